@@ -0,0 +1,18 @@
+"""
+ASGI config for cookiejwt project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Set ``COOKIE_JWT['ASYNC_VIEWS']`` to serve the token endpoints with the
+coroutine views from ``users.async_views``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cookiejwt.settings')
+
+application = get_asgi_application()
@@ -0,0 +1,17 @@
+"""
+ASGI config for the auth-only profile of cookiejwt project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+See ``cookiejwt.settings_auth``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cookiejwt.settings_auth')
+
+application = get_asgi_application()
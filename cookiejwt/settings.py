@@ -10,7 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
+import json
 import os
+import tempfile
 from datetime import timedelta
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -49,6 +51,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'users.middleware.CookieAuthenticationMiddleware',
+    'users.middleware.SlidingAccessTokenMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -72,17 +76,44 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'cookiejwt.wsgi.application'
+ASGI_APPLICATION = 'cookiejwt.asgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # django.db.backends.sqlite3 with WAL, tuned PRAGMAs and a single
+        # writer queue, see users/db/backends/sqlite_wal/base.py
+        'ENGINE': 'users.db.backends.sqlite_wal',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            'timeout': 5,
+            'pragmas': {
+                'busy_timeout': 5000,
+            },
+        },
     }
 }
 
+AUTHENTICATION_BACKENDS = [
+    'users.backends.HashingPoolModelBackend',
+]
+
+# the first hasher hashes new passwords, the others verify existing hashes
+# and are replaced by the first one on the next login. Overridden by
+# password_hashers.json when `tune_password_hashers --write` created it.
+PASSWORD_HASHERS = [
+    'users.hashers.PBKDF2PasswordHasher',
+    'users.hashers.ScryptPasswordHasher',
+    'users.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+
+PASSWORD_HASHERS_FILE = os.path.join(BASE_DIR, 'password_hashers.json')
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -128,7 +159,7 @@ REST_FRAMEWORK = {
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=5),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
-    'ROTATE_REFRESH_TOKENS': False,
+    'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
 
     'ALGORITHM': 'HS256',
@@ -146,3 +177,82 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_LIFETIME': timedelta(minutes=5),
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
 }
+
+COOKIE_JWT = {
+    'TOKEN_CACHE_ENABLED': False,
+    'TOKEN_CACHE_SIZE': 1024,
+    'TOKEN_CACHE_TTL': None,
+
+    'ASYNC_VIEWS': False,
+
+    'HASHING_POOL_WORKERS': os.cpu_count() or 1,
+    'HASHING_POOL_QUEUE_SIZE': 32,
+    'HASHING_POOL_RETRY_AFTER': 1,
+    'PASSWORD_HASHER_PARAMS': {},
+
+    'HMAC_VERIFIER_ENABLED': True,
+
+    # per process, fine for runserver. With several workers use
+    # 'users.denylist.CacheDenylistStore' on a shared, non-evicting cache
+    # (memcached or redis in CACHES), otherwise a rotated refresh token can be
+    # replayed against another worker
+    'DENYLIST_STORE': 'users.denylist.InMemoryDenylistStore',
+    'DENYLIST_STORE_OPTIONS': {},
+
+    # shared by the workers of one host, point it at a persistent directory
+    # (e.g. /var/lib/cookiejwt) in production, temp dirs may be cleaned up
+    'GENERATION_TABLE_PATH': os.environ.get('COOKIEJWT_GENERATION_TABLE_PATH',
+                                            os.path.join(tempfile.gettempdir(), 'cookiejwt-token-generations.bin')),
+    'GENERATION_TABLE_SLOTS': 65536,
+
+    'SLIDING_RENEWAL_THRESHOLD': 60,
+
+    'REFRESH_COALESCE_WINDOW': 2,
+    'REFRESH_COALESCE_SIZE': 10000,
+
+    # authorization data only, is_staff and is_superuser stay database backed
+    'USER_CLAIMS': ['groups', 'permissions'],
+    'CLAIMS_CACHE': 'users.claims.InMemoryClaimsCache',
+    'CLAIMS_CACHE_OPTIONS': {'max_size': 10000, 'ttl': 300},
+
+    'TOKEN_PROFILE': 'default',
+    'REFRESH_COOKIE_PATH': '/',
+    'COOKIE_SAMESITE': 'Strict',
+
+    'INTROSPECTION_MAX_TOKENS': 100,
+    # e.g. {'gateway': os.environ['COOKIEJWT_GATEWAY_SECRET']}, nobody may
+    # introspect tokens while empty
+    'INTROSPECTION_CLIENTS': {},
+
+    'METRICS_ENABLED': True,
+    # the scraper's address as the app server sees it, counters are per worker
+    # process so each scrape shows the process that answered it
+    'METRICS_ALLOWED_NETWORKS': ('127.0.0.1/32', '::1/128'),
+
+    'LOGIN_THROTTLE_RATES': {
+        'ip': (30, 0.5),
+        'username': (5, 1 / 60),
+    },
+    'LOGIN_THROTTLE_BACKEND': 'users.throttling.InMemoryTokenBucketLimiter',
+    'LOGIN_THROTTLE_OPTIONS': {},
+    # set to 1 behind a single nginx that appends $remote_addr to X-Forwarded-For
+    'LOGIN_THROTTLE_PROXIES': 0,
+
+    # a synchronous save per login unless write-behind is enabled, which the
+    # SQLite test database does not allow
+    'UPDATE_LAST_LOGIN': False,
+    'WRITE_BEHIND_ENABLED': False,
+    'WRITE_BEHIND_BATCH_SIZE': 100,
+    'WRITE_BEHIND_FLUSH_INTERVAL': 1.0,
+    'WRITE_BEHIND_MAX_PENDING': 10000,
+
+    'PRUNE_INTERVAL': 3600,
+    'PRUNE_CHUNK_SIZE': 1000,
+    'PRUNE_PAUSE': 0.05,
+}
+
+if os.path.exists(PASSWORD_HASHERS_FILE):
+    with open(PASSWORD_HASHERS_FILE) as f:
+        _tuned_hashers = json.load(f)
+    PASSWORD_HASHERS = _tuned_hashers['PASSWORD_HASHERS']
+    COOKIE_JWT['PASSWORD_HASHER_PARAMS'] = _tuned_hashers['PASSWORD_HASHER_PARAMS']
@@ -0,0 +1,48 @@
+"""
+Auth-only settings for cookiejwt project.
+
+Serves just the token endpoints from `users.urls` (or `users.async_urls`)
+without the admin, sessions, messages and static files apps and their
+middleware. Everything else, including `COOKIE_JWT` and `SIMPLE_JWT`, comes
+from `cookiejwt.settings`.
+
+Use with `cookiejwt.wsgi_auth` / `cookiejwt.asgi_auth` or
+`DJANGO_SETTINGS_MODULE=cookiejwt.settings_auth`.
+"""
+
+from cookiejwt.settings import *  # noqa: F401,F403
+from cookiejwt.settings import REST_FRAMEWORK
+
+# users.User needs auth and contenttypes, rest_framework provides the views
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'rest_framework',
+    'users'
+]
+
+# authentication is cookie JWT only, so no session or auth middleware.
+# CsrfViewMiddleware stays for any non-DRF view mounted later. DRF views are
+# csrf exempt exactly as in the full stack, the cookie authenticated POSTs
+# (refresh, revoke, clear) rely on COOKIE_JWT['COOKIE_SAMESITE'] = 'Strict',
+# which keeps the token cookies off cross-site requests.
+MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'users.middleware.CookieAuthenticationMiddleware',
+    'users.middleware.SlidingAccessTokenMiddleware',
+]
+
+ROOT_URLCONF = 'cookiejwt.urls_auth'
+
+# no template based views, error pages included
+TEMPLATES = []
+
+WSGI_APPLICATION = 'cookiejwt.wsgi_auth.application'
+ASGI_APPLICATION = 'cookiejwt.asgi_auth.application'
+
+# the browsable API needs templates and static files
+REST_FRAMEWORK = dict(REST_FRAMEWORK, DEFAULT_RENDERER_CLASSES=[
+    'rest_framework.renderers.JSONRenderer',
+])
@@ -16,7 +16,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from users.settings import cookie_settings
+from users.views import metrics
+
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('api/', include('users.urls'))
+    path('metrics', metrics, name='metrics'),
+    path('api/', include('users.async_urls' if cookie_settings.ASYNC_VIEWS else 'users.urls'))
 ]
@@ -0,0 +1,11 @@
+"""cookiejwt auth-only URL Configuration
+
+Used by `cookiejwt.settings_auth`, mounts only the token endpoints.
+"""
+from django.urls import path, include
+
+from users.settings import cookie_settings
+
+urlpatterns = [
+    path('api/', include('users.async_urls' if cookie_settings.ASYNC_VIEWS else 'users.urls'))
+]
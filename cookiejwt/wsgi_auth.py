@@ -0,0 +1,17 @@
+"""
+WSGI config for the auth-only profile of cookiejwt project.
+
+It exposes the WSGI callable as a module-level variable named ``application``.
+See ``cookiejwt.settings_auth``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.1/howto/deployment/wsgi/
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cookiejwt.settings_auth')
+
+application = get_wsgi_application()
@@ -1,5 +1,28 @@
 from django.contrib import admin
+from users.generations import GenerationTableFull, get_generation_table, revoke_user_tokens
 from users.models import User
 
+
+class UserAdmin(admin.ModelAdmin):
+    actions = ['revoke_tokens']
+
+    def revoke_tokens(self, request, queryset):
+        if get_generation_table() is None:
+            self.message_user(request, "Token generation table is not configured.", level='error')
+            return
+
+        count = 0
+        for user in queryset.iterator():
+            try:
+                revoke_user_tokens(user)
+            except GenerationTableFull:
+                self.message_user(request, "Logged out {} user(s) everywhere, the token generation table is full, "
+                                           "raise GENERATION_TABLE_SLOTS.".format(count), level='error')
+                return
+            count += 1
+        self.message_user(request, "Logged out {} user(s) everywhere.".format(count))
+    revoke_tokens.short_description = "Log out selected users everywhere"
+
+
 # Register your models here.
-admin.site.register(User)
+admin.site.register(User, UserAdmin)
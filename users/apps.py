@@ -3,3 +3,11 @@ from django.apps import AppConfig
 
 class UsersConfig(AppConfig):
     name = 'users'
+
+    def ready(self):
+        from users.claims import connect_claims_signals
+        from users.keyring import install_token_backend
+        from users.pruning import start_pruning_thread
+        connect_claims_signals()
+        install_token_backend()
+        start_pruning_thread()
@@ -0,0 +1,16 @@
+from django.urls import path
+
+from users.async_views import (
+    cookie_token_verify, cookie_token_obtain_pair, cookie_token_refresh, cookie_token_clear, cookie_token_revoke,
+    cookie_token_introspect, cookie_token_jwks,
+)
+
+urlpatterns = [
+    path('token/verify', cookie_token_verify, name='token_verify'),
+    path('token', cookie_token_obtain_pair, name='token_obtain'),
+    path('token/refresh', cookie_token_refresh, name='token_refresh'),
+    path('token/clear', cookie_token_clear, name='token_clear'),
+    path('token/revoke', cookie_token_revoke, name='token_revoke'),
+    path('token/introspect', cookie_token_introspect, name='token_introspect'),
+    path('token/jwks', cookie_token_jwks, name='token_jwks')
+]
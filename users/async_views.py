@@ -0,0 +1,236 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.db import close_old_connections
+from django.http import HttpResponse, HttpResponseNotAllowed
+from rest_framework import exceptions, status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.views import exception_handler
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+from users.authentication import CookieAccessTokenAuthentication, IntrospectionClientAuthentication
+from users.cookies import delete_token_cookies
+from users.generations import revoke_user_tokens
+from users.hashing import HashingPoolFull
+from users.introspection import introspect_tokens
+from users.metrics import COOKIE_SERIALIZATION_SECONDS, instrument_async_view, timer
+from users.renderers import EMPTY_JSON_BODY, json_body
+from users.serializers import TokenIntrospectionSerializer
+from users.throttling import LoginRateThrottle, refund_login_attempt
+from users.views import (
+    CookieTokenObtainPair, CookieTokenRefresh, jwks_response, set_obtain_pair_cookies, set_refresh_cookies,
+)
+
+# Async counterparts of the views in `users.views`. DRF views are synchronous,
+# so these are plain Django coroutine views sharing the same serializers and
+# cookie helpers. Everything that may block, the credentials check (password
+# hashing and user lookup), refresh (denylist store, claims lookups and
+# waiting for a coalesced refresh), revocation and introspection, runs on
+# asgiref's thread pool. Access token verification runs inline.
+
+
+def call_with_connections(func, *args, **kwargs):
+    # pool threads keep their own database connections, expire them like
+    # request_started and request_finished do for sync views
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Runs `func` off the event loop. Not thread sensitive, so concurrent logins
+    do not queue on asgiref's single shared thread but reach the hashing pool
+    together.
+    """
+    return await sync_to_async(call_with_connections, thread_sensitive=False)(func, *args, **kwargs)
+
+
+def exception_response(exc):
+    response = exception_handler(exc, {})
+    if response is None:
+        raise exc
+
+    error_response = HttpResponse(JSONRenderer().render(response.data), status=response.status_code,
+                                  content_type='application/json')
+    for header, value in response.items():
+        # the unrendered Response still carries HttpResponse's text/html default
+        if header.lower() != 'content-type':
+            error_response[header] = value
+
+    if error_response.status_code == status.HTTP_401_UNAUTHORIZED and not error_response.has_header('WWW-Authenticate'):
+        error_response['WWW-Authenticate'] = CookieAccessTokenAuthentication().authenticate_header(None)
+
+    return error_response
+
+
+def json_response(data=None, body=None):
+    # the bytes the sync views send: json_body for the LeanJSONMixin views,
+    # JSONRenderer output for the plain DRF ones
+    return HttpResponse(json_body(data) if body is None else body, content_type='application/json')
+
+
+def parse_json_body(request):
+    if not request.body:
+        return {}
+
+    try:
+        return json.loads(request.body)
+    except ValueError as e:
+        raise exceptions.ParseError('JSON parse error - %s' % e)
+
+
+@instrument_async_view('verify')
+async def cookie_token_verify(request):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    try:
+        auth = CookieAccessTokenAuthentication().authenticate(request)
+        if auth is None:
+            raise exceptions.NotAuthenticated()
+    except exceptions.APIException as e:
+        return exception_response(e)
+
+    user, _ = auth
+    return json_response({
+        'user_id': user.id
+    })
+
+
+def check_login(request, serializer, username):
+    """
+    Login throttle, credentials check and the refund of a successful attempt
+    as one thread pool job, the limiters may be cache round trips.
+    """
+    throttle = LoginRateThrottle()
+    if not throttle.allow_login(request, username):
+        raise exceptions.Throttled(throttle.wait())
+
+    try:
+        serializer.is_valid(raise_exception=True)
+    except HashingPoolFull:
+        # the password was never checked, the attempt must not count
+        refund_login_attempt(request)
+        raise
+    refund_login_attempt(request)
+
+
+@instrument_async_view('obtain')
+async def cookie_token_obtain_pair(request):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    try:
+        data = parse_json_body(request)
+        username = data.get(get_user_model().USERNAME_FIELD) if isinstance(data, dict) else None
+        serializer = CookieTokenObtainPair.serializer_class(data=data, context={'request': request})
+        try:
+            # credentials check hashes the password and queries the database
+            await run_blocking(check_login, request, serializer, username)
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+    except exceptions.APIException as e:
+        return exception_response(e)
+
+    response = json_response(body=b'')
+    with timer(COOKIE_SERIALIZATION_SECONDS, view='obtain'):
+        response.content = json_body(set_obtain_pair_cookies(response, serializer.validated_data))
+    return response
+
+
+@instrument_async_view('refresh')
+async def cookie_token_refresh(request):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    try:
+        serializer = CookieTokenRefresh.serializer_class(data={
+            'refresh': request.COOKIES.get('refresh_token', None)
+        })
+        try:
+            await run_blocking(serializer.is_valid, raise_exception=True)
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+    except exceptions.APIException as e:
+        return exception_response(e)
+
+    response = json_response(body=b'')
+    with timer(COOKIE_SERIALIZATION_SECONDS, view='refresh'):
+        response.content = json_body(set_refresh_cookies(response, serializer.validated_data))
+    return response
+
+
+@instrument_async_view('clear')
+async def cookie_token_clear(request):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    response = HttpResponse(EMPTY_JSON_BODY, content_type='application/json')
+    with timer(COOKIE_SERIALIZATION_SECONDS, view='clear'):
+        delete_token_cookies(response)
+    return response
+
+
+async def cookie_token_revoke(request):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    try:
+        auth = CookieAccessTokenAuthentication().authenticate(request)
+        if auth is None:
+            raise exceptions.NotAuthenticated()
+        await run_blocking(revoke_user_tokens, auth[0])
+    except exceptions.APIException as e:
+        return exception_response(e)
+
+    response = json_response(body=EMPTY_JSON_BODY)
+    delete_token_cookies(response)
+    return response
+
+
+async def cookie_token_introspect(request):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    authentication = IntrospectionClientAuthentication()
+    try:
+        try:
+            if authentication.authenticate(request) is None:
+                raise exceptions.NotAuthenticated()
+        except (exceptions.NotAuthenticated, exceptions.AuthenticationFailed) as e:
+            e.auth_header = authentication.authenticate_header(request)
+            raise
+
+        serializer = TokenIntrospectionSerializer(data=parse_json_body(request))
+        serializer.is_valid(raise_exception=True)
+    except exceptions.APIException as e:
+        return exception_response(e)
+
+    results = await run_blocking(introspect_tokens, serializer.validated_data['tokens'],
+                                 serializer.validated_data['token_type'])
+    return json_response(body=JSONRenderer().render({
+        'results': results
+    }))
+
+
+async def cookie_token_jwks(request):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    return jwks_response()
+
+
+# token endpoints manage the cookies themselves
+for view in (cookie_token_obtain_pair, cookie_token_refresh, cookie_token_clear, cookie_token_revoke,
+             cookie_token_introspect, cookie_token_jwks):
+    view.sliding_renewal = False
+
+# like DRF views, token endpoints rely on the cookies alone and are exempt from
+# the CSRF middleware (`csrf_exempt` would hide the coroutine from Django)
+for view in (cookie_token_verify, cookie_token_obtain_pair, cookie_token_refresh, cookie_token_clear,
+             cookie_token_revoke, cookie_token_introspect, cookie_token_jwks):
+    view.csrf_exempt = True
@@ -0,0 +1,263 @@
+import hashlib
+import json
+import math
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt import state
+from rest_framework_simplejwt.exceptions import TokenBackendError
+from rest_framework_simplejwt.settings import api_settings
+
+from users.authentication import failure_reason
+from users.introspection import AUTHENTICATION_CLASSES, error_message
+from users.tokens import get_access_token_class, get_refresh_token_class
+
+
+def parse_line(line, field='token'):
+    """
+    Raw token of one JSONL input line, either a JSON string or an object
+    holding the token under `field`. Returns None for unusable lines.
+    """
+    line = line.strip()
+    if not line:
+        return None
+
+    try:
+        value = json.loads(line)
+    except ValueError:
+        return None
+
+    if isinstance(value, dict):
+        value = value.get(field)
+    return value if isinstance(value, str) and value else None
+
+
+# 9999-12-31T23:59:59Z, the last second a datetime can hold
+MAX_EPOCH_SECONDS = 253402300799
+
+
+def epoch_seconds(value):
+    """
+    Returns `value` when it is a time stamp a datetime can hold, else None.
+    Unverified claims may be any JSON value, including Infinity and NaN.
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return value if 0 <= value <= MAX_EPOCH_SECONDS else None
+
+
+def detect_token_type(payload):
+    token_type = payload.get(api_settings.TOKEN_TYPE_CLAIM)
+    if token_type == get_refresh_token_class().token_type:
+        return 'refresh'
+    return 'access'
+
+
+def audit_token(raw_token, token_type='auto', now=None):
+    """
+    Validates a raw token exactly like the cookie authentication classes and
+    returns its verdict. Claims are decoded without verification so invalid
+    tokens can still be attributed to a user and issue time.
+    """
+    now = time.time() if now is None else now
+
+    try:
+        payload = state.token_backend.decode(raw_token, verify=False)
+    except TokenBackendError:
+        return {'valid': False, 'reason': 'malformed', 'error': 'Token is invalid or expired'}
+
+    if token_type == 'auto':
+        token_type = detect_token_type(payload)
+    token_class = get_refresh_token_class() if token_type == 'refresh' else get_access_token_class()
+
+    exp = epoch_seconds(payload.get('exp'))
+    issued_at = epoch_seconds(payload.get('iat'))
+    if issued_at is None and exp is not None:
+        # simplejwt does not set iat, every token of a type has the same lifetime
+        issued_at = epoch_seconds(int(exp - token_class.lifetime.total_seconds()))
+
+    verdict = {
+        'token_type': token_type,
+        'user_id': payload.get(api_settings.USER_ID_CLAIM),
+        'jti': payload.get(api_settings.JTI_CLAIM),
+        'issued_at': issued_at,
+        'exp': exp,
+    }
+
+    if exp is None and payload.get('exp') is not None:
+        # simplejwt cannot turn such an exp into a datetime and would raise
+        verdict.update(valid=False, reason='invalid', error="Token has an invalid 'exp' claim")
+        return verdict
+
+    backend = AUTHENTICATION_CLASSES[token_type]()
+    try:
+        validated_token = backend.get_validated_token(raw_token)
+    except AuthenticationFailed as e:
+        verdict.update(valid=False, reason=failure_reason(raw_token, token_class.token_type),
+                       error=error_message(e))
+        return verdict
+
+    try:
+        backend.check_token(validated_token)
+    except AuthenticationFailed as e:
+        verdict.update(valid=False, reason='revoked', error=error_message(e))
+        return verdict
+
+    verdict.update(valid=True, reason='valid', expires_in=max(int(validated_token['exp'] - now), 0))
+    return verdict
+
+
+def audit_chunk(chunk, token_type='auto', field='token'):
+    """
+    Audits a list of (line number, raw line) pairs, runs in pool workers.
+    """
+    now = time.time()
+    verdicts = []
+    for lineno, line in chunk:
+        raw_token = parse_line(line, field)
+        if raw_token is None:
+            verdict = {'valid': False, 'reason': 'unreadable', 'error': 'No token on this line'}
+        else:
+            verdict = audit_token(raw_token, token_type, now)
+        verdict['line'] = lineno
+        verdicts.append(verdict)
+    return verdicts
+
+
+def iter_chunks(lines, chunk_size):
+    numbered = enumerate(lines, 1)
+    while True:
+        chunk = list(islice(numbered, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def audit_stream(lines, token_type='auto', field='token', workers=0, chunk_size=1000, mp_context=None):
+    """
+    Yields one verdict per input line, in input order. With `workers` the
+    chunks are audited by a process pool, at most two chunks per worker are
+    read ahead so memory stays bounded however long the input is.
+    """
+    chunks = iter_chunks(lines, chunk_size)
+
+    if not workers:
+        for chunk in chunks:
+            yield from audit_chunk(chunk, token_type, field)
+        return
+
+    # spawned and forkserver workers start from a fresh interpreter with only
+    # DJANGO_SETTINGS_MODULE, forked ones just repeat the set up. The
+    # initializer must not live in a module that needs the app registry.
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=django.setup) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(audit_chunk, chunk, token_type, field))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+class TopCounter:
+    """
+    Counts of the most frequent keys in bounded memory. Once `capacity * 2`
+    keys are tracked all but the `capacity` most frequent are dropped, so a
+    key that only becomes frequent late in the stream may be undercounted.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = Counter()
+
+    def add(self, key):
+        self.counts[key] += 1
+        if len(self.counts) >= self.capacity * 2:
+            self.counts = Counter(dict(self.counts.most_common(self.capacity)))
+
+    def most_common(self, n):
+        return self.counts.most_common(n)
+
+
+class DistinctCounter:
+    """
+    Linear counting estimate of the number of distinct keys in a fixed
+    bitmap, within a few percent up to several times `size` keys.
+    """
+
+    def __init__(self, size=2 ** 20):
+        self.size = size
+        self.bits = bytearray(size // 8)
+
+    def add(self, key):
+        position = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little') % self.size
+        self.bits[position >> 3] |= 1 << (position & 7)
+
+    def estimate(self):
+        zeros = self.size - sum(bin(byte).count('1') for byte in self.bits)
+        if not zeros:
+            return None
+        return int(round(-self.size * math.log(zeros / self.size)))
+
+
+class AuditStats:
+    """
+    Aggregates verdicts: counts per reason and token type, per user (only
+    the `top_users` most frequent are reported) and per issue time bucket.
+    Memory is bounded: per user counts are kept for a bounded set of
+    frequent users, distinct users are estimated and issue times are taken
+    from unverified claims, so past `max_buckets` buckets tokens of new
+    buckets are only counted as `issued_unbucketed`.
+    """
+
+    def __init__(self, bucket_seconds=3600, top_users=20, max_buckets=10000):
+        self.bucket_seconds = bucket_seconds
+        self.top_users = top_users
+        self.max_buckets = max_buckets
+        self.total = 0
+        self.reasons = Counter()
+        self.token_types = Counter()
+        self.distinct_users = DistinctCounter()
+        self.users = TopCounter(max(top_users * 10, 1000))
+        self.invalid_users = TopCounter(max(top_users * 10, 1000))
+        self.issued = Counter()
+        self.issued_unbucketed = 0
+
+    def add(self, verdict):
+        self.total += 1
+        self.reasons[verdict['reason']] += 1
+        if 'token_type' in verdict:
+            self.token_types[verdict['token_type']] += 1
+
+        user_id = verdict.get('user_id')
+        if user_id is not None:
+            self.distinct_users.add(str(user_id))
+            self.users.add(str(user_id))
+            if not verdict['valid']:
+                self.invalid_users.add(str(user_id))
+
+        issued_at = epoch_seconds(verdict.get('issued_at'))
+        if issued_at is not None:
+            bucket = int(issued_at // self.bucket_seconds * self.bucket_seconds)
+            if bucket in self.issued or len(self.issued) < self.max_buckets:
+                self.issued[bucket] += 1
+            else:
+                self.issued_unbucketed += 1
+
+    def summary(self):
+        return {
+            'total': self.total,
+            'valid': self.reasons['valid'],
+            'reasons': dict(self.reasons.most_common()),
+            'token_types': dict(self.token_types.most_common()),
+            'distinct_users': self.distinct_users.estimate(),
+            'top_users': dict(self.users.most_common(self.top_users)),
+            'top_invalid_users': dict(self.invalid_users.most_common(self.top_users)),
+            'issued_per_bucket': {str(bucket): count for bucket, count in sorted(self.issued.items())},
+            'issued_unbucketed': self.issued_unbucketed,
+            'bucket_seconds': self.bucket_seconds,
+        }
@@ -1,23 +1,243 @@
+import hmac
+import time
+from http import cookies
+
+from django.contrib.auth.models import AnonymousUser
+from django.utils.functional import SimpleLazyObject
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import BasicAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt import state
 from rest_framework_simplejwt.authentication import JWTTokenUserAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenBackendError, TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from users.cache import get_token_cache
+from users.claims import ClaimsTokenUser
+from users.denylist import check_denylist
+from users.generations import check_generation
+from users.metrics import AUTHENTICATION_TOTAL, TOKEN_DECODE_SECONDS, inc, metrics_enabled, timer
+from users.settings import cookie_settings
+from users.tokens import get_access_token_class, get_refresh_token_class
+
+
+def failure_reason(raw_token, expected_type):
+    """
+    Tells apart why a token failed validation, used for metrics and token audits.
+    """
+    try:
+        payload = state.token_backend.decode(raw_token, verify=False)
+    except TokenBackendError:
+        return 'malformed'
+
+    try:
+        if float(payload['exp']) <= time.time():
+            return 'expired'
+    except (KeyError, TypeError, ValueError):
+        return 'invalid'
+
+    if expected_type is not None and payload.get(api_settings.TOKEN_TYPE_CLAIM) != expected_type:
+        return 'wrong_type'
+    return 'bad_signature'
 
 
-class CookieAccessTokenAuthentication(JWTTokenUserAuthentication):
+def get_cookie(request, name):
+    """
+    Value of cookie `name` as `request.COOKIES` holds it, picked out of the
+    raw Cookie header without parsing every other cookie, unless Django has
+    parsed them already.
+    """
+    request = getattr(request, '_request', request)
+    if 'COOKIES' in request.__dict__:
+        return request.COOKIES.get(name)
+
+    header = request.META.get('HTTP_COOKIE', '')
+    if name not in header:
+        return None
+    if not header.isascii():
+        # WSGI and ASGI decode non-ASCII headers differently, leave it to Django
+        return request.COOKIES.get(name)
+
+    # the last occurrence wins, like in django.http.parse_cookie
+    for chunk in reversed(header.split(';')):
+        key, separator, value = chunk.partition('=')
+        if separator and key.strip() == name:
+            return cookies._unquote(value.strip())
+    return None
+
+
+class CookieTokenAuthentication(JWTTokenUserAuthentication):
+    cookie_name = None
 
     def authenticate(self, request):
-        raw_token = request.COOKIES.get('access_token', None)
+        """
+        Authenticates the request by its cookie. Behind
+        CookieAuthenticationMiddleware every outcome, failures included, is
+        kept on the request so a token is validated once per request.
+        """
+        raw_token = get_cookie(request, self.cookie_name)
+        results = getattr(request, '_cookiejwt_auth', None)
+        if results is None:
+            return self.authenticate_token(raw_token)
+
+        key = (type(self), raw_token)
+        if key not in results:
+            try:
+                results[key] = (self.authenticate_token(raw_token), None)
+            except AuthenticationFailed as e:
+                results[key] = (None, e)
+
+        auth, error = results[key]
+        if error is not None:
+            raise error
+        return auth
+
+    def authenticate_token(self, raw_token):
         if raw_token is None:
+            inc(AUTHENTICATION_TOTAL, cookie=self.cookie_name, outcome='missing_cookie')
             return None
 
-        validated_token = self.get_validated_token(raw_token)
+        try:
+            with timer(TOKEN_DECODE_SECONDS, cookie=self.cookie_name):
+                validated_token = self.get_validated_token(raw_token)
+        except InvalidToken:
+            if metrics_enabled():
+                token_class = self.get_token_class() or api_settings.AUTH_TOKEN_CLASSES[0]
+                inc(AUTHENTICATION_TOTAL, cookie=self.cookie_name,
+                    outcome=failure_reason(raw_token, token_class.token_type))
+            raise
+
+        try:
+            self.check_token(validated_token)
+        except InvalidToken:
+            inc(AUTHENTICATION_TOTAL, cookie=self.cookie_name, outcome='revoked')
+            raise
+
+        inc(AUTHENTICATION_TOTAL, cookie=self.cookie_name, outcome='success')
         return self.get_user(validated_token), None
 
+    def get_user(self, validated_token):
+        return ClaimsTokenUser(validated_token)
 
-class CookieRefreshTokenAuthentication(JWTTokenUserAuthentication):
+    def get_token_class(self):
+        """
+        Token class of the configured profile, None validates against
+        SIMPLE_JWT['AUTH_TOKEN_CLASSES'].
+        """
+        return None
 
-    def authenticate(self, request):
-        raw_token = request.COOKIES.get('refresh_token', None)
-        if raw_token is None:
+    def validate_token(self, raw_token):
+        token_class = self.get_token_class()
+        if token_class is None:
+            return super().get_validated_token(raw_token)
+
+        try:
+            return token_class(raw_token)
+        except TokenError as e:
+            raise InvalidToken({
+                'detail': _('Given token not valid for any token type'),
+                'messages': [{'token_class': token_class.__name__,
+                              'token_type': token_class.token_type,
+                              'message': e.args[0]}],
+            })
+
+    def get_validated_token(self, raw_token):
+        cache = get_token_cache()
+        if cache is None:
+            return self.validate_token(raw_token)
+
+        # scoped by cookie, a refresh token validated once is no access token
+        validated_token = cache.get(raw_token, scope=self.cookie_name)
+        if validated_token is None:
+            validated_token = self.validate_token(raw_token)
+            cache.set(raw_token, validated_token, scope=self.cookie_name)
+
+        return validated_token
+
+    def check_token(self, validated_token):
+        """
+        Revocation checks, run on every request including cache hits.
+        """
+        try:
+            check_generation(validated_token)
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+
+
+class CookieAccessTokenAuthentication(CookieTokenAuthentication):
+    cookie_name = 'access_token'
+
+    def get_token_class(self):
+        if cookie_settings.TOKEN_PROFILE == 'default':
             return None
+        return get_access_token_class()
 
-        validated_token = self.get_validated_token(raw_token)
-        return self.get_user(validated_token), None
+
+class CookieRefreshTokenAuthentication(CookieTokenAuthentication):
+    cookie_name = 'refresh_token'
+
+    def get_token_class(self):
+        return get_refresh_token_class()
+
+    def check_token(self, validated_token):
+        super().check_token(validated_token)
+        try:
+            check_denylist(validated_token)
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+
+
+def get_cookie_user(request):
+    # a session login (the admin's) is a database user and wins over the token
+    fallback = getattr(request, '_cookiejwt_fallback_user', None)
+    if fallback is not None and fallback.is_authenticated:
+        return fallback
+
+    try:
+        auth = CookieAccessTokenAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        auth = None
+
+    if auth is not None:
+        return auth[0]
+    return AnonymousUser() if fallback is None else fallback
+
+
+def attach_cookie_user(request):
+    """
+    Sets `request.user` to the user of the access token cookie, resolved on
+    first use.
+    """
+    request.user = SimpleLazyObject(lambda: get_cookie_user(request))
+
+
+class IntrospectionClient:
+    """
+    Caller authenticated by its introspection client credentials.
+    """
+    is_authenticated = True
+    is_anonymous = False
+    is_staff = False
+
+    def __init__(self, client_id):
+        self.client_id = client_id
+
+    def __str__(self):
+        return self.client_id
+
+
+class IntrospectionClientAuthentication(BasicAuthentication):
+    """
+    HTTP Basic authentication of the clients in
+    COOKIE_JWT['INTROSPECTION_CLIENTS'] (client id to secret), the client
+    authentication RFC 7662 asks of introspection callers.
+    """
+    www_authenticate_realm = 'introspection'
+
+    def authenticate_credentials(self, userid, password, request=None):
+        secret = cookie_settings.INTROSPECTION_CLIENTS.get(userid)
+        # compared for unknown clients too, so both fail in the same time
+        matches = hmac.compare_digest((secret or '').encode('utf-8'), password.encode('utf-8'))
+        if not secret or not matches:
+            raise AuthenticationFailed(_('Invalid client credentials.'))
+        return IntrospectionClient(userid), None
@@ -0,0 +1,58 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import check_password, identify_hasher, make_password
+
+from users.hashing import run_hasher
+from users.metrics import PASSWORD_REHASH_TOTAL, USER_LOOKUP_SECONDS, inc, timer
+
+UserModel = get_user_model()
+
+
+class HashingPoolModelBackend(ModelBackend):
+    """
+    ModelBackend which runs the password hasher on the bounded hashing pool,
+    the user lookup and any rehash write stay on the request thread.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+
+        try:
+            with timer(USER_LOOKUP_SECONDS):
+                user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # Run the default password hasher once to reduce the timing
+            # difference between an existing and a nonexistent user (#20760).
+            run_hasher(make_password, password)
+            return None
+
+        if self.check_password(user, password) and self.user_can_authenticate(user):
+            return user
+
+    def check_password(self, user, raw_password):
+        # one pool job, a rehash must not be turned away by a full pool after
+        # the password was accepted
+        valid, encoded = run_hasher(verify_and_rehash, raw_password, user.password)
+
+        if encoded is not None:
+            # hasher or its parameters changed, store an up to date hash
+            inc(PASSWORD_REHASH_TOTAL, algorithm=identify_hasher(user.password).algorithm)
+            user.password = encoded
+            user.save(update_fields=['password'])
+
+        return valid
+
+
+def verify_and_rehash(raw_password, encoded):
+    """
+    Checks `raw_password` against `encoded` and returns whether it matched
+    and, when the hash is outdated, its replacement.
+    """
+    outdated = []
+    valid = check_password(raw_password, encoded, outdated.append)
+    if valid and outdated:
+        return True, make_password(raw_password)
+    return valid, None
@@ -0,0 +1,470 @@
+import http.client
+import json
+import math
+import threading
+import time
+import zlib
+from http import cookies
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.wsgi import get_wsgi_application
+from django.db import OperationalError, close_old_connections, connections, transaction
+from django.test import Client, RequestFactory
+from django.utils import timezone
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.response import Response
+from rest_framework.settings import api_settings as drf_settings
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from users.db import write_atomic
+
+ENDPOINTS = ('token', 'token/refresh', 'token/verify', 'token/clear')
+
+BENCH_USERNAME = 'bench-user-{}'
+BENCH_PASSWORD = 'bench-password'
+
+
+class InProcessClient:
+    """
+    Drives the WSGI handler directly through the Django test client.
+    """
+
+    def __init__(self, host='localhost'):
+        self.client = Client(HTTP_HOST=host)
+
+    def request(self, method, path, body=None, cookie_header=None):
+        extra = {}
+        if cookie_header:
+            extra['HTTP_COOKIE'] = cookie_header
+
+        response = self.client.generic(method, path, body or '', content_type='application/json', **extra)
+        return response.status_code, response.cookies
+
+    def close(self):
+        close_old_connections()
+
+
+class SocketClient:
+    """
+    Talks HTTP over a local socket to an already running server.
+    """
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self.connection = None
+
+    def request(self, method, path, body=None, cookie_header=None):
+        headers = {'Content-Type': 'application/json'}
+        if cookie_header:
+            headers['Cookie'] = cookie_header
+
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            try:
+                self.connection.request(method, self.prefix + path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                response.read()
+                break
+            except (ConnectionError, http.client.HTTPException):
+                # server closed the keep-alive connection, reconnect once
+                self.close()
+                if attempt:
+                    raise
+
+        jar = cookies.SimpleCookie()
+        for header in response.headers.get_all('Set-Cookie') or ():
+            jar.load(header)
+
+        if response.getheader('Connection', '').lower() == 'close' or response.version < 11:
+            self.close()
+
+        return response.status, jar
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+def start_local_server(host='127.0.0.1', port=0):
+    """
+    Serves the project WSGI application on a background thread, returns the
+    server and its base URL.
+    """
+    server = make_server(host, port, get_wsgi_application(),
+                         server_class=ThreadingWSGIServer, handler_class=QuietRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, name='cookiejwt-benchmark-server', daemon=True)
+    thread.start()
+    return server, 'http://{}:{}'.format(*server.server_address)
+
+
+def bench_password(username, passwords=1):
+    """
+    Deterministic password of a benchmark user, one of `passwords` variants.
+    """
+    if passwords <= 1:
+        return BENCH_PASSWORD
+    return '{}-{}'.format(BENCH_PASSWORD, zlib.crc32(username.encode('utf-8')) % passwords)
+
+
+def create_bench_users(count, passwords=1, batch_size=1000, progress=None):
+    """
+    Creates the missing benchmark users 0..count-1 in `batch_size` chunks.
+    Every password variant is hashed once and its encoded hash shared by all
+    users having it, so the cost is `passwords` hashes plus one bulk insert
+    per chunk. `progress` is called with (users done, created) after every
+    chunk. Returns the number of users created.
+    """
+    User = get_user_model()
+    encoded = {}
+    created = 0
+
+    for start in range(0, count, batch_size):
+        usernames = [BENCH_USERNAME.format(i) for i in range(start, min(start + batch_size, count))]
+        existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+
+        users = []
+        for username in usernames:
+            if username in existing:
+                continue
+            password = bench_password(username, passwords)
+            if password not in encoded:
+                encoded[password] = make_password(password)
+            users.append(User(username=username, password=encoded[password]))
+
+        with transaction.atomic():
+            User.objects.bulk_create(users, batch_size=batch_size)
+        created += len(users)
+
+        if progress is not None:
+            progress(start + len(usernames), created)
+
+    return created
+
+
+def ensure_bench_users(count, passwords=1):
+    """
+    Creates the missing benchmark users and returns all their usernames.
+    """
+    create_bench_users(count, passwords)
+    return [BENCH_USERNAME.format(i) for i in range(count)]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    # nearest rank
+    rank = max(math.ceil(pct / 100.0 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(endpoint, latencies, statuses, elapsed):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'endpoint': endpoint,
+        'requests': count,
+        'errors': sum(n for code, n in statuses.items() if code >= 400),
+        'statuses': {str(code): n for code, n in sorted(statuses.items())},
+        'elapsed': elapsed,
+        'throughput': count / elapsed if elapsed else None,
+        'latency_ms': {
+            'mean': sum(latencies) / count * 1000 if count else None,
+            'p50': _ms(percentile(latencies, 50)),
+            'p95': _ms(percentile(latencies, 95)),
+            'p99': _ms(percentile(latencies, 99)),
+            'max': _ms(latencies[-1] if latencies else None),
+        },
+    }
+
+
+def _ms(value):
+    return None if value is None else value * 1000
+
+
+class TokenBenchmark:
+    """
+    Drives the /api/token* endpoints from `concurrency` threads, each thread
+    owning a client created by `client_factory` and cycling through the
+    benchmark users.
+    """
+
+    def __init__(self, client_factory, usernames, prefix='/api/', concurrency=1, requests=100, passwords=1):
+        self.client_factory = client_factory
+        self.usernames = usernames
+        self.passwords = passwords
+        self.prefix = prefix
+        self.concurrency = concurrency
+        self.requests = requests
+        self.sessions = {}
+
+    def login_body(self, username):
+        return json.dumps({'username': username, 'password': bench_password(username, self.passwords),
+                           'remember': False})
+
+    def prepare_sessions(self):
+        client = self.client_factory()
+        try:
+            for username in self.usernames:
+                status, jar = client.request('POST', self.prefix + 'token', self.login_body(username))
+                if status != 200:
+                    raise RuntimeError('Benchmark login for {} failed with status {}'.format(username, status))
+                self.sessions[username] = {}
+                self.update_session(username, jar)
+        finally:
+            client.close()
+
+    def update_session(self, username, jar):
+        for name in ('access_token', 'refresh_token'):
+            if name in jar:
+                self.sessions[username][name] = jar[name].value
+
+    def build_request(self, endpoint, username):
+        session = self.sessions[username]
+        if endpoint == 'token':
+            return 'POST', self.login_body(username), None
+        if endpoint == 'token/refresh':
+            return 'POST', None, 'refresh_token=' + session['refresh_token']
+        if endpoint == 'token/verify':
+            return 'GET', None, 'access_token=' + session['access_token']
+        return 'POST', None, 'access_token={}; refresh_token={}'.format(session['access_token'],
+                                                                        session['refresh_token'])
+
+    def run_endpoint(self, endpoint):
+        latencies = []
+        statuses = {}
+        lock = threading.Lock()
+        counter = iter(range(self.requests))
+        path = self.prefix + endpoint
+
+        def worker(usernames):
+            # every thread owns its users, rotated refresh tokens are never
+            # replayed by another thread
+            client = self.client_factory()
+            local_latencies = []
+            local_statuses = {}
+            try:
+                while True:
+                    with lock:
+                        i = next(counter, None)
+                    if i is None:
+                        break
+
+                    username = usernames[i % len(usernames)]
+                    method, body, cookie_header = self.build_request(endpoint, username)
+                    started = time.perf_counter()
+                    status, jar = client.request(method, path, body, cookie_header)
+                    local_latencies.append(time.perf_counter() - started)
+                    local_statuses[status] = local_statuses.get(status, 0) + 1
+
+                    if endpoint == 'token/refresh' and status == 200:
+                        self.update_session(username, jar)
+            finally:
+                client.close()
+                with lock:
+                    latencies.extend(local_latencies)
+                    for status, n in local_statuses.items():
+                        statuses[status] = statuses.get(status, 0) + n
+
+        threads = [threading.Thread(target=worker, args=(self.usernames[k::self.concurrency],))
+                   for k in range(min(self.concurrency, len(self.usernames)))]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return summarize(endpoint, latencies, statuses, time.perf_counter() - started)
+
+    def run(self, endpoints=ENDPOINTS):
+        self.prepare_sessions()
+        return [self.run_endpoint(endpoint) for endpoint in endpoints]
+
+
+class DatabaseBenchmark:
+    """
+    Replays the database side of logins from `concurrency` threads: a user
+    lookup by username and, for `write_ratio` of them, a transaction that
+    reloads the user and saves its last_login. Operations failing with
+    "database is locked" are counted with status 503, successful ones 200.
+    """
+
+    def __init__(self, usernames, concurrency=4, operations=1000, write_ratio=0.5):
+        self.usernames = usernames
+        self.concurrency = concurrency
+        self.operations = operations
+        self.write_ratio = write_ratio
+
+    def operation(self, username, write):
+        User = get_user_model()
+        user = User._default_manager.get_by_natural_key(username)
+        if write:
+            # reads before it writes, so it has to begin as a write transaction
+            with write_atomic():
+                user = User._default_manager.get(pk=user.pk)
+                user.last_login = timezone.now()
+                user.save(update_fields=['last_login'])
+
+    def run(self):
+        latencies = []
+        statuses = {}
+        lock = threading.Lock()
+        write_every = round(1 / self.write_ratio) if self.write_ratio else 0
+
+        def worker(k):
+            local_latencies = []
+            local_statuses = {}
+            try:
+                for i in range(k, self.operations, self.concurrency):
+                    username = self.usernames[i % len(self.usernames)]
+                    started = time.perf_counter()
+                    try:
+                        self.operation(username, write_every and i % write_every == 0)
+                        status = 200
+                    except OperationalError:
+                        status = 503
+                    local_latencies.append(time.perf_counter() - started)
+                    local_statuses[status] = local_statuses.get(status, 0) + 1
+            finally:
+                connections.close_all()
+
+            with lock:
+                latencies.extend(local_latencies)
+                for status, n in local_statuses.items():
+                    statuses[status] = statuses.get(status, 0) + n
+
+        threads = [threading.Thread(target=worker, args=(k,)) for k in range(self.concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return summarize('lookup+login write', latencies, statuses, time.perf_counter() - started)
+
+
+class DRFResponseMixin:
+    """
+    Puts back DRF's default renderers, content negotiation and Response on a
+    LeanJSONMixin view, the baseline of `rendering_benchmark`.
+    """
+    renderer_classes = drf_settings.DEFAULT_RENDERER_CLASSES
+    content_negotiation_class = DefaultContentNegotiation
+
+    def json_response(self, data=None, status=200, body=None):
+        return Response(json.loads(body) if body else data, status=status)
+
+
+def rendering_benchmark(iterations=5000, accept='*/*'):
+    """
+    CPU time per request of the verify and clear views with the lean JSON
+    path and with DRF's default response handling, called through
+    RequestFactory so only view dispatch and rendering are measured.
+    """
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    from users.views import CookieTokenClear, CookieTokenVerify
+
+    token = AccessToken()
+    token[jwt_settings.USER_ID_CLAIM] = 1
+    factory = RequestFactory(HTTP_ACCEPT=accept)
+
+    def verify_request():
+        request = factory.get('/api/token/verify')
+        request.COOKIES['access_token'] = str(token)
+        return request
+
+    def clear_request():
+        return factory.post('/api/token/clear')
+
+    results = []
+    for name, view_class, make_request in (('token/verify', CookieTokenVerify, verify_request),
+                                           ('token/clear', CookieTokenClear, clear_request)):
+        result = {'endpoint': name}
+        for variant, cls in (('drf', type('DRF' + view_class.__name__, (DRFResponseMixin, view_class), {})),
+                             ('lean', view_class)):
+            view = cls.as_view()
+            # first round warms up caches, the second one is measured
+            for rounds in (min(iterations, 100), iterations):
+                requests = [make_request() for _ in range(rounds)]
+                started = time.process_time()
+                for request in requests:
+                    response = view(request)
+                    # what the handler does with a Response before sending it
+                    getattr(response, 'render', lambda: None)()
+                elapsed = time.process_time() - started
+
+            if response.status_code != 200:
+                raise RuntimeError('{} answered {}'.format(name, response.status_code))
+            result[variant + '_us'] = elapsed / iterations * 1e6
+
+        result['saved_us'] = result['drf_us'] - result['lean_us']
+        results.append(result)
+    return results
+
+
+def verification_benchmark(iterations=20000):
+    """
+    CPU time per decode of an HMAC signed access token with simplejwt's
+    PyJWT backend and with HMACTokenBackend, on their own and inside
+    AccessToken which adds simplejwt's claim checks.
+    """
+    from rest_framework_simplejwt import state
+    from rest_framework_simplejwt.backends import TokenBackend
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    from users.verification import HMACTokenBackend
+
+    reference = TokenBackend(jwt_settings.ALGORITHM, jwt_settings.SIGNING_KEY, jwt_settings.VERIFYING_KEY,
+                             jwt_settings.AUDIENCE, jwt_settings.ISSUER)
+    if not HMACTokenBackend.supports(reference):
+        raise ValueError("SIMPLE_JWT['ALGORITHM'] {} is not an HMAC algorithm".format(reference.algorithm))
+    backends = (('pyjwt', reference), ('hmac', HMACTokenBackend.from_backend(reference)))
+
+    token = AccessToken()
+    token[jwt_settings.USER_ID_CLAIM] = 1
+    raw_token = reference.encode(token.payload)
+
+    def measure(call):
+        # first round warms up caches, the second one is measured
+        for rounds in (min(iterations, 100), iterations):
+            started = time.process_time()
+            for _ in range(rounds):
+                call()
+            elapsed = time.process_time() - started
+        return elapsed / iterations * 1e6
+
+    results = []
+    installed = state.token_backend
+    try:
+        for name in ('decode', 'access_token'):
+            result = {'operation': name}
+            for variant, backend in backends:
+                state.token_backend = backend
+                if name == 'decode':
+                    result[variant + '_us'] = measure(lambda: backend.decode(raw_token))
+                else:
+                    result[variant + '_us'] = measure(lambda: AccessToken(raw_token))
+            result['saved_us'] = result['pyjwt_us'] - result['hmac_us']
+            results.append(result)
+    finally:
+        state.token_backend = installed
+    return results
@@ -0,0 +1,117 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.test.signals import setting_changed
+
+from users.settings import USER_SETTINGS, cookie_settings
+
+
+class TokenCache:
+    """
+    Bounded LRU cache of validated tokens keyed by a digest of the raw token
+    and the scope it was validated for, e.g. the cookie name, so a token
+    accepted as one type is never served from the cache as another. Entries
+    never outlive the `exp` claim of the token they hold.
+    """
+
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(raw_token):
+        if isinstance(raw_token, str):
+            raw_token = raw_token.encode('utf-8')
+        return hashlib.sha256(raw_token).digest()
+
+    def get(self, raw_token, scope=None):
+        key = (scope, self.make_key(raw_token))
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, token = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return token
+
+    def set(self, raw_token, token, scope=None):
+        try:
+            expires_at = float(token['exp'])
+        except (KeyError, TypeError, ValueError):
+            # no usable expiration, never cache such tokens
+            return
+
+        if self.ttl is not None:
+            expires_at = min(expires_at, time.time() + self.ttl)
+
+        key = (scope, self.make_key(raw_token))
+        with self._lock:
+            self._entries[key] = (expires_at, token)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_token_cache = None
+_token_cache_lock = threading.Lock()
+
+
+def get_token_cache():
+    """
+    Returns the process wide token cache or None when caching is disabled.
+    """
+    global _token_cache
+
+    if not cookie_settings.TOKEN_CACHE_ENABLED:
+        return None
+
+    if _token_cache is None:
+        with _token_cache_lock:
+            if _token_cache is None:
+                _token_cache = TokenCache(max_size=cookie_settings.TOKEN_CACHE_SIZE,
+                                          ttl=cookie_settings.TOKEN_CACHE_TTL)
+    return _token_cache
+
+
+def reset_token_cache(*args, **kwargs):
+    global _token_cache
+
+    if kwargs.get('setting', USER_SETTINGS) == USER_SETTINGS:
+        _token_cache = None
+
+
+setting_changed.connect(reset_token_cache)
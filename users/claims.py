@@ -0,0 +1,283 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.test.signals import setting_changed
+from django.utils.module_loading import import_string
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from users.settings import USER_SETTINGS, cookie_settings
+
+# claims computed from relations, every other claim name is a user field
+RELATION_CLAIMS = ('groups', 'permissions')
+
+
+class InMemoryClaimsCache:
+    """
+    Bounded LRU of claims per user id held in process memory. Signals only
+    reach the process that saved the change, so entries also expire after
+    `ttl` seconds to bound how stale other workers can be.
+    """
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+
+            expires_at, claims = entry
+            if expires_at is not None and expires_at <= now:
+                del self._entries[user_id]
+                return None
+
+            self._entries.move_to_end(user_id)
+            return claims
+
+    def set(self, user_id, claims):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[user_id] = (expires_at, claims)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class CacheClaimsCache:
+    """
+    Claims kept in a Django cache shared by all workers, so an invalidation
+    in one worker is seen by every other. `clear()` bumps a version that is
+    part of every key instead of deleting keys one by one.
+    """
+
+    def __init__(self, alias='default', prefix='cookiejwt:claims', ttl=300):
+        self.cache = caches[alias]
+        self.prefix = prefix
+        self.ttl = ttl
+        self.version_key = '{}:version'.format(prefix)
+
+    def _key(self, user_id):
+        version = self.cache.get(self.version_key)
+        if version is None:
+            self.cache.add(self.version_key, 0, None)
+            version = self.cache.get(self.version_key, 0)
+        return '{}:{}:{}'.format(self.prefix, version, user_id)
+
+    def get(self, user_id):
+        return self.cache.get(self._key(user_id))
+
+    def set(self, user_id, claims):
+        self.cache.set(self._key(user_id), claims, self.ttl)
+
+    def invalidate(self, user_id):
+        self.cache.delete(self._key(user_id))
+
+    def clear(self):
+        self.cache.add(self.version_key, 0, None)
+        self.cache.incr(self.version_key)
+
+
+class ClaimsTokenUser(TokenUser):
+    """
+    TokenUser answering permission checks from the `permissions` claim,
+    without a database lookup. Staff and superuser status are never taken
+    from a token, a demotion would otherwise last until it expires, so admin
+    access needs a session login.
+    """
+    is_staff = False
+    is_superuser = False
+
+    @property
+    def group_names(self):
+        return self.token.get('groups', [])
+
+    def get_all_permissions(self, obj=None):
+        return set(self.token.get('permissions', ()))
+
+    def has_perm(self, perm, obj=None):
+        return perm in self.get_all_permissions(obj)
+
+    def has_perms(self, perm_list, obj=None):
+        return all(self.has_perm(perm, obj) for perm in perm_list)
+
+    def has_module_perms(self, module):
+        return any(perm.startswith(module + '.') for perm in self.get_all_permissions())
+
+
+def check_claim_names(claim_names):
+    reserved = {'exp', 'iat', 'nbf', 'jti', api_settings.TOKEN_TYPE_CLAIM, api_settings.USER_ID_CLAIM,
+                cookie_settings.GENERATION_CLAIM, cookie_settings.REMEMBER_CLAIM}
+    clashes = reserved.intersection(claim_names)
+    if clashes:
+        raise ImproperlyConfigured("COOKIE_JWT['USER_CLAIMS'] contains reserved claims: {}".format(
+            ', '.join(sorted(clashes))))
+
+
+def build_user_claims(user_id, claim_names):
+    """
+    Claims of one user: `groups` (names), `permissions` ('app_label.codename',
+    direct and through groups) and any concrete user field. Fields and group
+    names come from one query, permissions from a second one. Returns None
+    for unknown users.
+    """
+    UserModel = get_user_model()
+    user_filter = {api_settings.USER_ID_FIELD: user_id}
+    fields = [name for name in claim_names if name not in RELATION_CLAIMS]
+
+    lookups = fields + ['groups__name'] if 'groups' in claim_names else fields
+    if lookups:
+        rows = list(UserModel._default_manager.filter(**user_filter).values_list(*lookups))
+    else:
+        rows = [()] if UserModel._default_manager.filter(**user_filter).exists() else []
+    if not rows:
+        return None
+
+    claims = dict(zip(fields, rows[0]))
+    if 'groups' in claim_names:
+        claims['groups'] = sorted(row[-1] for row in rows if row[-1] is not None)
+
+    if 'permissions' in claim_names:
+        user_lookup = 'user__' + api_settings.USER_ID_FIELD
+        group_lookup = 'group__user__' + api_settings.USER_ID_FIELD
+        permissions = Permission.objects.filter(Q(**{user_lookup: user_id}) | Q(**{group_lookup: user_id}))
+        claims['permissions'] = sorted({'{}.{}'.format(app_label, codename) for app_label, codename in
+                                        permissions.values_list('content_type__app_label', 'codename')})
+
+    return claims
+
+
+_claims_cache = None
+_claims_cache_lock = threading.Lock()
+
+
+def get_claims_cache():
+    """
+    Returns the process wide claims cache or None when claims are computed on
+    every token issued.
+    """
+    global _claims_cache
+
+    if not cookie_settings.CLAIMS_CACHE:
+        return None
+
+    if _claims_cache is None:
+        with _claims_cache_lock:
+            if _claims_cache is None:
+                _claims_cache = import_string(cookie_settings.CLAIMS_CACHE)(**cookie_settings.CLAIMS_CACHE_OPTIONS)
+    return _claims_cache
+
+
+def get_user_claims(user_id):
+    claim_names = cookie_settings.USER_CLAIMS
+    cache = get_claims_cache()
+    if cache is None:
+        return build_user_claims(user_id, claim_names)
+
+    claims = cache.get(user_id)
+    if claims is None:
+        claims = build_user_claims(user_id, claim_names)
+        if claims is not None:
+            cache.set(user_id, claims)
+    return claims
+
+
+def add_user_claims(token):
+    """
+    Adds the configured `USER_CLAIMS` of the token's user to `token`.
+    """
+    if not cookie_settings.USER_CLAIMS:
+        return
+
+    check_claim_names(cookie_settings.USER_CLAIMS)
+    claims = get_user_claims(token[api_settings.USER_ID_CLAIM])
+    if claims:
+        token.payload.update(claims)
+
+
+def invalidate_user_claims(*user_ids):
+    cache = get_claims_cache()
+    if cache is not None:
+        for user_id in user_ids:
+            cache.invalidate(user_id)
+
+
+def clear_user_claims():
+    cache = get_claims_cache()
+    if cache is not None:
+        cache.clear()
+
+
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not set(update_fields).intersection(cookie_settings.USER_CLAIMS):
+        # e.g. the last_login update of every login
+        return
+    invalidate_user_claims(getattr(instance, api_settings.USER_ID_FIELD))
+
+
+def user_relations_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+
+    if not reverse:
+        invalidate_user_claims(getattr(instance, api_settings.USER_ID_FIELD))
+    elif pk_set and api_settings.USER_ID_FIELD in ('id', 'pk'):
+        invalidate_user_claims(*pk_set)
+    else:
+        # users of a group or permission, unknown after clear()
+        clear_user_claims()
+
+
+def groups_changed(*args, **kwargs):
+    action = kwargs.get('action')
+    if action is None or action.startswith('post_'):
+        # renames and permission changes reach every member, they are rare
+        clear_user_claims()
+
+
+def connect_claims_signals():
+    UserModel = get_user_model()
+    post_save.connect(user_changed, sender=UserModel, dispatch_uid='cookiejwt_claims_user_saved')
+    post_delete.connect(user_changed, sender=UserModel, dispatch_uid='cookiejwt_claims_user_deleted')
+    m2m_changed.connect(user_relations_changed, sender=UserModel.groups.through,
+                        dispatch_uid='cookiejwt_claims_user_groups')
+    m2m_changed.connect(user_relations_changed, sender=UserModel.user_permissions.through,
+                        dispatch_uid='cookiejwt_claims_user_permissions')
+    m2m_changed.connect(groups_changed, sender=Group.permissions.through,
+                        dispatch_uid='cookiejwt_claims_group_permissions')
+    for model in (Group, Permission):
+        post_save.connect(groups_changed, sender=model, dispatch_uid='cookiejwt_claims_{}_saved'.format(model.__name__))
+        post_delete.connect(groups_changed, sender=model, dispatch_uid='cookiejwt_claims_{}_deleted'.format(model.__name__))
+
+
+def reset_claims_cache(*args, **kwargs):
+    global _claims_cache
+
+    if kwargs.get('setting', USER_SETTINGS) == USER_SETTINGS:
+        _claims_cache = None
+
+
+setting_changed.connect(reset_claims_cache)
@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.test.signals import setting_changed
+
+from users.cache import TokenCache
+from users.metrics import REFRESH_COALESCED_TOTAL, inc
+from users.settings import USER_SETTINGS, cookie_settings
+
+
+class Flight:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.expires_at = None
+
+
+class SingleFlight:
+    """
+    Runs one call per key at a time. Callers arriving while it runs wait for
+    it and share its result, and so do callers within `window` seconds after
+    it returned. Failures are handed to the waiting callers but not kept.
+    At most `max_size` finished results are kept, oldest first out.
+    """
+
+    def __init__(self, window=2.0, max_size=10000):
+        self.window = window
+        self.max_size = max_size
+        self._flights = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._flights)
+
+    def run(self, raw_key, func):
+        """
+        Returns `func()` or the result of the call sharing its key, together
+        with whether this caller ran `func` itself.
+        """
+        key = TokenCache.make_key(raw_key)
+        now = time.monotonic()
+
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and flight.expires_at is not None and flight.expires_at <= now:
+                del self._flights[key]
+                flight = None
+
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, False
+
+        try:
+            flight.result = func()
+        except BaseException as e:
+            flight.error = e
+            with self._lock:
+                self._flights.pop(key, None)
+            raise
+        else:
+            finished_at = time.monotonic()
+            with self._lock:
+                flight.expires_at = finished_at + self.window
+                self._prune(finished_at)
+        finally:
+            flight.done.set()
+
+        return flight.result, True
+
+    def _prune(self, now):
+        # flights are kept in start order, which is close to expiry order
+        while self._flights:
+            key, flight = next(iter(self._flights.items()))
+            if flight.expires_at is None or flight.expires_at > now:
+                break
+            del self._flights[key]
+
+        if len(self._flights) > self.max_size:
+            finished = [key for key, flight in self._flights.items() if flight.expires_at is not None]
+            for key in finished[:len(self._flights) - self.max_size]:
+                del self._flights[key]
+
+
+_refresh_flights = None
+_refresh_flights_lock = threading.Lock()
+
+
+def get_refresh_flights():
+    """
+    Returns the process wide single flight of refresh tokens or None when
+    refresh requests are not coalesced.
+    """
+    global _refresh_flights
+
+    if not cookie_settings.REFRESH_COALESCE_WINDOW:
+        return None
+
+    if _refresh_flights is None:
+        with _refresh_flights_lock:
+            if _refresh_flights is None:
+                _refresh_flights = SingleFlight(window=cookie_settings.REFRESH_COALESCE_WINDOW,
+                                                max_size=cookie_settings.REFRESH_COALESCE_SIZE)
+    return _refresh_flights
+
+
+def coalesce_refresh(raw_token, refresh):
+    """
+    Calls `refresh()` once for concurrent and near simultaneous refreshes of
+    `raw_token`, every caller gets its own copy of the minted tokens.
+    """
+    flights = get_refresh_flights()
+    if flights is None:
+        return refresh()
+
+    data, leader = flights.run(raw_token, refresh)
+    inc(REFRESH_COALESCED_TOTAL, role='leader' if leader else 'follower')
+    return dict(data)
+
+
+def reset_refresh_flights(*args, **kwargs):
+    global _refresh_flights
+
+    if kwargs.get('setting', USER_SETTINGS) == USER_SETTINGS:
+        _refresh_flights = None
+
+
+setting_changed.connect(reset_refresh_flights)
@@ -0,0 +1,36 @@
+import datetime
+
+from rest_framework_simplejwt.settings import api_settings
+
+from users.settings import cookie_settings
+
+
+def access_expiration():
+    return datetime.datetime.utcnow() + api_settings.ACCESS_TOKEN_LIFETIME
+
+
+def refresh_expiration():
+    return datetime.datetime.utcnow() + api_settings.REFRESH_TOKEN_LIFETIME
+
+
+def set_access_cookie(response, token, expires=None):
+    response.set_cookie('access_token',
+                        token,
+                        expires=expires,
+                        httponly=True,
+                        samesite=cookie_settings.COOKIE_SAMESITE)
+
+
+def set_refresh_cookie(response, token, expires=None):
+    response.set_cookie('refresh_token',
+                        token,
+                        expires=expires,
+                        path=cookie_settings.REFRESH_COOKIE_PATH,
+                        httponly=True,
+                        samesite=cookie_settings.COOKIE_SAMESITE)
+
+
+def delete_token_cookies(response):
+    response.delete_cookie('access_token', samesite=cookie_settings.COOKIE_SAMESITE)
+    response.delete_cookie('refresh_token', path=cookie_settings.REFRESH_COOKIE_PATH,
+                           samesite=cookie_settings.COOKIE_SAMESITE)
@@ -0,0 +1,26 @@
+from contextlib import contextmanager
+
+from django.db import transaction
+
+
+@contextmanager
+def write_atomic(using=None):
+    """
+    `transaction.atomic` for blocks that read before they write. On the
+    sqlite_wal backend the transaction takes the writer lock and begins with
+    BEGIN IMMEDIATE, instead of a deferred BEGIN that may fail to upgrade to
+    a write. Nested in another atomic block it is a plain savepoint.
+    """
+    connection = transaction.get_connection(using)
+    if connection.in_atomic_block or not hasattr(connection, 'begin_immediate'):
+        with transaction.atomic(using=using):
+            yield
+        return
+
+    connection.begin_immediate = True
+    try:
+        with transaction.atomic(using=using):
+            connection.begin_immediate = False
+            yield
+    finally:
+        connection.begin_immediate = False
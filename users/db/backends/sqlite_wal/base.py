@@ -0,0 +1,188 @@
+import re
+import threading
+
+from django.db.backends.sqlite3 import base as sqlite3_base
+from django.db.utils import OperationalError
+
+# applied to every new connection, override with OPTIONS['pragmas']
+DEFAULT_PRAGMAS = {
+    # readers see the last committed snapshot and never wait for the writer
+    'journal_mode': 'WAL',
+    # fsync at checkpoints only, a power loss may drop the last commits but
+    # never corrupts the database
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+WRITE_QUERY_RE = re.compile(r'\s*(INSERT|UPDATE|DELETE|REPLACE|CREATE|DROP|ALTER)\b', re.IGNORECASE)
+
+_writer_locks = {}
+_writer_locks_lock = threading.Lock()
+
+
+def get_writer_lock(name):
+    with _writer_locks_lock:
+        lock = _writer_locks.get(name)
+        if lock is None:
+            lock = _writer_locks[name] = threading.Lock()
+        return lock
+
+
+class WriterQueueCursorWrapper(sqlite3_base.SQLiteCursorWrapper):
+    """
+    Runs write statements while holding the process wide writer lock of the
+    database, for one statement in autocommit mode and until the end of the
+    transaction inside one. Reads never take the lock.
+    """
+    writer = None
+
+    def execute(self, query, params=None):
+        acquired = self.before_statement(query)
+        try:
+            return super().execute(query, params)
+        finally:
+            if acquired:
+                self.writer.release_writer_lock()
+
+    def executemany(self, query, param_list):
+        acquired = self.before_statement(query)
+        try:
+            return super().executemany(query, param_list)
+        finally:
+            if acquired:
+                self.writer.release_writer_lock()
+
+    def before_statement(self, query):
+        """
+        Takes the writer lock a write needs, returns True when it is to be
+        released right after the statement.
+        """
+        write = WRITE_QUERY_RE.match(query) is not None
+        if self.writer.transaction_pending:
+            self.writer.begin_transaction(immediate=write)
+            return False
+        if not write:
+            return False
+        if self.connection.in_transaction:
+            # a transaction that read first, it keeps the lock until it ends
+            self.writer.acquire_writer_lock()
+            return False
+        return self.writer.acquire_writer_lock()
+
+
+class DatabaseWrapper(sqlite3_base.DatabaseWrapper):
+    """
+    SQLite tuned for concurrent requests. Every connection gets the WAL
+    journal, a busy timeout, NORMAL synchronous and memory mapped reads.
+    Writers of one process queue on a lock instead of polling SQLite's file
+    lock, autocommit writes hold it for their statement. Transactions begin
+    with their first statement: one that starts with a write takes the lock
+    and runs BEGIN IMMEDIATE, one that starts with a read runs a deferred
+    BEGIN and takes the lock only at its first write, so read-only
+    transactions never wait. A transaction that reads before it writes can
+    fail with "database is locked" when another writer committed in between,
+    wrap those in `users.db.write_atomic` to begin them immediately.
+
+    OPTIONS accepts `pragmas` (merged over DEFAULT_PRAGMAS) and
+    `single_writer` (default True) next to the sqlite3.connect arguments.
+    Combine it with CONN_MAX_AGE to keep connections and their page cache.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._holds_writer_lock = False
+        self.transaction_pending = False
+        self.begin_immediate = False
+        self._cursor_class = type('WriterQueueCursorWrapper', (WriterQueueCursorWrapper,), {'writer': self})
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        kwargs.pop('pragmas', None)
+        kwargs.pop('single_writer', None)
+        return kwargs
+
+    @property
+    def pragmas(self):
+        return dict(DEFAULT_PRAGMAS, **self.settings_dict['OPTIONS'].get('pragmas', {}))
+
+    @property
+    def single_writer(self):
+        return self.settings_dict['OPTIONS'].get('single_writer', True)
+
+    @property
+    def writer_lock(self):
+        return get_writer_lock(self.settings_dict['NAME'])
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute('PRAGMA {} = {}'.format(name, value))
+        return conn
+
+    def create_cursor(self, name=None):
+        if not self.single_writer:
+            return super().create_cursor(name)
+        return self.connection.cursor(factory=self._cursor_class)
+
+    def acquire_writer_lock(self):
+        """
+        Returns False when this connection already holds the lock.
+        """
+        if self._holds_writer_lock:
+            return False
+        if not self.writer_lock.acquire(timeout=self.pragmas['busy_timeout'] / 1000):
+            raise OperationalError('database is locked')
+        self._holds_writer_lock = True
+        return True
+
+    def release_writer_lock(self):
+        if self._holds_writer_lock:
+            self._holds_writer_lock = False
+            self.writer_lock.release()
+
+    def _start_transaction_under_autocommit(self):
+        if not self.single_writer:
+            return super()._start_transaction_under_autocommit()
+
+        if self.begin_immediate:
+            self.begin_transaction(immediate=True)
+        else:
+            # BEGIN is sent with the first statement, once it is known
+            # whether the transaction starts by writing
+            self.transaction_pending = True
+
+    def begin_transaction(self, immediate):
+        self.transaction_pending = False
+        if not immediate:
+            self.connection.execute('BEGIN')
+            return
+
+        self.acquire_writer_lock()
+        try:
+            self.connection.execute('BEGIN IMMEDIATE')
+        except Exception:
+            self.release_writer_lock()
+            raise
+
+    def _commit(self):
+        self.transaction_pending = False
+        try:
+            return super()._commit()
+        finally:
+            self.release_writer_lock()
+
+    def _rollback(self):
+        self.transaction_pending = False
+        try:
+            return super()._rollback()
+        finally:
+            self.release_writer_lock()
+
+    def _close(self):
+        self.transaction_pending = False
+        try:
+            return super()._close()
+        finally:
+            self.release_writer_lock()
@@ -0,0 +1,268 @@
+import hashlib
+import math
+import threading
+import time
+
+from django.core.cache import caches
+from django.test.signals import setting_changed
+from django.utils.module_loading import import_string
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from users.settings import USER_SETTINGS, cookie_settings
+
+
+class BloomFilter:
+    """
+    Fixed size Bloom filter over string keys, `k` bit positions are derived
+    from a single blake2b digest by double hashing.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(int(capacity), 1)
+        self.size = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class AgingBloomFilter:
+    """
+    Pair of Bloom filters rotated every `window` seconds. Denylisted refresh
+    tokens stop mattering once they expire, so with a window of at least the
+    refresh token lifetime an entry is never dropped while it is still needed
+    and the filters do not fill up with dead entries.
+    """
+
+    def __init__(self, capacity, error_rate=0.001, window=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.window = window
+        self.current = BloomFilter(capacity, error_rate)
+        self.previous = None
+        self.rotated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _maybe_rotate(self):
+        if self.window is None or time.monotonic() - self.rotated_at < self.window:
+            return
+        with self._lock:
+            # another request may have rotated while this one waited, rotating
+            # twice would drop the last window's entries
+            if time.monotonic() - self.rotated_at < self.window:
+                return
+            self.previous = self.current
+            self.current = BloomFilter(self.capacity, self.error_rate)
+            self.rotated_at = time.monotonic()
+
+    def add(self, key):
+        self._maybe_rotate()
+        self.current.add(key)
+
+    def __contains__(self, key):
+        self._maybe_rotate()
+        return key in self.current or (self.previous is not None and key in self.previous)
+
+
+class BaseDenylistStore:
+    """
+    Authoritative storage of denylisted token ids. `changes` lets a store
+    shared between processes report ids added elsewhere, so the local filter
+    can learn about them.
+    """
+
+    def add(self, jti, exp):
+        raise NotImplementedError('Must implement `add` method for `BaseDenylistStore` subclasses')
+
+    def contains(self, jti):
+        raise NotImplementedError('Must implement `contains` method for `BaseDenylistStore` subclasses')
+
+    def changes(self, cursor, limit=None):
+        """
+        Returns the new cursor, the ids added after `cursor` (at most the
+        latest `limit` of them) and whether none were left out.
+        """
+        return cursor, (), True
+
+
+class InMemoryDenylistStore(BaseDenylistStore):
+    """
+    Process local store, suitable for a single worker or for tests. With more
+    workers a rotated refresh token can be replayed against another worker.
+    """
+
+    def __init__(self, prune_every=1024):
+        self.prune_every = prune_every
+        self._entries = {}
+        self._adds = 0
+        self._lock = threading.Lock()
+
+    def add(self, jti, exp):
+        with self._lock:
+            self._entries[jti] = exp
+            self._adds += 1
+            if self._adds % self.prune_every == 0:
+                now = time.time()
+                self._entries = {key: value for key, value in self._entries.items() if value > now}
+
+    def contains(self, jti):
+        exp = self._entries.get(jti)
+        return exp is not None and exp > time.time()
+
+
+class CacheDenylistStore(BaseDenylistStore):
+    """
+    Store backed by a Django cache, e.g. memcached or redis on the local host,
+    shared by all workers using that cache. Every addition is also appended to
+    a numbered log the other workers replay into their filters. The cache must
+    be shared and must not evict live entries, LocMemCache is neither.
+    """
+
+    def __init__(self, alias='default', prefix='cookiejwt:denylist', batch_size=500):
+        self.cache = caches[alias]
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.seq_key = '{}:seq'.format(prefix)
+
+    def _timeout(self, exp):
+        return max(int(math.ceil(exp - time.time())), 1)
+
+    def add(self, jti, exp):
+        timeout = self._timeout(exp)
+        self.cache.set('{}:jti:{}'.format(self.prefix, jti), 1, timeout)
+
+        self.cache.add(self.seq_key, 0, None)
+        seq = self.cache.incr(self.seq_key)
+        self.cache.set('{}:log:{}'.format(self.prefix, seq), jti, timeout)
+
+    def contains(self, jti):
+        return self.cache.get('{}:jti:{}'.format(self.prefix, jti)) is not None
+
+    def changes(self, cursor, limit=None):
+        seq = self.cache.get(self.seq_key) or 0
+        if seq <= cursor:
+            return seq, (), True
+
+        # the counter only grows, a new worker must not walk the whole history
+        low_water = cursor if limit is None else max(cursor, seq - limit)
+        jtis = []
+        for start in range(low_water + 1, seq + 1, self.batch_size):
+            keys = ['{}:log:{}'.format(self.prefix, n) for n in range(start, min(start + self.batch_size, seq + 1))]
+            jtis.extend(self.cache.get_many(keys).values())
+        return seq, jtis, low_water == cursor
+
+
+class Denylist:
+    """
+    Denylist store fronted by a Bloom filter. Positives are confirmed against
+    the store. A negative answer is only final once the filter has replayed
+    the store's changes, which for a shared store is one read of its change
+    counter, so ids revoked by other workers are seen at once. A
+    `sync_interval` above 0 skips that replay for that many seconds and
+    accepts a revocation blind spot of the same length.
+
+    A replay reads at most the filter capacity of latest changes. When older
+    ones were left out, negatives are confirmed against the store until they
+    can no longer belong to a live token, one filter window later.
+    """
+
+    def __init__(self, store, bloom, sync_interval=1.0):
+        self.store = store
+        self.bloom = bloom
+        self.sync_interval = sync_interval
+        self.fast_negatives = 0
+        self.store_lookups = 0
+        self._cursor = 0
+        self._synced_at = None
+        self._incomplete_until = None
+        self._lock = threading.Lock()
+
+    def sync(self, force=False):
+        now = time.monotonic()
+        if not force and self._synced_at is not None and now - self._synced_at < self.sync_interval:
+            return
+
+        with self._lock:
+            self._cursor, jtis, complete = self.store.changes(self._cursor, self.bloom.capacity)
+            for jti in jtis:
+                self.bloom.add(jti)
+            if not complete:
+                window = self.bloom.window
+                self._incomplete_until = float('inf') if window is None else now + window
+            self._synced_at = now
+
+    def _filter_complete(self):
+        incomplete_until = self._incomplete_until
+        return incomplete_until is None or time.monotonic() >= incomplete_until
+
+    def revoke(self, jti, exp):
+        self.store.add(jti, exp)
+        with self._lock:
+            self.bloom.add(jti)
+
+    def is_revoked(self, jti):
+        if jti not in self.bloom:
+            self.sync()
+            if jti not in self.bloom and self._filter_complete():
+                self.fast_negatives += 1
+                return False
+
+        self.store_lookups += 1
+        return self.store.contains(jti)
+
+
+_denylist = None
+_denylist_lock = threading.Lock()
+
+
+def get_denylist():
+    """
+    Returns the process wide refresh token denylist or None when disabled.
+    """
+    global _denylist
+
+    if not cookie_settings.DENYLIST_STORE:
+        return None
+
+    if _denylist is None:
+        with _denylist_lock:
+            if _denylist is None:
+                store = import_string(cookie_settings.DENYLIST_STORE)(**cookie_settings.DENYLIST_STORE_OPTIONS)
+                bloom = AgingBloomFilter(cookie_settings.DENYLIST_FILTER_CAPACITY,
+                                         cookie_settings.DENYLIST_FILTER_ERROR_RATE,
+                                         api_settings.REFRESH_TOKEN_LIFETIME.total_seconds())
+                _denylist = Denylist(store, bloom, cookie_settings.DENYLIST_SYNC_INTERVAL)
+                _denylist.sync(force=True)
+    return _denylist
+
+
+def check_denylist(token):
+    denylist = get_denylist()
+    if denylist is not None and denylist.is_revoked(token[api_settings.JTI_CLAIM]):
+        raise TokenError(_('Token is blacklisted'))
+
+
+def reset_denylist(*args, **kwargs):
+    global _denylist
+
+    if kwargs.get('setting', USER_SETTINGS) in (USER_SETTINGS, 'SIMPLE_JWT'):
+        _denylist = None
+
+
+setting_changed.connect(reset_denylist)
@@ -0,0 +1,216 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+from django.test.signals import setting_changed
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from users.settings import USER_SETTINGS, cookie_settings
+
+HEADER = struct.Struct('<8sQ')
+SLOT = struct.Struct('<QQ')
+MAGIC = b'CJWTGEN2'
+LEGACY_MAGICS = (b'CJWTGEN1',)
+
+
+class GenerationTableFull(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _('Too many users were logged out recently, try again later.')
+    default_code = 'generation_table_full'
+
+
+class GenerationTable:
+    """
+    Per-user token generations in a memory mapped file, so every worker on
+    the host reads the same values without a database round trip. A
+    generation is the time of the user's last revocation in seconds, kept
+    increasing, so after `ttl` seconds (the longest token lifetime) no token
+    it revoked is alive and its slot can be taken by another user.
+
+    The file is an open addressing hash table of (key, generation) slots,
+    probed for at most `max_probe` slots. Reads are lock free, writers
+    serialize on a thread lock and an exclusive `flock`, which only excludes
+    other processes. A new slot is published by writing its
+    generation before its key, a reused one by writing its key first, so a
+    concurrent reader at worst sees the user revoked a moment early.
+    """
+    max_probe = 64
+
+    def __init__(self, path, slots=65536, ttl=None):
+        self.path = path
+        self.ttl = ttl
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._lock = threading.Lock()
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                header = os.pread(self._fd, HEADER.size, 0)
+                if len(header) == HEADER.size and header.startswith(MAGIC):
+                    slots = HEADER.unpack(header)[1]
+                elif header.startswith(LEGACY_MAGICS):
+                    # counters of the old format are no timestamps, never guess
+                    raise ValueError('Token generation table {} has an older format, move it away'.format(path))
+                else:
+                    os.ftruncate(self._fd, HEADER.size + slots * SLOT.size)
+                    os.pwrite(self._fd, HEADER.pack(MAGIC, slots), 0)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+            self.slots = slots
+            self._map = mmap.mmap(self._fd, HEADER.size + slots * SLOT.size)
+        except Exception:
+            os.close(self._fd)
+            raise
+
+    @staticmethod
+    def make_key(user_id):
+        if isinstance(user_id, int) and 0 <= user_id < 2 ** 63:
+            return user_id + 1
+        digest = hashlib.blake2b(str(user_id).encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'little') | 2 ** 63
+
+    def _probe(self, key):
+        index = (key * 0x9E3779B97F4A7C15 >> 16) % self.slots
+        for _ in range(min(self.slots, self.max_probe)):
+            offset = HEADER.size + index * SLOT.size
+            slot_key, generation = SLOT.unpack_from(self._map, offset)
+            yield offset, slot_key, generation
+            index = (index + 1) % self.slots
+
+    def get(self, user_id):
+        key = self.make_key(user_id)
+        for offset, slot_key, generation in self._probe(key):
+            if slot_key == key:
+                return generation
+            if slot_key == 0:
+                break
+        return 0
+
+    def bump(self, user_id, now=None):
+        """
+        Revokes every token of `user_id` issued so far and returns the new
+        generation, raises GenerationTableFull when no slot within the probe
+        length is free or expired.
+        """
+        key = self.make_key(user_id)
+        now = int(time.time() if now is None else now)
+        with self._lock:
+            return self._bump(key, now)
+
+    def _bump(self, key, now):
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            found, empty, expired = None, None, None
+            for offset, slot_key, generation in self._probe(key):
+                if slot_key == key:
+                    found = offset, generation
+                    break
+                if slot_key == 0:
+                    empty = offset
+                    break
+                if expired is None and self.ttl is not None and generation + self.ttl <= now:
+                    expired = offset
+
+            if found is not None:
+                offset, generation = found
+                generation = max(generation + 1, now)
+                struct.pack_into('<Q', self._map, offset + 8, generation)
+            elif expired is not None:
+                generation = now
+                struct.pack_into('<Q', self._map, expired, key)
+                struct.pack_into('<Q', self._map, expired + 8, generation)
+            elif empty is not None:
+                generation = now
+                struct.pack_into('<Q', self._map, empty + 8, generation)
+                struct.pack_into('<Q', self._map, empty, key)
+            else:
+                raise GenerationTableFull()
+            return generation
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+def longest_token_lifetime():
+    return max(lifetime.total_seconds() for lifetime in (
+        api_settings.ACCESS_TOKEN_LIFETIME, api_settings.REFRESH_TOKEN_LIFETIME,
+        api_settings.SLIDING_TOKEN_LIFETIME, api_settings.SLIDING_TOKEN_REFRESH_LIFETIME))
+
+
+_generation_table = None
+_generation_table_lock = threading.Lock()
+
+
+def get_generation_table():
+    """
+    Returns the process wide generation table or None when disabled.
+    """
+    global _generation_table
+
+    if not cookie_settings.GENERATION_TABLE_PATH:
+        return None
+
+    if _generation_table is None:
+        with _generation_table_lock:
+            if _generation_table is None:
+                _generation_table = GenerationTable(cookie_settings.GENERATION_TABLE_PATH,
+                                                    cookie_settings.GENERATION_TABLE_SLOTS,
+                                                    longest_token_lifetime())
+    return _generation_table
+
+
+def add_generation_claim(token, user):
+    table = get_generation_table()
+    if table is None:
+        return
+
+    generation = table.get(getattr(user, api_settings.USER_ID_FIELD))
+    if generation:
+        # tokens without the claim count as generation 0
+        token[cookie_settings.GENERATION_CLAIM] = generation
+
+
+def check_generation(token):
+    table = get_generation_table()
+    if table is None:
+        return
+
+    try:
+        user_id = token[api_settings.USER_ID_CLAIM]
+    except KeyError:
+        return
+
+    if token.get(cookie_settings.GENERATION_CLAIM, 0) < table.get(user_id):
+        raise TokenError(_('Token has been revoked'))
+
+
+def revoke_user_tokens(user):
+    """
+    Invalidates every access and refresh token issued to `user` so far.
+    """
+    table = get_generation_table()
+    if table is None:
+        return None
+    return table.bump(getattr(user, api_settings.USER_ID_FIELD))
+
+
+def reset_generation_table(*args, **kwargs):
+    global _generation_table
+
+    if kwargs.get('setting', USER_SETTINGS) in (USER_SETTINGS, 'SIMPLE_JWT') and _generation_table is not None:
+        _generation_table.close()
+        _generation_table = None
+
+
+setting_changed.connect(reset_generation_table)
@@ -0,0 +1,371 @@
+import base64
+import hashlib
+import json
+import os
+import statistics
+import time
+from collections import Counter
+
+from django.contrib.auth import hashers
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX, get_hasher, identify_hasher
+from django.utils.crypto import constant_time_compare
+from django.utils.translation import gettext_noop as _
+
+from users.settings import cookie_settings
+
+TUNING_PASSWORD = 'hasher-tuning-password'
+
+
+def tuned_param(algorithm, name, default):
+    return cookie_settings.PASSWORD_HASHER_PARAMS.get(algorithm, {}).get(name, default)
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    PBKDF2 with its iteration count taken from
+    COOKIE_JWT['PASSWORD_HASHER_PARAMS']['pbkdf2_sha256']. Hashes with other
+    counts are upgraded on the next successful login.
+    """
+
+    @property
+    def iterations(self):
+        return tuned_param(self.algorithm, 'iterations', hashers.PBKDF2PasswordHasher.iterations)
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    """
+    Argon2 with tunable `time_cost`, `memory_cost` (KiB) and `parallelism`,
+    needs the argon2-cffi package.
+    """
+
+    @property
+    def time_cost(self):
+        return tuned_param(self.algorithm, 'time_cost', hashers.Argon2PasswordHasher.time_cost)
+
+    @property
+    def memory_cost(self):
+        return tuned_param(self.algorithm, 'memory_cost', hashers.Argon2PasswordHasher.memory_cost)
+
+    @property
+    def parallelism(self):
+        return tuned_param(self.algorithm, 'parallelism', hashers.Argon2PasswordHasher.parallelism)
+
+
+class ScryptPasswordHasher(hashers.BasePasswordHasher):
+    """
+    scrypt through hashlib, in the format of Django 4.0's hasher of the same
+    name so stored hashes keep working after an upgrade. `work_factor` (N),
+    `block_size` (r) and `parallelism` (p) are tunable, memory use is about
+    128 * N * r bytes.
+    """
+    algorithm = 'scrypt'
+
+    @property
+    def work_factor(self):
+        return tuned_param(self.algorithm, 'work_factor', 2 ** 14)
+
+    @property
+    def block_size(self):
+        return tuned_param(self.algorithm, 'block_size', 8)
+
+    @property
+    def parallelism(self):
+        return tuned_param(self.algorithm, 'parallelism', 1)
+
+    def encode(self, password, salt, n=None, r=None, p=None):
+        assert password is not None
+        assert salt and '$' not in salt
+        n = n or self.work_factor
+        r = r or self.block_size
+        p = p or self.parallelism
+        hash_ = hashlib.scrypt(password.encode(), salt=salt.encode(), n=n, r=r, p=p,
+                               maxmem=256 * n * r * p, dklen=64)
+        hash_ = base64.b64encode(hash_).decode('ascii').strip()
+        return '%s$%d$%s$%d$%d$%s' % (self.algorithm, n, salt, r, p, hash_)
+
+    def decode(self, encoded):
+        algorithm, work_factor, salt, block_size, parallelism, hash_ = encoded.split('$', 5)
+        assert algorithm == self.algorithm
+        return {
+            'algorithm': algorithm,
+            'work_factor': int(work_factor),
+            'salt': salt,
+            'block_size': int(block_size),
+            'parallelism': int(parallelism),
+            'hash': hash_,
+        }
+
+    def verify(self, password, encoded):
+        decoded = self.decode(encoded)
+        encoded_2 = self.encode(password, decoded['salt'], decoded['work_factor'], decoded['block_size'],
+                                decoded['parallelism'])
+        return constant_time_compare(encoded, encoded_2)
+
+    def safe_summary(self, encoded):
+        decoded = self.decode(encoded)
+        return {
+            _('algorithm'): decoded['algorithm'],
+            _('work factor'): decoded['work_factor'],
+            _('block size'): decoded['block_size'],
+            _('parallelism'): decoded['parallelism'],
+            _('salt'): hashers.mask_hash(decoded['salt']),
+            _('hash'): hashers.mask_hash(decoded['hash']),
+        }
+
+    def must_update(self, encoded):
+        decoded = self.decode(encoded)
+        return (decoded['work_factor'] != self.work_factor or decoded['block_size'] != self.block_size or
+                decoded['parallelism'] != self.parallelism)
+
+    def harden_runtime(self, password, encoded):
+        # scrypt runtime is not additive in its parameters, nothing sensible to pad
+        pass
+
+
+def argon2_available():
+    try:
+        import argon2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def time_hasher(hasher_class, params, samples=3):
+    """
+    Median seconds of `samples` encodes with `hasher_class` using `params`
+    instead of its configured cost.
+    """
+    hasher = type('Probe' + hasher_class.__name__, (hasher_class,), dict(params))()
+    salt = hasher.salt()
+    times = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        hasher.encode(TUNING_PASSWORD, salt)
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def format_params(params):
+    return ' '.join('{}={}'.format(name, value) for name, value in params.items())
+
+
+def tuning_result(algorithm, hasher_class, params, seconds, memory_bytes=None):
+    return {
+        'algorithm': algorithm,
+        'hasher': '{}.{}'.format(hasher_class.__module__, hasher_class.__name__),
+        'params': params,
+        'seconds': seconds,
+        'hashes_per_second': 1 / seconds if seconds else None,
+        'memory_bytes': memory_bytes,
+    }
+
+
+def tune_pbkdf2(target, samples=3, probe_iterations=20000):
+    """
+    PBKDF2 time is linear in the iteration count, so one probe is scaled to
+    the target and the result measured again, and scaled down once more if
+    it overshoots.
+    """
+    seconds = time_hasher(PBKDF2PasswordHasher, {'iterations': probe_iterations}, samples)
+    iterations = probe_iterations
+    for _ in range(2):
+        iterations = max(int(iterations * target / seconds) // 1000 * 1000, 1000)
+        seconds = time_hasher(PBKDF2PasswordHasher, {'iterations': iterations}, samples)
+        if seconds <= target:
+            break
+    return tuning_result('pbkdf2_sha256', PBKDF2PasswordHasher, {'iterations': iterations}, seconds)
+
+
+def tune_scrypt(target, samples=3, block_size=8, parallelism=1, max_memory=64 * 1024 * 1024):
+    """
+    Largest power of two work factor within the target time and memory cap.
+    """
+    best = None
+    work_factor = 2 ** 10
+    while 128 * work_factor * block_size * parallelism <= max_memory:
+        params = {'work_factor': work_factor, 'block_size': block_size, 'parallelism': parallelism}
+        seconds = time_hasher(ScryptPasswordHasher, params, samples)
+        if seconds > target and best is not None:
+            break
+        best = tuning_result('scrypt', ScryptPasswordHasher, params, seconds,
+                             128 * work_factor * block_size * parallelism)
+        if seconds > target:
+            break
+        work_factor *= 2
+    return best
+
+
+def tune_argon2(target, samples=3, memory_cost=19456, parallelism=1):
+    """
+    Highest time cost within the target at `memory_cost` KiB, the memory is
+    halved first when a single pass is already too slow.
+    """
+    params = {'time_cost': 1, 'memory_cost': memory_cost, 'parallelism': parallelism}
+    seconds = time_hasher(Argon2PasswordHasher, params, samples)
+    while seconds > target and params['memory_cost'] > 8 * 1024:
+        params['memory_cost'] //= 2
+        seconds = time_hasher(Argon2PasswordHasher, params, samples)
+
+    while True:
+        candidate = dict(params, time_cost=params['time_cost'] + 1)
+        candidate_seconds = time_hasher(Argon2PasswordHasher, candidate, samples)
+        if candidate_seconds > target:
+            break
+        params, seconds = candidate, candidate_seconds
+    return tuning_result('argon2', Argon2PasswordHasher, params, seconds, params['memory_cost'] * 1024)
+
+
+# Django's own defaults, a recommendation never goes below them. Hashers
+# upgrade any hash whose cost differs from the configured one, so a lower
+# setting would weaken existing hashes on their next login.
+COST_FLOORS = {
+    'pbkdf2_sha256': {'iterations': hashers.PBKDF2PasswordHasher.iterations},
+    'scrypt': {'work_factor': 2 ** 14},
+    'argon2': {'time_cost': hashers.Argon2PasswordHasher.time_cost,
+               'memory_cost': hashers.Argon2PasswordHasher.memory_cost},
+}
+
+
+def apply_cost_floor(result, samples=3):
+    """
+    Raises the parameters of a tuning result that fell below COST_FLOORS and
+    measures it again. The tuned parameters are kept under `below_floor`.
+    """
+    floor = COST_FLOORS.get(result['algorithm'], {})
+    raised = {name: minimum for name, minimum in floor.items() if result['params'].get(name, minimum) < minimum}
+    if not raised:
+        return result
+
+    hasher_class = hashers.import_string(result['hasher'])
+    params = dict(result['params'], **raised)
+    memory_bytes = result['memory_bytes']
+    if result['algorithm'] == 'scrypt':
+        memory_bytes = 128 * params['work_factor'] * params['block_size'] * params['parallelism']
+    elif result['algorithm'] == 'argon2':
+        memory_bytes = params['memory_cost'] * 1024
+
+    floored = tuning_result(result['algorithm'], hasher_class, params, time_hasher(hasher_class, params, samples),
+                            memory_bytes)
+    floored['below_floor'] = result['params']
+    return floored
+
+
+# most preferred first, memory hard algorithms cost attackers more per guess
+TUNERS = (
+    ('argon2', tune_argon2),
+    ('scrypt', tune_scrypt),
+    ('pbkdf2_sha256', tune_pbkdf2),
+)
+
+
+def tune_hashers(target, algorithms=None, samples=3, max_memory=64 * 1024 * 1024, progress=None):
+    """
+    Tunes every available algorithm (all of TUNERS by default) to hash in at
+    most `target` seconds and `max_memory` bytes on this host. Returns the
+    results, most preferred first. Results below COST_FLOORS are raised to
+    it, whatever the target, and carry the tuned parameters in `below_floor`.
+    """
+    memory_options = {
+        'argon2': {'memory_cost': min(19456, max_memory // 1024)},
+        'scrypt': {'max_memory': max_memory},
+    }
+    results = []
+    for algorithm, tuner in TUNERS:
+        if algorithms is not None and algorithm not in algorithms:
+            continue
+        if algorithm == 'argon2' and not argon2_available():
+            if progress is not None:
+                progress(algorithm, None)
+            continue
+
+        result = apply_cost_floor(tuner(target, samples=samples, **memory_options.get(algorithm, {})), samples)
+        results.append(result)
+        if progress is not None:
+            progress(algorithm, result)
+    return results
+
+
+def recommended_config(results, current_hashers):
+    """
+    PASSWORD_HASHERS with the preferred tuned hasher first and the cost
+    parameters of every tuned one. Hashers of the current setting stay listed
+    so existing hashes still verify and are upgraded on login.
+    """
+    tuned = [result['hasher'] for result in results]
+    tuned_algorithms = {result['algorithm'] for result in results}
+
+    password_hashers = list(tuned)
+    for path in current_hashers:
+        algorithm = hashers.import_string(path).algorithm
+        if algorithm not in tuned_algorithms and path not in password_hashers:
+            password_hashers.append(path)
+            tuned_algorithms.add(algorithm)
+
+    return {
+        'PASSWORD_HASHERS': password_hashers,
+        'PASSWORD_HASHER_PARAMS': {result['algorithm']: result['params'] for result in results},
+    }
+
+
+def write_config(config, path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(config, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def hash_label(hasher, encoded):
+    summary = hasher.safe_summary(encoded)
+    params = ' '.join('{}={}'.format(str(key).replace(' ', '_'), value) for key, value in summary.items()
+                      if str(key) not in ('algorithm', 'salt', 'hash'))
+    return '{} {}'.format(hasher.algorithm, params).strip()
+
+
+class HashStatus:
+    """
+    Counts stored password hashes by algorithm and cost, and how many are
+    already in the form the preferred hasher would produce. The rest is
+    upgraded on each user's next successful login.
+    """
+
+    def __init__(self):
+        self.preferred = get_hasher('default')
+        self.total = 0
+        self.current = 0
+        self.unusable = 0
+        self.unknown = 0
+        self.labels = Counter()
+
+    @property
+    def outdated(self):
+        return self.total - self.current - self.unusable - self.unknown
+
+    def add(self, encoded):
+        self.total += 1
+        if not encoded or encoded.startswith(UNUSABLE_PASSWORD_PREFIX):
+            self.unusable += 1
+            return
+
+        try:
+            hasher = identify_hasher(encoded)
+            label = hash_label(hasher, encoded)
+        except (ValueError, IndexError):
+            self.unknown += 1
+            return
+
+        self.labels[label] += 1
+        if hasher.algorithm == self.preferred.algorithm and not self.preferred.must_update(encoded):
+            self.current += 1
+
+    def summary(self):
+        usable = self.total - self.unusable - self.unknown
+        return {
+            'total': self.total,
+            'current': self.current,
+            'outdated': self.outdated,
+            'unusable': self.unusable,
+            'unknown': self.unknown,
+            'migrated_percent': 100.0 * self.current / usable if usable else 100.0,
+            'preferred': hash_label(self.preferred, self.preferred.encode(TUNING_PASSWORD, self.preferred.salt())),
+            'hashes': dict(self.labels.most_common()),
+        }
@@ -0,0 +1,136 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.test.signals import setting_changed
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import Throttled
+
+from users.metrics import PASSWORD_HASH_QUEUE_SECONDS, PASSWORD_HASH_SECONDS, observe, timer
+from users.settings import USER_SETTINGS, cookie_settings
+
+
+class HashingPoolFull(Throttled):
+    default_detail = _('Too many concurrent login attempts.')
+    default_code = 'hashing_pool_full'
+
+
+class HashingExecutor:
+    """
+    Bounded worker pool for password hashing. At most `workers` hashes run at
+    once and at most `queue_size` more wait for a worker, anything above that
+    is rejected immediately with `HashingPoolFull`.
+    """
+
+    def __init__(self, workers, queue_size=0, retry_after=1):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cookiejwt-hashing')
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self._stats = {
+            'submitted': 0,
+            'completed': 0,
+            'rejected': 0,
+            'queue_wait_total': 0.0,
+            'queue_wait_max': 0.0,
+            'hash_time_total': 0.0,
+            'hash_time_max': 0.0,
+        }
+        self.observers = []
+
+    def submit(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise HashingPoolFull(wait=self.retry_after)
+
+        with self._lock:
+            self._stats['submitted'] += 1
+
+        enqueued_at = time.perf_counter()
+
+        def task():
+            started_at = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._record(started_at - enqueued_at, time.perf_counter() - started_at)
+                self._slots.release()
+
+        try:
+            return self._executor.submit(task)
+        except RuntimeError:
+            self._slots.release()
+            raise
+
+    def run(self, fn, *args, **kwargs):
+        return self.submit(fn, *args, **kwargs).result()
+
+    def _record(self, queue_wait, hash_time):
+        with self._lock:
+            self._stats['completed'] += 1
+            self._stats['queue_wait_total'] += queue_wait
+            self._stats['queue_wait_max'] = max(self._stats['queue_wait_max'], queue_wait)
+            self._stats['hash_time_total'] += hash_time
+            self._stats['hash_time_max'] = max(self._stats['hash_time_max'], hash_time)
+
+        for observer in self.observers:
+            observer(queue_wait, hash_time)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, workers=self.workers, queue_size=self.queue_size)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+_hashing_executor = None
+_hashing_executor_lock = threading.Lock()
+
+
+def get_hashing_executor():
+    """
+    Returns the process wide hashing executor or None when hashing runs inline
+    on the request thread.
+    """
+    global _hashing_executor
+
+    if not cookie_settings.HASHING_POOL_WORKERS:
+        return None
+
+    if _hashing_executor is None:
+        with _hashing_executor_lock:
+            if _hashing_executor is None:
+                executor = HashingExecutor(cookie_settings.HASHING_POOL_WORKERS,
+                                           cookie_settings.HASHING_POOL_QUEUE_SIZE,
+                                           cookie_settings.HASHING_POOL_RETRY_AFTER)
+                executor.observers.append(observe_hashing)
+                _hashing_executor = executor
+    return _hashing_executor
+
+
+def observe_hashing(queue_wait, hash_time):
+    observe(PASSWORD_HASH_QUEUE_SECONDS, queue_wait)
+    observe(PASSWORD_HASH_SECONDS, hash_time)
+
+
+def run_hasher(fn, *args, **kwargs):
+    executor = get_hashing_executor()
+    if executor is None:
+        with timer(PASSWORD_HASH_SECONDS):
+            return fn(*args, **kwargs)
+    return executor.run(fn, *args, **kwargs)
+
+
+def reset_hashing_executor(*args, **kwargs):
+    global _hashing_executor
+
+    if kwargs.get('setting', USER_SETTINGS) == USER_SETTINGS and _hashing_executor is not None:
+        _hashing_executor.shutdown(wait=False)
+        _hashing_executor = None
+
+
+setting_changed.connect(reset_hashing_executor)
@@ -0,0 +1,51 @@
+import time
+
+from rest_framework.exceptions import AuthenticationFailed
+
+from users.authentication import CookieAccessTokenAuthentication, CookieRefreshTokenAuthentication
+
+AUTHENTICATION_CLASSES = {
+    'access': CookieAccessTokenAuthentication,
+    'refresh': CookieRefreshTokenAuthentication,
+}
+
+
+def error_message(exc):
+    detail = exc.detail
+    if isinstance(detail, dict):
+        messages = detail.get('messages')
+        if messages:
+            return str(messages[-1]['message'])
+        return str(detail.get('detail', ''))
+    return str(detail)
+
+
+def introspect_tokens(raw_tokens, token_type='access'):
+    """
+    Validates every raw token the same way the cookie authentication classes
+    do and returns one result per token, in order. Duplicates are validated
+    once and the token cache is shared with regular requests.
+    """
+    backend = AUTHENTICATION_CLASSES[token_type]()
+    now = time.time()
+    verdicts = {}
+    results = []
+
+    for raw_token in raw_tokens:
+        verdict = verdicts.get(raw_token)
+        if verdict is None:
+            try:
+                validated_token = backend.get_validated_token(raw_token)
+                backend.check_token(validated_token)
+            except AuthenticationFailed as e:
+                verdict = {'valid': False, 'error': error_message(e)}
+            else:
+                verdict = {
+                    'valid': True,
+                    'claims': validated_token.payload,
+                    'expires_in': max(int(validated_token['exp'] - now), 0),
+                }
+            verdicts[raw_token] = verdict
+        results.append(verdict)
+
+    return results
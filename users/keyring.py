@@ -0,0 +1,245 @@
+import base64
+import json
+
+import jwt
+from django.core.exceptions import ImproperlyConfigured
+from django.test.signals import setting_changed
+from django.utils.translation import gettext_lazy as _
+from jwt import InvalidTokenError
+from jwt.algorithms import get_default_algorithms
+from rest_framework_simplejwt import state
+from rest_framework_simplejwt.backends import TokenBackend
+from rest_framework_simplejwt.exceptions import TokenBackendError
+from rest_framework_simplejwt.settings import api_settings
+
+from users.settings import USER_SETTINGS, cookie_settings
+from users.verification import HMACTokenBackend
+
+ASYMMETRIC_PREFIXES = ('RS', 'PS', 'ES', 'Ed')
+
+EC_CURVES = {
+    'secp256r1': 'P-256',
+    'secp384r1': 'P-384',
+    'secp521r1': 'P-521',
+}
+
+
+def b64url_uint(value, length=None):
+    if length is None:
+        length = max((value.bit_length() + 7) // 8, 1)
+    return base64.urlsafe_b64encode(value.to_bytes(length, 'big')).rstrip(b'=').decode('ascii')
+
+
+def b64url_bytes(value):
+    return base64.urlsafe_b64encode(value).rstrip(b'=').decode('ascii')
+
+
+def read_key_material(config, name):
+    if config.get(name) is not None:
+        value = config[name]
+    elif config.get(name + '_file') is not None:
+        with open(config[name + '_file'], 'rb') as f:
+            value = f.read()
+    else:
+        return None
+    return value.encode('utf-8') if isinstance(value, str) else value
+
+
+class SigningKey:
+    """
+    A single entry of the key ring. PEM material is parsed once here, so
+    encoding and decoding reuse the same key objects.
+    """
+
+    def __init__(self, kid, algorithm, private_key=None, public_key=None, secret=None):
+        self.kid = kid
+        self.algorithm = algorithm
+        self.private_key = private_key
+        self.public_key = public_key
+        self.secret = secret
+
+    @property
+    def is_asymmetric(self):
+        return self.algorithm.startswith(ASYMMETRIC_PREFIXES)
+
+    @property
+    def can_sign(self):
+        return (self.private_key if self.is_asymmetric else self.secret) is not None
+
+    @property
+    def encoding_key(self):
+        return self.private_key if self.is_asymmetric else self.secret
+
+    @property
+    def decoding_key(self):
+        return self.public_key if self.is_asymmetric else self.secret
+
+    @classmethod
+    def from_config(cls, config):
+        try:
+            kid = config['kid']
+            algorithm = config['algorithm']
+        except KeyError as e:
+            raise ImproperlyConfigured("COOKIE_JWT['SIGNING_KEYS'] entries require '{}'".format(e.args[0]))
+
+        if algorithm not in get_default_algorithms() or algorithm == 'none':
+            raise ImproperlyConfigured("Signing key '{}' uses unsupported algorithm '{}'".format(kid, algorithm))
+
+        if not algorithm.startswith(ASYMMETRIC_PREFIXES):
+            secret = read_key_material(config, 'secret')
+            if secret is None:
+                raise ImproperlyConfigured("Signing key '{}' requires 'secret'".format(kid))
+            return cls(kid, algorithm, secret=secret)
+
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives import serialization
+
+        private_key = public_key = None
+
+        private_pem = read_key_material(config, 'private_key')
+        if private_pem is not None:
+            private_key = serialization.load_pem_private_key(private_pem, password=None, backend=default_backend())
+            public_key = private_key.public_key()
+
+        public_pem = read_key_material(config, 'public_key')
+        if public_pem is not None:
+            public_key = serialization.load_pem_public_key(public_pem, backend=default_backend())
+
+        if public_key is None:
+            raise ImproperlyConfigured("Signing key '{}' requires 'private_key' or 'public_key'".format(kid))
+
+        return cls(kid, algorithm, private_key=private_key, public_key=public_key)
+
+    def to_jwk(self):
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+        jwk = {'kid': self.kid, 'alg': self.algorithm, 'use': 'sig'}
+        if isinstance(self.public_key, rsa.RSAPublicKey):
+            numbers = self.public_key.public_numbers()
+            jwk.update(kty='RSA', n=b64url_uint(numbers.n), e=b64url_uint(numbers.e))
+        elif isinstance(self.public_key, ec.EllipticCurvePublicKey):
+            numbers = self.public_key.public_numbers()
+            size = (self.public_key.curve.key_size + 7) // 8
+            jwk.update(kty='EC', crv=EC_CURVES[self.public_key.curve.name],
+                       x=b64url_uint(numbers.x, size), y=b64url_uint(numbers.y, size))
+        else:
+            raw = self.public_key.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+            jwk.update(kty='OKP', crv='Ed25519' if len(raw) == 32 else 'Ed448', x=b64url_bytes(raw))
+        return jwk
+
+
+class KeyRing:
+    """
+    Signing keys indexed by `kid`. Tokens are signed with the active key and
+    verified with whichever key their header names, so a new key can be
+    published before it is activated and an old one kept for verification
+    until the tokens it signed expire.
+    """
+
+    def __init__(self, keys, active_kid=None):
+        self.keys = {key.kid: key for key in keys}
+        if len(self.keys) != len(keys):
+            raise ImproperlyConfigured("COOKIE_JWT['SIGNING_KEYS'] contains duplicate kids")
+
+        if active_kid is None:
+            active_kid = next((key.kid for key in keys if key.can_sign), None)
+
+        self.active = self.keys.get(active_kid)
+        if self.active is None or not self.active.can_sign:
+            raise ImproperlyConfigured("Active signing key '{}' is missing or has no private key".format(active_kid))
+
+        self.jwks = {'keys': [key.to_jwk() for key in keys if key.is_asymmetric]}
+        self.jwks_json = json.dumps(self.jwks).encode('utf-8')
+
+    @classmethod
+    def from_settings(cls):
+        configs = cookie_settings.SIGNING_KEYS
+        if not configs:
+            return None
+        return cls([SigningKey.from_config(config) for config in configs], cookie_settings.ACTIVE_SIGNING_KID)
+
+    def get(self, kid):
+        return self.keys.get(kid)
+
+
+class KeyRingTokenBackend(TokenBackend):
+    """
+    Token backend signing with the active key ring entry and picking the
+    verification key by the `kid` header. Tokens without `kid` fall back to
+    the SIMPLE_JWT algorithm and keys, so existing sessions survive the switch.
+    """
+
+    def __init__(self, keyring, fallback=None, audience=None, issuer=None):
+        self.keyring = keyring
+        self.fallback = fallback
+        self.audience = audience
+        self.issuer = issuer
+
+    @property
+    def algorithm(self):
+        return self.keyring.active.algorithm
+
+    def encode(self, payload):
+        jwt_payload = payload.copy()
+        if self.audience is not None:
+            jwt_payload['aud'] = self.audience
+        if self.issuer is not None:
+            jwt_payload['iss'] = self.issuer
+
+        key = self.keyring.active
+        token = jwt.encode(jwt_payload, key.encoding_key, algorithm=key.algorithm, headers={'kid': key.kid})
+        return token.decode('utf-8')
+
+    def decode(self, token, verify=True):
+        try:
+            kid = jwt.get_unverified_header(token).get('kid')
+        except InvalidTokenError:
+            raise TokenBackendError(_('Token is invalid or expired'))
+
+        if kid is None and self.fallback is not None:
+            return self.fallback.decode(token, verify=verify)
+
+        key = self.keyring.get(kid)
+        if key is None:
+            raise TokenBackendError(_('Token is invalid or expired'))
+
+        try:
+            return jwt.decode(token, key.decoding_key, algorithms=[key.algorithm], verify=verify,
+                              audience=self.audience, issuer=self.issuer,
+                              options={'verify_aud': self.audience is not None})
+        except InvalidTokenError:
+            raise TokenBackendError(_('Token is invalid or expired'))
+
+
+default_token_backend = state.token_backend
+
+
+def get_keyring():
+    backend = state.token_backend
+    return backend.keyring if isinstance(backend, KeyRingTokenBackend) else None
+
+
+def install_token_backend(*args, **kwargs):
+    """
+    Points simplejwt at the key ring backend when COOKIE_JWT['SIGNING_KEYS']
+    is configured, otherwise restores its default backend. With
+    `HMAC_VERIFIER_ENABLED` HMAC signed SIMPLE_JWT tokens are verified by
+    HMACTokenBackend instead of PyJWT.
+    """
+    if kwargs.get('setting', USER_SETTINGS) != USER_SETTINGS:
+        return
+
+    backend = default_token_backend
+    if cookie_settings.HMAC_VERIFIER_ENABLED and HMACTokenBackend.supports(backend):
+        backend = HMACTokenBackend.from_backend(backend)
+
+    keyring = KeyRing.from_settings()
+    if keyring is None:
+        state.token_backend = backend
+    else:
+        fallback = backend if cookie_settings.VERIFY_LEGACY_TOKENS else None
+        state.token_backend = KeyRingTokenBackend(keyring, fallback, api_settings.AUDIENCE, api_settings.ISSUER)
+
+
+setting_changed.connect(install_token_backend)
@@ -0,0 +1,63 @@
+import json
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.audit import AuditStats, audit_stream
+
+
+class Command(BaseCommand):
+    help = "Validates and decodes logged tokens read as JSONL, printing one JSON verdict per line and totals."
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', nargs='?', default='-', help='JSONL file to read, "-" reads stdin.')
+        parser.add_argument('--field', default='token', help='Key holding the token in JSON object lines.')
+        parser.add_argument(
+            '--token-type', choices=('auto', 'access', 'refresh'), default='auto',
+            help='Authentication class to validate with, auto picks it from the token type claim.',
+        )
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Validation processes, 0 validates in this process.')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Lines handed to a worker at once.')
+        parser.add_argument('--output', help='Write verdicts to this file instead of stdout.')
+        parser.add_argument('--stats-only', action='store_true', help='Only print the totals.')
+        parser.add_argument('--bucket', type=int, default=3600, help='Issue time bucket width in seconds.')
+        parser.add_argument('--top-users', type=int, default=20, help='Users listed in the totals.')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 0 or options['chunk_size'] < 1 or options['bucket'] < 1:
+            raise CommandError('--workers must be >= 0, --chunk-size and --bucket must be positive.')
+
+        if options['input'] == '-':
+            lines = sys.stdin
+        else:
+            try:
+                lines = open(options['input'], encoding='utf-8')
+            except OSError as e:
+                raise CommandError(e)
+
+        output = None
+        if options['output']:
+            output = open(options['output'], 'w', encoding='utf-8')
+        elif not options['stats_only']:
+            output = self.stdout
+
+        stats = AuditStats(options['bucket'], options['top_users'])
+        try:
+            for verdict in audit_stream(lines, options['token_type'], options['field'],
+                                        options['workers'], options['chunk_size']):
+                stats.add(verdict)
+                if output is not None:
+                    output.write(json.dumps(verdict) + '\n')
+        finally:
+            if lines is not sys.stdin:
+                lines.close()
+            if output is not None and output is not self.stdout:
+                output.close()
+
+        summary = json.dumps(stats.summary(), indent=2)
+        if output is self.stdout:
+            self.stderr.write(summary)
+        else:
+            self.stdout.write(summary)
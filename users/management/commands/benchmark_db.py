@@ -0,0 +1,43 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from users.benchmark import DatabaseBenchmark, ensure_bench_users
+
+
+class Command(BaseCommand):
+    help = "Measures concurrent user lookups and last_login writes against the default database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=8, help='Number of threads.')
+        parser.add_argument('--operations', type=int, default=2000, help='Total lookups.')
+        parser.add_argument('--write-ratio', type=float, default=0.5, help='Share of lookups followed by a write.')
+        parser.add_argument('--users', type=int, default=100, help='Number of benchmark users.')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['operations'] < 1 or options['users'] < 1:
+            raise CommandError('--concurrency, --operations and --users must be positive.')
+        if not 0 <= options['write_ratio'] <= 1:
+            raise CommandError('--write-ratio must be between 0 and 1.')
+
+        usernames = ensure_bench_users(options['users'])
+        result = DatabaseBenchmark(usernames, options['concurrency'], options['operations'],
+                                   options['write_ratio']).run()
+        result.update(
+            engine=connection.settings_dict['ENGINE'],
+            settings=os.environ.get('DJANGO_SETTINGS_MODULE'),
+            concurrency=options['concurrency'],
+            write_ratio=options['write_ratio'],
+        )
+
+        if options['json']:
+            self.stdout.write(json.dumps(result, indent=2))
+            return
+
+        latency = result['latency_ms']
+        self.stdout.write('{}: {} ops, {} locked, {:.1f} ops/s, p50 {:.2f} ms, p99 {:.2f} ms'.format(
+            result['engine'], result['requests'], result['errors'], result['throughput'],
+            latency['p50'], latency['p99']))
@@ -0,0 +1,29 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.benchmark import rendering_benchmark
+
+
+class Command(BaseCommand):
+    help = "Compares CPU time per request of the lean JSON token views with DRF's default response handling."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=5000, help='Requests per view and variant.')
+        parser.add_argument('--accept', default='*/*', help='Accept header sent with every request.')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be positive.')
+
+        results = rendering_benchmark(options['iterations'], options['accept'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write('{:<16}{:>12}{:>12}{:>12}'.format('endpoint', 'drf us', 'lean us', 'saved us'))
+        for result in results:
+            self.stdout.write('{:<16}{:>12.1f}{:>12.1f}{:>12.1f}'.format(
+                result['endpoint'], result['drf_us'], result['lean_us'], result['saved_us']))
@@ -0,0 +1,96 @@
+import json
+import os
+import platform
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.benchmark import (
+    ENDPOINTS, InProcessClient, SocketClient, TokenBenchmark, ensure_bench_users, start_local_server,
+)
+
+
+class Command(BaseCommand):
+    help = "Measures throughput and latency of the /api/token* endpoints."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mode', choices=['inprocess', 'socket'], default='inprocess',
+            help='Call the WSGI handler directly or go through a local HTTP socket.',
+        )
+        parser.add_argument(
+            '--url',
+            help='Base URL of an already running server (implies socket mode), '
+                 'by default a threaded server is started on a free local port.',
+        )
+        parser.add_argument('--prefix', default='/api/', help='URL prefix the token endpoints are mounted at.')
+        parser.add_argument('--concurrency', type=int, default=4, help='Number of client threads.')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint.')
+        parser.add_argument('--users', type=int, default=10, help='Number of benchmark users to log in as.')
+        parser.add_argument('--passwords', type=int, default=1,
+                            help='Password variants the users were created with, see create_bench_users.')
+        parser.add_argument(
+            '--endpoint', action='append', dest='endpoints', choices=ENDPOINTS,
+            help='Endpoint to benchmark, may be repeated. Defaults to all of them.',
+        )
+        parser.add_argument('--host', default='localhost', help='Host header for in-process requests.')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+        parser.add_argument('--output', help='Also write the JSON results to this file.')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1 or options['users'] < 1:
+            raise CommandError('--concurrency, --requests and --users must be positive.')
+        if options['users'] < options['concurrency']:
+            raise CommandError('--users must be at least --concurrency, threads do not share users.')
+
+        usernames = ensure_bench_users(options['users'], options['passwords'])
+
+        server = None
+        mode = 'socket' if options['url'] else options['mode']
+        if mode == 'socket':
+            base_url = options['url']
+            if base_url is None:
+                server, base_url = start_local_server()
+
+            def client_factory():
+                return SocketClient(base_url)
+        else:
+            def client_factory():
+                return InProcessClient(options['host'])
+
+        benchmark = TokenBenchmark(client_factory, usernames,
+                                   prefix=options['prefix'],
+                                   concurrency=options['concurrency'],
+                                   requests=options['requests'],
+                                   passwords=options['passwords'])
+        try:
+            results = benchmark.run(options['endpoints'] or ENDPOINTS)
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+        report = {
+            'mode': mode,
+            'settings': os.environ.get('DJANGO_SETTINGS_MODULE'),
+            'python': platform.python_version(),
+            'concurrency': options['concurrency'],
+            'requests': options['requests'],
+            'users': options['users'],
+            'endpoints': results,
+        }
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write('{:<16}{:>8}{:>8}{:>12}{:>10}{:>10}{:>10}'.format(
+            'endpoint', 'reqs', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+        for result in results:
+            latency = result['latency_ms']
+            self.stdout.write('{:<16}{:>8}{:>8}{:>12.1f}{:>10.2f}{:>10.2f}{:>10.2f}'.format(
+                result['endpoint'], result['requests'], result['errors'], result['throughput'],
+                latency['p50'], latency['p95'], latency['p99']))
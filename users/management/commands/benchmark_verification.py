@@ -0,0 +1,31 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.benchmark import verification_benchmark
+
+
+class Command(BaseCommand):
+    help = "Compares CPU time per HMAC token verification of PyJWT and HMACTokenBackend."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000, help='Decodes per operation and variant.')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be positive.')
+
+        try:
+            results = verification_benchmark(options['iterations'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write('{:<16}{:>12}{:>12}{:>12}'.format('operation', 'pyjwt us', 'hmac us', 'saved us'))
+        for result in results:
+            self.stdout.write('{:<16}{:>12.1f}{:>12.1f}{:>12.1f}'.format(
+                result['operation'], result['pyjwt_us'], result['hmac_us'], result['saved_us']))
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.benchmark import BENCH_PASSWORD, BENCH_USERNAME, create_bench_users
+
+
+class Command(BaseCommand):
+    help = "Creates benchmark users with deterministic credentials for load testing /api/token."
+
+    def add_arguments(self, parser):
+        parser.add_argument('count', type=int, help='Number of users, existing ones are kept.')
+        parser.add_argument(
+            '--passwords', type=int, default=1,
+            help='Distinct passwords to spread over the users, each is hashed only once.',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='Users inserted per bulk_create.')
+
+    def handle(self, *args, **options):
+        if options['count'] < 1 or options['passwords'] < 1 or options['batch_size'] < 1:
+            raise CommandError('count, --passwords and --batch-size must be positive.')
+
+        count = options['count']
+        started = time.perf_counter()
+        report_every = max(count // 10, 1)
+        reported = [0]
+
+        def progress(done, created):
+            if options['verbosity'] > 1 or done - reported[0] >= report_every or done == count:
+                reported[0] = done
+                elapsed = time.perf_counter() - started
+                self.stdout.write('{}/{} users, {} created, {:.1f} s'.format(done, count, created, elapsed))
+
+        created = create_bench_users(count, options['passwords'], options['batch_size'], progress)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write('created {} users in {:.1f} s ({:.0f} users/s)'.format(
+            created, elapsed, created / elapsed if elapsed else 0))
+        self.stdout.write('usernames {} .. {}, password {}{}'.format(
+            BENCH_USERNAME.format(0), BENCH_USERNAME.format(count - 1), BENCH_PASSWORD,
+            '' if options['passwords'] == 1 else '-<crc32(username) % {}>'.format(options['passwords'])))
@@ -0,0 +1,47 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from users.hashers import HashStatus
+
+
+class Command(BaseCommand):
+    help = ("Reports how many stored password hashes already use the preferred hasher and its current cost, "
+            "the others are rehashed on each user's next login.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Users read per query.')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive.')
+
+        UserModel = get_user_model()
+        status = HashStatus()
+        last_pk = None
+        while True:
+            users = UserModel._default_manager.order_by('pk')
+            if last_pk is not None:
+                users = users.filter(pk__gt=last_pk)
+            rows = list(users.values_list('pk', 'password')[:options['chunk_size']])
+            if not rows:
+                break
+
+            for _, encoded in rows:
+                status.add(encoded)
+            last_pk = rows[-1][0]
+            if options['verbosity'] > 1:
+                self.stdout.write('{} users scanned, {} current'.format(status.total, status.current))
+
+        summary = status.summary()
+        if options['json']:
+            self.stdout.write(json.dumps(summary, indent=2))
+            return
+
+        self.stdout.write('{current} of {total} hashes current ({migrated_percent:.1f}% of usable), {outdated} '
+                          'outdated, {unusable} unusable, {unknown} unknown'.format(**summary))
+        self.stdout.write('preferred: {}'.format(summary['preferred']))
+        for label, count in summary['hashes'].items():
+            self.stdout.write('{:>10}  {}'.format(count, label))
@@ -0,0 +1,40 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.pruning import PruneCheckpoint, outstanding_token_pruner
+
+
+class Command(BaseCommand):
+    help = "Deletes expired outstanding (and blacklisted) refresh tokens in small primary key chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Primary keys covered by one DELETE.')
+        parser.add_argument('--pause', type=float, default=0.05, help='Seconds to sleep after each chunk.')
+        parser.add_argument('--state-file', help='Checkpoint file, an interrupted run resumes from it.')
+        parser.add_argument('--time-budget', type=float, help='Stop after this many seconds.')
+        parser.add_argument('--json', action='store_true', help='Print the statistics as JSON.')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1 or options['pause'] < 0:
+            raise CommandError('--chunk-size must be positive and --pause must not be negative.')
+
+        pruner = outstanding_token_pruner(chunk_size=options['chunk_size'], pause=options['pause'],
+                                          checkpoint=PruneCheckpoint(options['state_file']))
+        if pruner is None:
+            self.stdout.write('rest_framework_simplejwt.token_blacklist is not installed, nothing to prune.')
+            return
+
+        stats = pruner.run(options['time_budget'], progress=self.progress if options['verbosity'] > 1 else None)
+
+        if options['json']:
+            self.stdout.write(json.dumps(stats, indent=2))
+            return
+
+        self.stdout.write('deleted {} rows in {} chunks, {:.1f} s, {:.0f} rows/s{}'.format(
+            stats['deleted'], stats['chunks'], stats['elapsed'], stats['rows_per_second'],
+            '' if stats['done'] else ', resume from pk {}'.format(stats['next_pk'])))
+
+    def progress(self, stats):
+        self.stdout.write('chunk {}: {} rows deleted, {:.0f} rows/s'.format(
+            stats['chunks'], stats['deleted'], stats['rows_per_second']))
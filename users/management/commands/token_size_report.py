@@ -0,0 +1,43 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from rest_framework_simplejwt.settings import api_settings
+
+from users.settings import cookie_settings
+from users.tokens import token_profile_report
+
+
+class Command(BaseCommand):
+    help = "Compares token and Cookie header sizes of the default and compact token profiles."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, default=123456,
+                            help='User the tokens are minted for, an unsaved stand-in when it does not exist.')
+        parser.add_argument(
+            '--refresh-cookie-path', default='/api/token/refresh',
+            help='refresh_token cookie path assumed for the compact profile.',
+        )
+        parser.add_argument('--requests', type=int, default=1000000, help='Request volume to extrapolate to.')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+
+    def handle(self, *args, **options):
+        UserModel = get_user_model()
+        user_filter = {api_settings.USER_ID_FIELD: options['user_id']}
+        user = UserModel._default_manager.filter(**user_filter).first() or UserModel(**user_filter)
+
+        report = token_profile_report(user, options['refresh_cookie_path'])
+        report['current_profile'] = cookie_settings.TOKEN_PROFILE
+        report['saved_bytes_total'] = report['saved_bytes_per_request'] * options['requests']
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        for name in ('default', 'compact'):
+            profile = report[name]
+            self.stdout.write('{:<8} access {:>4} B  refresh {:>4} B  cookie header {:>4} B/request'.format(
+                name, profile['access_token_bytes'], profile['refresh_token_bytes'],
+                profile['cookie_bytes_per_request']))
+        self.stdout.write('saved {} B per request, {:.1f} MB per {} requests'.format(
+            report['saved_bytes_per_request'], report['saved_bytes_total'] / 1e6, options['requests']))
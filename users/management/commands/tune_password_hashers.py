@@ -0,0 +1,89 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from users.hashers import TUNERS, format_params, recommended_config, tune_hashers, write_config
+from users.settings import cookie_settings
+
+
+class Command(BaseCommand):
+    help = ("Calibrates the cost of each available password hasher on this host to a target hash time and "
+            "prints or writes the resulting PASSWORD_HASHERS configuration.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target-ms', type=float, default=100.0, help='Longest acceptable time of one hash.')
+        parser.add_argument('--min-throughput', type=float, default=None,
+                            help='Hashes per second one core must sustain, lowers the target time if needed.')
+        parser.add_argument('--algorithms', nargs='+', choices=[algorithm for algorithm, _ in TUNERS],
+                            help='Algorithms to tune, all available ones by default.')
+        parser.add_argument('--samples', type=int, default=3, help='Timed hashes per candidate, the median counts.')
+        parser.add_argument('--max-memory-mib', type=int, default=64, help='Memory limit of one hash.')
+        parser.add_argument('--write', metavar='PATH', nargs='?', const='',
+                            help='Write the configuration as JSON, to PASSWORD_HASHERS_FILE without a path.')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+
+    def handle(self, *args, **options):
+        if options['target_ms'] <= 0:
+            raise CommandError('--target-ms must be positive.')
+        if options['samples'] < 1:
+            raise CommandError('--samples must be positive.')
+        if options['max_memory_mib'] < 1:
+            raise CommandError('--max-memory-mib must be positive.')
+        if options['min_throughput'] is not None and options['min_throughput'] <= 0:
+            raise CommandError('--min-throughput must be positive.')
+        if options['write'] == '':
+            options['write'] = getattr(settings, 'PASSWORD_HASHERS_FILE', None)
+            if not options['write']:
+                raise CommandError('--write needs a path when PASSWORD_HASHERS_FILE is not set.')
+
+        target = options['target_ms'] / 1000
+        if options['min_throughput'] is not None:
+            target = min(target, 1 / options['min_throughput'])
+
+        def progress(algorithm, result):
+            if options['verbosity'] < 2:
+                return
+            if result is None:
+                self.stdout.write('{}: not available'.format(algorithm))
+            else:
+                self.stdout.write('{}: {} in {:.1f} ms'.format(algorithm, result['params'], result['seconds'] * 1000))
+
+        results = tune_hashers(target, algorithms=options['algorithms'], samples=options['samples'],
+                               max_memory=options['max_memory_mib'] * 2 ** 20, progress=progress)
+        if not results:
+            raise CommandError('None of the requested algorithms is available.')
+
+        workers = cookie_settings.HASHING_POOL_WORKERS or 1
+        for result in results:
+            result['logins_per_second'] = result['hashes_per_second'] * workers
+
+        for result in results:
+            if 'below_floor' in result:
+                self.stderr.write(
+                    'WARNING: {} only meets {:.1f} ms with {}, below Django\'s default cost. Recommending {} '
+                    '({:.1f} ms) instead, a lower cost would weaken existing hashes when they are upgraded on '
+                    'login.'.format(result['algorithm'], target * 1000, format_params(result['below_floor']),
+                                    format_params(result['params']), result['seconds'] * 1000))
+
+        config = recommended_config(results, settings.PASSWORD_HASHERS)
+        if options['write']:
+            write_config(config, options['write'])
+
+        if options['json']:
+            self.stdout.write(json.dumps({'target_ms': target * 1000, 'workers': workers, 'results': results,
+                                          'config': config}, indent=2))
+            return
+
+        self.stdout.write('{:<16}{:>12}{:>12}{:>12}{:>10}  {}'.format(
+            'algorithm', 'ms', 'hashes/s', 'logins/s', 'MiB', 'params'))
+        for result in results:
+            memory = result['memory_bytes'] / 2 ** 20 if result['memory_bytes'] else 0
+            self.stdout.write('{:<16}{:>12.1f}{:>12.1f}{:>12.1f}{:>10.1f}  {}'.format(
+                result['algorithm'], result['seconds'] * 1000, result['hashes_per_second'],
+                result['logins_per_second'], memory, format_params(result['params'])))
+
+        if options['write']:
+            self.stdout.write('Wrote {}, existing hashes are upgraded on their next login.'.format(options['write']))
+        else:
+            self.stdout.write(json.dumps(config, indent=2))
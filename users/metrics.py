@@ -0,0 +1,247 @@
+import functools
+import ipaddress
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from users.settings import cookie_settings
+
+DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _format_labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(name, escape_label(value)) for name, value in pairs) + '}'
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def collect(self):
+        raise NotImplementedError('Must implement `collect` method for `Metric` subclasses')
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def collect(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield '{}{} {}'.format(self.name, self._format_labels(key), format_value(value))
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels):
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def collect(self):
+        with self._lock:
+            values = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+        for key, (bucket_counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), bucket_counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else format_value(bound)
+                yield '{}_bucket{} {}'.format(self.name, self._format_labels(key, [('le', le)]), cumulative)
+            yield '{}_sum{} {}'.format(self.name, self._format_labels(key), format_value(total))
+            yield '{}_count{} {}'.format(self.name, self._format_labels(key), count)
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+    def render(self):
+        # every worker process keeps its own values, a scrape only sees the
+        # slice of the process that served it
+        lines = ['# cookiejwt metrics of process {}'.format(os.getpid())]
+        for metric in self.metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.documentation))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+def metrics_client_allowed(request):
+    """
+    Whether REMOTE_ADDR is inside one of COOKIE_JWT['METRICS_ALLOWED_NETWORKS'].
+    Forwarded headers are ignored, they are set by whoever sends the request.
+    """
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False)
+               for network in cookie_settings.METRICS_ALLOWED_NETWORKS)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+registry = Registry()
+
+AUTHENTICATION_TOTAL = registry.register(Counter(
+    'cookiejwt_authentication_total', 'Cookie authentication attempts by outcome.', ('cookie', 'outcome')))
+TOKEN_DECODE_SECONDS = registry.register(Histogram(
+    'cookiejwt_token_decode_seconds', 'Time spent validating a raw token, cache lookups included.', ('cookie',)))
+PASSWORD_HASH_SECONDS = registry.register(Histogram(
+    'cookiejwt_password_hash_seconds', 'Time spent in the password hasher.'))
+PASSWORD_HASH_QUEUE_SECONDS = registry.register(Histogram(
+    'cookiejwt_password_hash_queue_seconds', 'Time password hashing jobs waited for a pool worker.'))
+PASSWORD_REHASH_TOTAL = registry.register(Counter(
+    'cookiejwt_password_rehash_total', 'Passwords rehashed on login by the algorithm they were stored with.',
+    ('algorithm',)))
+USER_LOOKUP_SECONDS = registry.register(Histogram(
+    'cookiejwt_user_lookup_seconds', 'Time spent loading the user on login.'))
+COOKIE_SERIALIZATION_SECONDS = registry.register(Histogram(
+    'cookiejwt_cookie_serialization_seconds', 'Time spent setting token cookies on a response.', ('view',)))
+REFRESH_COALESCED_TOTAL = registry.register(Counter(
+    'cookiejwt_refresh_coalesced_total', 'Coalesced token refreshes, minted (leader) or shared (follower).',
+    ('role',)))
+VIEW_SECONDS = registry.register(Histogram(
+    'cookiejwt_view_seconds', 'Token endpoint latency by view and status code.', ('view', 'status')))
+
+
+def metrics_enabled():
+    return cookie_settings.METRICS_ENABLED
+
+
+class NullTimer:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class Timer:
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+def timer(histogram, **labels):
+    """
+    Context manager observing the duration of its block, a shared no-op
+    when metrics are disabled.
+    """
+    if not cookie_settings.METRICS_ENABLED:
+        return NULL_TIMER
+    return Timer(histogram, labels)
+
+
+def inc(counter, **labels):
+    if cookie_settings.METRICS_ENABLED:
+        counter.inc(**labels)
+
+
+def observe(histogram, value, **labels):
+    if cookie_settings.METRICS_ENABLED:
+        histogram.observe(value, **labels)
+
+
+class InstrumentedViewMixin:
+    """
+    Records latency of DRF views under their `metrics_name`.
+    """
+    metrics_name = None
+
+    def dispatch(self, request, *args, **kwargs):
+        if not cookie_settings.METRICS_ENABLED:
+            return super().dispatch(request, *args, **kwargs)
+
+        started = time.perf_counter()
+        response = super().dispatch(request, *args, **kwargs)
+        VIEW_SECONDS.observe(time.perf_counter() - started, view=self.metrics_name, status=response.status_code)
+        return response
+
+
+def instrument_async_view(name):
+    """
+    Same as InstrumentedViewMixin for coroutine views.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if not cookie_settings.METRICS_ENABLED:
+                return await view(request, *args, **kwargs)
+
+            started = time.perf_counter()
+            response = await view(request, *args, **kwargs)
+            VIEW_SECONDS.observe(time.perf_counter() - started, view=name, status=response.status_code)
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,95 @@
+import time
+
+from rest_framework_simplejwt import state
+from rest_framework_simplejwt.exceptions import TokenBackendError, TokenError
+
+from users.authentication import attach_cookie_user, get_cookie
+from users.serializers import CookieTokenRefreshSerializer
+from users.settings import cookie_settings
+from users.views import set_refresh_cookies
+
+
+class CookieAuthenticationMiddleware:
+    """
+    Makes the JWT user available to every view and middleware as
+    `request.user`, not only to DRF views. Only the `access_token` cookie is
+    read from the raw Cookie header. The token is validated on first use of
+    `request.user`, and CookieAccessTokenAuthentication reuses that result.
+
+    A user logged in through the session by earlier middleware
+    (AuthenticationMiddleware) is kept, as is the anonymous user of requests
+    without a valid access token. AnonymousUser without that middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request._cookiejwt_auth = {}
+        request._cookiejwt_fallback_user = getattr(request, 'user', None)
+        attach_cookie_user(request)
+        return self.get_response(request)
+
+
+class SlidingAccessTokenMiddleware:
+    """
+    Renews an access token which is missing, expired or about to expire from
+    the `refresh_token` cookie and sets the new cookies on the same response,
+    so clients never have to call /api/token/refresh themselves.
+
+    Views with a false `sliding_renewal` attribute (the token endpoints) are
+    left alone.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        renewed = getattr(request, '_cookiejwt_renewed', None)
+        if renewed is not None and 'access_token' not in response.cookies:
+            set_refresh_cookies(response, renewed)
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, 'cls', view_func)
+        if not getattr(view, 'sliding_renewal', True):
+            return None
+
+        raw_refresh = get_cookie(request, 'refresh_token')
+        if raw_refresh is None or not self.needs_renewal(get_cookie(request, 'access_token')):
+            return None
+
+        serializer = CookieTokenRefreshSerializer(data={'refresh': raw_refresh})
+        try:
+            if not serializer.is_valid():
+                return None
+        except TokenError:
+            return None
+
+        renewed = serializer.validated_data
+
+        # authenticate the rest of this request with the new tokens
+        request.COOKIES['access_token'] = renewed['access']
+        if 'refresh' in renewed:
+            request.COOKIES['refresh_token'] = renewed['refresh']
+        if hasattr(request, '_cookiejwt_auth'):
+            attach_cookie_user(request)
+
+        request._cookiejwt_renewed = renewed
+        return None
+
+    def needs_renewal(self, raw_access):
+        if raw_access is None:
+            return True
+
+        try:
+            # signature is not checked here, this only decides whether to renew
+            payload = state.token_backend.decode(raw_access, verify=False)
+            exp = float(payload['exp'])
+        except (TokenBackendError, KeyError, TypeError, ValueError):
+            return True
+
+        return exp - time.time() <= cookie_settings.SLIDING_RENEWAL_THRESHOLD
@@ -0,0 +1,176 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from django.db import connections
+from django.db.models import Max, Min
+from django.test.signals import setting_changed
+from django.utils import timezone
+
+from users.settings import USER_SETTINGS, cookie_settings
+from users.writebehind import blacklist_installed
+
+logger = logging.getLogger(__name__)
+
+
+class PruneCheckpoint:
+    """
+    Next primary key to look at, kept in a small JSON file so an interrupted
+    run continues where it stopped. Without a path it only lives in memory.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.next_pk = None
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.next_pk = json.load(f).get('next_pk')
+
+    def save(self, next_pk):
+        self.next_pk = next_pk
+        if self.path:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'next_pk': next_pk}, f)
+            os.replace(tmp_path, self.path)
+
+
+class ExpiredRowPruner:
+    """
+    Deletes rows of `model` whose `expires_field` is in the past, walking the
+    table in primary key windows of `chunk_size` so every DELETE is a short
+    index range scan in its own transaction. Sleeps `pause` seconds after
+    every window that deleted rows to leave the database to request handling.
+    """
+
+    def __init__(self, model, expires_field='expires_at', chunk_size=1000, pause=0.05, checkpoint=None):
+        self.model = model
+        self.expires_field = expires_field
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.checkpoint = checkpoint or PruneCheckpoint()
+
+    def run(self, time_budget=None, progress=None):
+        """
+        Prunes up to the highest primary key present when the run started and
+        returns its statistics. With `time_budget` (seconds) the run stops
+        early and the next one resumes from the checkpoint. `progress` is
+        called with the running statistics after every window.
+        """
+        manager = self.model._base_manager
+        bounds = manager.aggregate(low=Min('pk'), high=Max('pk'))
+        cutoff = timezone.now()
+        started = time.monotonic()
+
+        stats = {'deleted': 0, 'chunks': 0, 'elapsed': 0.0, 'rows_per_second': 0.0, 'done': True}
+        if bounds['high'] is None:
+            self.checkpoint.save(None)
+            return stats
+
+        low = self.checkpoint.next_pk
+        if low is None or low < bounds['low']:
+            low = bounds['low']
+
+        while low <= bounds['high']:
+            high = low + self.chunk_size
+            deleted, _ = manager.filter(pk__gte=low, pk__lt=high,
+                                        **{self.expires_field + '__lte': cutoff}).delete()
+            low = high
+            self.checkpoint.save(low)
+
+            stats['deleted'] += deleted
+            stats['chunks'] += 1
+            stats['elapsed'] = time.monotonic() - started
+            stats['rows_per_second'] = stats['deleted'] / stats['elapsed'] if stats['elapsed'] else 0.0
+            if progress is not None:
+                progress(stats)
+
+            if time_budget is not None and stats['elapsed'] >= time_budget:
+                stats['done'] = low > bounds['high']
+                break
+            if deleted and self.pause:
+                time.sleep(self.pause)
+
+        if stats['done']:
+            # wrap around, the next run starts from the lowest key again
+            self.checkpoint.save(None)
+        stats['next_pk'] = self.checkpoint.next_pk
+        return stats
+
+
+def outstanding_token_pruner(**kwargs):
+    """
+    Pruner of the simplejwt blacklist tables, deleting an OutstandingToken
+    also deletes its BlacklistedToken. Returns None when the blacklist app
+    is not installed.
+    """
+    if not blacklist_installed():
+        return None
+
+    from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+
+    return ExpiredRowPruner(OutstandingToken, 'expires_at', **kwargs)
+
+
+class PruningThread(threading.Thread):
+    """
+    Runs `pruner` every `interval` seconds in the background.
+    """
+
+    def __init__(self, pruner, interval):
+        super().__init__(name='cookiejwt-pruning', daemon=True)
+        self.pruner = pruner
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                stats = self.pruner.run()
+                logger.info('Pruned %d expired rows at %.0f rows/s', stats['deleted'], stats['rows_per_second'])
+            except Exception:
+                logger.exception('Pruning expired rows failed')
+            finally:
+                connections.close_all()
+
+    def stop(self):
+        self._stopped.set()
+
+
+_pruning_thread = None
+_pruning_thread_lock = threading.Lock()
+
+
+def start_pruning_thread():
+    """
+    Starts the periodic in-process pruning when `PRUNE_INTERVAL` is set and
+    there is something to prune.
+    """
+    global _pruning_thread
+
+    if not cookie_settings.PRUNE_INTERVAL:
+        return None
+
+    with _pruning_thread_lock:
+        if _pruning_thread is None:
+            pruner = outstanding_token_pruner(chunk_size=cookie_settings.PRUNE_CHUNK_SIZE,
+                                              pause=cookie_settings.PRUNE_PAUSE)
+            if pruner is None:
+                return None
+
+            _pruning_thread = PruningThread(pruner, cookie_settings.PRUNE_INTERVAL)
+            _pruning_thread.start()
+    return _pruning_thread
+
+
+def stop_pruning_thread(*args, **kwargs):
+    global _pruning_thread
+
+    if kwargs.get('setting', USER_SETTINGS) == USER_SETTINGS and _pruning_thread is not None:
+        _pruning_thread.stop()
+        _pruning_thread = None
+
+
+setting_changed.connect(stop_pruning_thread)
@@ -0,0 +1,41 @@
+import json
+
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import JSONRenderer
+
+# static response bodies, encoded once
+EMPTY_JSON_BODY = b'{}'
+
+
+class FixedJSONNegotiation(DefaultContentNegotiation):
+    """
+    Always answers with the first renderer without looking at the Accept
+    header or a format suffix. Request parsing is left as it is.
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        renderer = renderers[0]
+        return renderer, renderer.media_type
+
+
+def json_body(data):
+    # same output as JSONRenderer with COMPACT_JSON
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+class LeanJSONMixin:
+    """
+    Fast response path for the token views. Their responses are small
+    fixed-shape dicts, so they skip content negotiation and the browsable
+    API. `json_response` encodes straight into an HttpResponse instead of
+    going through Response and the renderer. Error responses raised from the
+    view still go through DRF's exception handler and JSONRenderer.
+    """
+    renderer_classes = (JSONRenderer,)
+    content_negotiation_class = FixedJSONNegotiation
+
+    def json_response(self, data=None, status=status.HTTP_200_OK, body=None):
+        return HttpResponse(json_body(data) if body is None else body,
+                            status=status, content_type='application/json')
@@ -1,6 +1,26 @@
+from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
-from rest_framework_simplejwt.serializers import TokenObtainSerializer
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.serializers import TokenObtainSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+
+from users.claims import add_user_claims
+from users.coalescing import coalesce_refresh
+from users.denylist import check_denylist, get_denylist
+from users.generations import add_generation_claim, check_generation
+from users.settings import cookie_settings
+from users.tokens import get_refresh_token_class
+from users.writebehind import record_login, refresh_token_for_user
+
+
+def issue_access_token(refresh):
+    """
+    Access token of `refresh` with the user claims. The remember choice only
+    matters for reissuing the refresh cookie and is not copied over.
+    """
+    access = refresh.access_token
+    access.payload.pop(cookie_settings.REMEMBER_CLAIM, None)
+    add_user_claims(access)
+    return access
 
 
 class TokenDetailPairObtainSerializer(TokenObtainSerializer):
@@ -11,15 +31,67 @@ class TokenDetailPairObtainSerializer(TokenObtainSerializer):
 
     @classmethod
     def get_token(cls, user):
-        return RefreshToken.for_user(user)
+        token = refresh_token_for_user(get_refresh_token_class(), user)
+        add_generation_claim(token, user)
+        return token
 
     def validate(self, attrs):
         data = super().validate(attrs)
         refresh = self.get_token(self.user)
+        remember = attrs.get('remember', False)
+        if remember:
+            refresh[cookie_settings.REMEMBER_CLAIM] = 1
+
+        access = issue_access_token(refresh)
 
         data['refresh'] = str(refresh)
-        data['access'] = str(refresh.access_token)
+        data['access'] = str(access)
         data['user_id'] = self.user.id
-        data['remember'] = attrs.get('remember', False)
+        data['remember'] = remember
+
+        record_login(self.user)
+
+        return data
+
+
+class CookieTokenRefreshSerializer(TokenRefreshSerializer):
+
+    def validate(self, attrs):
+        return coalesce_refresh(attrs['refresh'], lambda: self.refresh_tokens(attrs['refresh']))
+
+    def refresh_tokens(self, raw_token):
+        refresh = get_refresh_token_class()(raw_token)
+        check_denylist(refresh)
+        check_generation(refresh)
+
+        # claims come from the cache, not from the refresh token, so they follow
+        # changes to the user
+        access = issue_access_token(refresh)
+
+        # a rotated token keeps the claim, so the cookies stay session cookies
+        # for logins without `remember`
+        data = {'access': str(access), 'remember': bool(refresh.get(cookie_settings.REMEMBER_CLAIM))}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            denylist = get_denylist()
+            if api_settings.BLACKLIST_AFTER_ROTATION and denylist is not None:
+                denylist.revoke(refresh[api_settings.JTI_CLAIM], refresh['exp'])
+
+            refresh.set_jti()
+            refresh.set_exp()
+
+            data['refresh'] = str(refresh)
 
         return data
+
+
+class TokenIntrospectionSerializer(serializers.Serializer):
+    tokens = serializers.ListField(child=serializers.CharField(), allow_empty=False)
+    token_type = serializers.ChoiceField(choices=('access', 'refresh'), default='access')
+
+    def validate_tokens(self, tokens):
+        max_tokens = cookie_settings.INTROSPECTION_MAX_TOKENS
+        if len(tokens) > max_tokens:
+            raise serializers.ValidationError(
+                _('Ensure this field has no more than {max_length} elements.').format(max_length=max_tokens))
+        return tokens
@@ -0,0 +1,152 @@
+from django.conf import settings
+from django.test.signals import setting_changed
+
+USER_SETTINGS = 'COOKIE_JWT'
+
+DEFAULTS = {
+    # in-process cache of validated tokens
+    'TOKEN_CACHE_ENABLED': False,
+    'TOKEN_CACHE_SIZE': 1024,
+    'TOKEN_CACHE_TTL': None,
+
+    # serve the token endpoints with coroutine views (ASGI deployments)
+    'ASYNC_VIEWS': False,
+
+    # bounded password hashing pool used by HashingPoolModelBackend,
+    # 0 workers hashes inline on the request thread
+    'HASHING_POOL_WORKERS': 0,
+    'HASHING_POOL_QUEUE_SIZE': 0,
+    'HASHING_POOL_RETRY_AFTER': 1,
+
+    # cost parameters of the users.hashers password hashers by algorithm,
+    # e.g. {'pbkdf2_sha256': {'iterations': 260000}}, see tune_password_hashers
+    'PASSWORD_HASHER_PARAMS': {},
+
+    # kid indexed signing keys, replaces the SIMPLE_JWT signing key when set
+    'SIGNING_KEYS': [],
+    'ACTIVE_SIGNING_KID': None,
+    'VERIFY_LEGACY_TOKENS': True,
+    'JWKS_MAX_AGE': 300,
+
+    # verify HS256/384/512 SIMPLE_JWT tokens with precomputed HMAC state
+    # instead of PyJWT's generic decode
+    'HMAC_VERIFIER_ENABLED': False,
+
+    # refresh token denylist used for rotation, None disables it. The in-memory
+    # store is per process, use CacheDenylistStore with more than one worker
+    'DENYLIST_STORE': 'users.denylist.InMemoryDenylistStore',
+    'DENYLIST_STORE_OPTIONS': {},
+    'DENYLIST_FILTER_CAPACITY': 100000,
+    'DENYLIST_FILTER_ERROR_RATE': 0.001,
+    # seconds a filter miss is trusted without replaying the store's changes,
+    # revocations of other workers go unseen that long. At 0 a shared store
+    # is read on every filter miss
+    'DENYLIST_SYNC_INTERVAL': 0,
+
+    # memory mapped per-user token generations, None disables them
+    'GENERATION_TABLE_PATH': None,
+    'GENERATION_TABLE_SLOTS': 65536,
+    'GENERATION_CLAIM': 'gen',
+
+    # SlidingAccessTokenMiddleware renews access tokens expiring within this
+    # many seconds
+    'SLIDING_RENEWAL_THRESHOLD': 60,
+
+    # refreshes of the same refresh token within this many seconds share
+    # one set of minted tokens, 0 disables coalescing
+    'REFRESH_COALESCE_WINDOW': 0,
+    'REFRESH_COALESCE_SIZE': 10000,
+
+    # claims added to access tokens on login and refresh: 'groups',
+    # 'permissions' or user fields, cached per user until the user, its
+    # groups or permissions change
+    'USER_CLAIMS': [],
+    'CLAIMS_CACHE': 'users.claims.InMemoryClaimsCache',
+    'CLAIMS_CACHE_OPTIONS': {},
+
+    # 'compact' issues tokens with short type values and jti-less access tokens
+    'TOKEN_PROFILE': 'default',
+    'REFRESH_COOKIE_PATH': '/',
+    # SameSite of both token cookies. The token views are csrf exempt, Strict
+    # keeps the cookies off cross-site requests and so is their CSRF defence
+    'COOKIE_SAMESITE': 'Strict',
+    # refresh token claim of `remember: true` logins, refreshes reissue
+    # session cookies for tokens without it
+    'REMEMBER_CLAIM': 'rem',
+
+    # upper bound of tokens accepted by one /api/token/introspect call and the
+    # clients allowed to call it, {client id: secret} sent with HTTP Basic
+    'INTROSPECTION_MAX_TOKENS': 100,
+    'INTROSPECTION_CLIENTS': {},
+
+    # in-process counters and histograms served at /metrics to clients whose
+    # REMOTE_ADDR is in one of the networks
+    'METRICS_ENABLED': False,
+    'METRICS_ALLOWED_NETWORKS': ('127.0.0.1/32', '::1/128'),
+
+    # (burst, refill per second) token buckets of failed login attempts,
+    # checked before any password hashing, None disables a scope
+    'LOGIN_THROTTLE_RATES': {
+        'ip': None,
+        'username': None,
+    },
+    'LOGIN_THROTTLE_BACKEND': 'users.throttling.InMemoryTokenBucketLimiter',
+    'LOGIN_THROTTLE_OPTIONS': {},
+    # reverse proxies in front of the app that append to X-Forwarded-For,
+    # 0 keys the 'ip' scope by REMOTE_ADDR
+    'LOGIN_THROTTLE_PROXIES': 0,
+
+    # store last_login on token obtain, with write-behind enabled it and the
+    # blacklist app's OutstandingToken rows are written in batches off the
+    # request thread
+    'UPDATE_LAST_LOGIN': False,
+    'WRITE_BEHIND_ENABLED': False,
+    'WRITE_BEHIND_BATCH_SIZE': 100,
+    'WRITE_BEHIND_FLUSH_INTERVAL': 1.0,
+    # pending entries kept while writes fail, older ones are dropped
+    'WRITE_BEHIND_MAX_PENDING': 10000,
+
+    # background pruning of expired blacklist app rows every PRUNE_INTERVAL
+    # seconds, None leaves it to the prune_tokens command
+    'PRUNE_INTERVAL': None,
+    'PRUNE_CHUNK_SIZE': 1000,
+    'PRUNE_PAUSE': 0.05,
+}
+
+
+class CookieSettings:
+    """
+    Lazy accessor for the `COOKIE_JWT` settings dict, falling back to DEFAULTS
+    for keys which were not overridden.
+    """
+
+    def __init__(self, defaults=None):
+        self.defaults = defaults or DEFAULTS
+        self._cached_attrs = set()
+
+    def __getattr__(self, attr):
+        if attr not in self.defaults:
+            raise AttributeError("Invalid COOKIE_JWT setting: '{}'".format(attr))
+
+        user_settings = getattr(settings, USER_SETTINGS, {})
+        value = user_settings.get(attr, self.defaults[attr])
+
+        self._cached_attrs.add(attr)
+        setattr(self, attr, value)
+        return value
+
+    def reload(self):
+        for attr in self._cached_attrs:
+            delattr(self, attr)
+        self._cached_attrs.clear()
+
+
+cookie_settings = CookieSettings(DEFAULTS)
+
+
+def reload_cookie_settings(*args, **kwargs):
+    if kwargs['setting'] == USER_SETTINGS:
+        cookie_settings.reload()
+
+
+setting_changed.connect(reload_cookie_settings)
@@ -1,14 +1,63 @@
+import base64
+import hmac
 import json
+import multiprocessing
 import os
+import tempfile
+import threading
+import time
 from http import cookies
 import datetime
+import unittest
+import warnings
+from io import StringIO
+from unittest import mock
 
+import jwt
+
+from cookiejwt import settings_auth
+from django.contrib.auth.hashers import check_password, make_password
+from django.contrib.auth.models import AnonymousUser, Group, Permission
+from django.core.cache.backends.base import CacheKeyWarning
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import DataError, OperationalError, connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
+from rest_framework_simplejwt import state
+from rest_framework_simplejwt.backends import TokenBackend
+from rest_framework_simplejwt.exceptions import TokenBackendError, TokenError
 from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 from rest_framework_simplejwt.settings import api_settings
-from users.authentication import CookieAccessTokenAuthentication
+from users.audit import AuditStats, audit_stream
+from users.authentication import CookieAccessTokenAuthentication, CookieRefreshTokenAuthentication, get_cookie
+from users.benchmark import bench_password, create_bench_users, percentile
+from users.cache import TokenCache, get_token_cache
+from users.claims import (
+    CacheClaimsCache, add_user_claims, build_user_claims, get_claims_cache, get_user_claims, reset_claims_cache,
+)
+from users.coalescing import SingleFlight, reset_refresh_flights
+from users.db import write_atomic
+from users.denylist import AgingBloomFilter, BloomFilter, CacheDenylistStore, Denylist, get_denylist
+from users.generations import GenerationTable, GenerationTableFull, get_generation_table
+from users.hashers import (
+    COST_FLOORS, HashStatus, ScryptPasswordHasher, apply_cost_floor, recommended_config, tune_pbkdf2, tuning_result,
+)
+from users.hashing import get_hashing_executor
+from users.keyring import get_keyring
+from users.metrics import (
+    AUTHENTICATION_TOTAL, PASSWORD_HASH_SECONDS, PASSWORD_REHASH_TOTAL, REFRESH_COALESCED_TOTAL, VIEW_SECONDS, registry,
+)
+from users.middleware import CookieAuthenticationMiddleware, SlidingAccessTokenMiddleware
 from users.models import User
+from users.pruning import ExpiredRowPruner, PruneCheckpoint
+from users.throttling import CacheTokenBucketLimiter, InMemoryTokenBucketLimiter, reset_login_limiters
+from users.verification import HMAC_ALGORITHMS, HMACTokenBackend
+from users.views import CookieTokenVerify
+from users.writebehind import WriteBehindBuffer, get_write_behind
 
 
 class TestCookieTokenVerify(APITestCase):
@@ -26,7 +75,7 @@ class TestCookieTokenVerify(APITestCase):
 
         response = self.client.get('/api/token/verify')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data['user_id'], u.id)
+        self.assertEqual(response.json()['user_id'], u.id)
 
     def test_cookie_token_verify_wrong_token(self):
         token_cookie = cookies.SimpleCookie({'access_token': str(os.urandom(32))})
@@ -60,10 +109,12 @@ class TestCookieTokenObtain(APITestCase):
 
         self.assertTrue(raw_token['httponly'])
         self.assertEqual(raw_token['expires'], '')
+        self.assertEqual(raw_token['samesite'], 'Strict')
 
         raw_refresh = response.client.cookies['refresh_token']
         self.assertTrue(raw_refresh['httponly'])
         self.assertEqual(raw_refresh['expires'], '')
+        self.assertEqual(raw_refresh['samesite'], 'Strict')
 
         backend = CookieAccessTokenAuthentication()
         validated_token = backend.get_validated_token(raw_token.value)
@@ -187,3 +238,1859 @@ class TestCookieTokenClear(APITestCase):
 
         self.assertEqual(raw_access.value, "")
         self.assertEqual(raw_refresh.value, "")
+
+
+@override_settings(COOKIE_JWT={'TOKEN_CACHE_ENABLED': True, 'TOKEN_CACHE_SIZE': 2})
+class TestTokenCache(APITestCase):
+
+    def setUp(self):
+        user = User(username='testuser', email='test@test.com')
+        user.set_password('testpassword')
+        user.save()
+
+    def test_cache_hit_on_repeated_verify(self):
+        u = User.objects.first()
+        token = AccessToken.for_user(u)
+        self.client.cookies = cookies.SimpleCookie({'access_token': token})
+
+        for _ in range(3):
+            response = self.client.get('/api/token/verify')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        stats = get_token_cache().stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 2)
+
+    def test_cache_bounded_size(self):
+        u = User.objects.first()
+        backend = CookieAccessTokenAuthentication()
+        for _ in range(3):
+            backend.get_validated_token(str(AccessToken.for_user(u)))
+
+        self.assertEqual(len(get_token_cache()), 2)
+
+    def test_cache_entry_expires_with_token(self):
+        cache = TokenCache(max_size=10)
+        cache.set('expired', {'exp': 1})
+        cache.set('valid', {'exp': 2 ** 40})
+
+        self.assertIsNone(cache.get('expired'))
+        self.assertIsNotNone(cache.get('valid'))
+
+    def test_refresh_token_cached_is_no_access_token(self):
+        refresh = str(RefreshToken.for_user(User.objects.first()))
+        self.client.cookies = cookies.SimpleCookie({'refresh_token': refresh})
+        self.assertIsNotNone(CookieRefreshTokenAuthentication().get_validated_token(refresh))
+
+        self.client.cookies = cookies.SimpleCookie({'access_token': refresh})
+        response = self.client.get('/api/token/verify')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(COOKIE_JWT={'TOKEN_CACHE_ENABLED': False})
+    def test_cache_disabled(self):
+        self.assertIsNone(get_token_cache())
+
+
+# the views run blocking work on pool threads, which only see committed rows
+@override_settings(ROOT_URLCONF='users.async_urls')
+class TestAsyncCookieTokenViews(APITransactionTestCase):
+
+    def setUp(self):
+        user = User(username='testuser', email='test@test.com')
+        user.set_password('testpassword')
+        user.save()
+
+    def test_async_token_verify(self):
+        u = User.objects.first()
+        self.client.cookies = cookies.SimpleCookie({'access_token': AccessToken.for_user(u)})
+
+        response = self.client.get('/token/verify')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['user_id'], u.id)
+
+    def test_async_token_verify_no_cookie(self):
+        response = self.client.get('/token/verify')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_async_bodies_match_sync_views(self):
+        self.client.cookies = cookies.SimpleCookie({'access_token': AccessToken.for_user(User.objects.first())})
+        for path in ('/token/verify', '/token/refresh'):
+            with self.subTest(path=path):
+                response = self.client.get(path) if path.endswith('verify') else self.client.post(path)
+                with override_settings(ROOT_URLCONF='cookiejwt.urls'):
+                    expected = (self.client.get('/api' + path) if path.endswith('verify')
+                                else self.client.post('/api' + path))
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(response.content, expected.content)
+                self.assertEqual(response['Content-Type'], expected['Content-Type'])
+
+    def test_async_token_obtain(self):
+        response = self.client.post('/token', json.dumps({
+            'username': 'testuser',
+            'password': 'testpassword',
+            'remember': False
+        }), content_type="application/json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['user_id'], User.objects.get(username='testuser').id)
+        self.assertTrue(response.cookies['access_token']['httponly'])
+        self.assertTrue(response.cookies['refresh_token']['httponly'])
+
+    def test_async_token_obtain_wrong_password(self):
+        response = self.client.post('/token', json.dumps({
+            'username': 'testuser',
+            'password': 'wrongpassword',
+            'remember': False
+        }), content_type="application/json")
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_async_token_obtain_no_data(self):
+        response = self.client.post('/token', content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_async_token_refresh(self):
+        u = User.objects.first()
+        self.client.cookies = cookies.SimpleCookie({'refresh_token': RefreshToken.for_user(u)})
+
+        response = self.client.post('/token/refresh')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        backend = CookieAccessTokenAuthentication()
+        validated_token = backend.get_validated_token(response.cookies['access_token'].value)
+        self.assertEqual(backend.get_user(validated_token).id, u.id)
+
+    def test_async_token_clear(self):
+        response = self.client.post('/token/clear')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.cookies['access_token'].value, "")
+        self.assertEqual(response.cookies['refresh_token'].value, "")
+
+    @override_settings(COOKIE_JWT={'LOGIN_THROTTLE_RATES': {'ip': None, 'username': (2, 1 / 3600)}})
+    def test_async_login_throttled(self):
+        reset_login_limiters()
+        for password in ('wrongpassword', 'wrongpassword', 'testpassword'):
+            response = self.client.post('/token', json.dumps({
+                'username': 'testuser',
+                'password': password,
+                'remember': False
+            }), content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+
+@override_settings(COOKIE_JWT={'HASHING_POOL_WORKERS': 1, 'HASHING_POOL_QUEUE_SIZE': 0,
+                               'HASHING_POOL_RETRY_AFTER': 5})
+class TestHashingPool(APITestCase):
+
+    def setUp(self):
+        user = User(username='testuser', email='test@test.com')
+        user.set_password('testpassword')
+        user.save()
+
+    def obtain(self, password='testpassword'):
+        return self.client.post('/api/token', json.dumps({
+            'username': 'testuser',
+            'password': password,
+            'remember': False
+        }), content_type="application/json")
+
+    def test_login_through_pool(self):
+        completed = get_hashing_executor().stats()['completed']
+        response = self.obtain()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        stats = get_hashing_executor().stats()
+        self.assertEqual(stats['completed'], completed + 1)
+        self.assertGreater(stats['hash_time_total'], 0)
+
+    def test_login_wrong_password_through_pool(self):
+        response = self.obtain('wrongpassword')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_rehash_in_same_job(self):
+        User.objects.filter(username='testuser').update(password=make_password('testpassword', hasher='pbkdf2_sha1'))
+        completed = get_hashing_executor().stats()['completed']
+        self.assertEqual(self.obtain().status_code, status.HTTP_200_OK)
+
+        self.assertEqual(get_hashing_executor().stats()['completed'], completed + 1)
+        self.assertTrue(User.objects.get(username='testuser').password.startswith('pbkdf2_sha256$'))
+
+    def test_login_rejected_when_pool_full(self):
+        release = threading.Event()
+        busy = get_hashing_executor().submit(release.wait)
+        try:
+            response = self.obtain()
+        finally:
+            release.set()
+            busy.result()
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '5')
+
+
+class TestBenchmarkCommand(APITransactionTestCase):
+
+    def test_benchmark_inprocess_json(self):
+        out = StringIO()
+        call_command('benchmark_tokens', concurrency=2, requests=4, users=2, host='testserver', json=True,
+                     stdout=out)
+        report = json.loads(out.getvalue())
+
+        self.assertEqual([r['endpoint'] for r in report['endpoints']],
+                         ['token', 'token/refresh', 'token/verify', 'token/clear'])
+        for result in report['endpoints']:
+            self.assertEqual(result['requests'], 4)
+            self.assertEqual(result['errors'], 0)
+            self.assertIsNotNone(result['latency_ms']['p99'])
+
+    def test_percentile_nearest_rank(self):
+        values = list(range(1, 21))
+        self.assertEqual(percentile(values, 50), 10)
+        self.assertEqual(percentile(values, 95), 19)
+        self.assertEqual(percentile(values, 99), 20)
+        self.assertEqual(percentile(values, 0), 1)
+        self.assertIsNone(percentile([], 50))
+
+
+try:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+except ImportError:
+    serialization = None
+
+
+def private_key_pem(private_key):
+    return private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                     serialization.NoEncryption()).decode('ascii')
+
+
+@unittest.skipIf(serialization is None, 'cryptography is not installed')
+class TestKeyRing(APITestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.rsa_pem = private_key_pem(rsa.generate_private_key(65537, 2048, default_backend()))
+        cls.ec_pem = private_key_pem(ec.generate_private_key(ec.SECP256R1(), default_backend()))
+
+    def setUp(self):
+        user = User(username='testuser', email='test@test.com')
+        user.set_password('testpassword')
+        user.save()
+
+    def keyring_settings(self, active, keys=('rsa', 'ec')):
+        configs = {
+            'rsa': {'kid': 'rsa', 'algorithm': 'RS256', 'private_key': self.rsa_pem},
+            'ec': {'kid': 'ec', 'algorithm': 'ES256', 'private_key': self.ec_pem},
+        }
+        return override_settings(COOKIE_JWT={'SIGNING_KEYS': [configs[kid] for kid in keys],
+                                             'ACTIVE_SIGNING_KID': active})
+
+    def test_tokens_signed_with_active_key(self):
+        with self.keyring_settings('ec'):
+            token = str(AccessToken.for_user(User.objects.first()))
+            self.assertEqual(jwt.get_unverified_header(token), {'typ': 'JWT', 'alg': 'ES256', 'kid': 'ec'})
+
+            self.client.cookies = cookies.SimpleCookie({'access_token': token})
+            response = self.client.get('/api/token/verify')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_rotation_keeps_old_tokens_valid(self):
+        with self.keyring_settings('rsa'):
+            token = str(AccessToken.for_user(User.objects.first()))
+
+        with self.keyring_settings('ec'):
+            self.assertEqual(AccessToken(token)['user_id'], 1)
+
+        with self.keyring_settings('ec', keys=('ec',)):
+            self.client.cookies = cookies.SimpleCookie({'access_token': token})
+            response = self.client.get('/api/token/verify')
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_legacy_tokens_without_kid(self):
+        token = str(AccessToken.for_user(User.objects.first()))
+
+        with self.keyring_settings('rsa'):
+            self.assertEqual(AccessToken(token)['user_id'], 1)
+
+    def test_jwks_endpoint(self):
+        with self.keyring_settings('rsa'):
+            token = str(AccessToken.for_user(User.objects.first()))
+            response = self.client.get('/api/token/jwks')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('max-age=300', response['Cache-Control'])
+
+        jwks = json.loads(response.content)
+        self.assertEqual([key['kid'] for key in jwks['keys']], ['rsa', 'ec'])
+
+        public_key = jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(jwks['keys'][0]))
+        payload = jwt.decode(token, public_key, algorithms=['RS256'])
+        self.assertEqual(payload['user_id'], 1)
+
+    def test_jwks_endpoint_without_keyring(self):
+        self.assertIsNone(get_keyring())
+        response = self.client.get('/api/token/jwks')
+        self.assertEqual(json.loads(response.content), {'keys': []})
+
+
+class TestRefreshRotation(APITestCase):
+
+    def setUp(self):
+        user = User(username='testuser', email='test@test.com')
+        user.set_password('testpassword')
+        user.save()
+
+    def refresh(self, token):
+        self.client.cookies = cookies.SimpleCookie({'refresh_token': token})
+        return self.client.post('/api/token/refresh')
+
+    def test_refresh_rotates_refresh_cookie(self):
+        token = str(RefreshToken.for_user(User.objects.first()))
+
+        response = self.refresh(token)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('refresh_expire', response.json())
+
+        rotated = response.cookies['refresh_token']
+        self.assertTrue(rotated['httponly'])
+        self.assertNotEqual(rotated.value, token)
+        self.assertEqual(self.refresh(rotated.value).status_code, status.HTTP_200_OK)
+
+    def test_rotation_keeps_remember_choice(self):
+        for remember in (False, True):
+            with self.subTest(remember=remember):
+                self.client.cookies = cookies.SimpleCookie()
+                response = self.client.post('/api/token', json.dumps({
+                    'username': 'testuser',
+                    'password': 'testpassword',
+                    'remember': remember
+                }), content_type="application/json")
+                self.assertEqual(response.cookies['refresh_token']['expires'] != '', remember)
+                self.assertNotIn('rem', AccessToken(response.cookies['access_token'].value).payload)
+
+                token = response.cookies['refresh_token'].value
+                for _ in range(2):
+                    reset_refresh_flights()
+                    rotated = self.refresh(token).cookies['refresh_token']
+                    self.assertNotEqual(rotated.value, token)
+                    self.assertEqual(rotated['expires'] != '', remember)
+                    token = rotated.value
+
+    def test_rotated_refresh_token_is_denied(self):
+        token = str(RefreshToken.for_user(User.objects.first()))
+
+        self.assertEqual(self.refresh(token).status_code, status.HTTP_200_OK)
+        # a replay after the coalescing window
+        reset_refresh_flights()
+        self.assertEqual(self.refresh(token).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_unrevoked_tokens_skip_store(self):
+        denylist = get_denylist()
+        fast_negatives = denylist.fast_negatives
+
+        self.refresh(str(RefreshToken.for_user(User.objects.first())))
+        self.assertEqual(denylist.fast_negatives, fast_negatives + 1)
+
+    @mock.patch.object(api_settings, 'ROTATE_REFRESH_TOKENS', False)
+    def test_refresh_without_rotation(self):
+        response = self.refresh(str(RefreshToken.for_user(User.objects.first())))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('refresh_token', response.cookies)
+
+
+class TestDenylist(APITestCase):
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(1000, 0.001)
+        for i in range(1000):
+            bloom.add('jti-{}'.format(i))
+
+        self.assertTrue(all('jti-{}'.format(i) in bloom for i in range(1000)))
+        false_positives = sum('other-{}'.format(i) in bloom for i in range(10000))
+        self.assertLess(false_positives, 50)
+
+    def test_concurrent_rotation_keeps_last_window(self):
+        bloom = AgingBloomFilter(1000, 0.001, 60)
+        bloom.add('revoked')
+        bloom.rotated_at -= 60
+        new_filter = BloomFilter
+
+        def slow_filter(*args):
+            time.sleep(0.05)
+            return new_filter(*args)
+
+        with mock.patch('users.denylist.BloomFilter', side_effect=slow_filter):
+            threads = [threading.Thread(target=bloom.__contains__, args=('other',)) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertIn('revoked', bloom)
+
+    def test_new_worker_replay_bounded(self):
+        store = CacheDenylistStore()
+        for i in range(20):
+            store.add('jti-{}'.format(i), 2 ** 40)
+
+        with mock.patch.object(store.cache, 'get_many', wraps=store.cache.get_many) as get_many:
+            worker = Denylist(store, AgingBloomFilter(5, 0.001, 60), sync_interval=0)
+            worker.sync(force=True)
+        self.assertEqual(sum(len(call.args[0]) for call in get_many.call_args_list), 5)
+        self.assertIn('jti-19', worker.bloom)
+
+        # the ids left out of the replay are still found in the store
+        self.assertTrue(worker.is_revoked('jti-0'))
+        self.assertFalse(worker.is_revoked('not-revoked'))
+        self.assertEqual(worker.fast_negatives, 0)
+
+        worker._incomplete_until = time.monotonic()
+        self.assertFalse(worker.is_revoked('not-revoked'))
+        self.assertEqual(worker.fast_negatives, 1)
+
+    @override_settings(COOKIE_JWT={'DENYLIST_STORE': 'users.denylist.CacheDenylistStore',
+                                   'DENYLIST_SYNC_INTERVAL': 0})
+    def test_cache_store_shared_between_workers(self):
+        worker = get_denylist()
+        other_worker = CacheDenylistStore()
+        other_worker.add('revoked-elsewhere', 2 ** 40)
+
+        self.assertTrue(worker.is_revoked('revoked-elsewhere'))
+        self.assertFalse(worker.is_revoked('not-revoked'))
+
+    @override_settings(COOKIE_JWT={'DENYLIST_STORE': 'users.denylist.CacheDenylistStore'})
+    def test_miss_sees_revocations_of_other_workers(self):
+        worker = get_denylist()
+        self.assertFalse(worker.is_revoked('revoked-later'))
+
+        CacheDenylistStore().add('revoked-later', 2 ** 40)
+        self.assertTrue(worker.is_revoked('revoked-later'))
+
+    @override_settings(COOKIE_JWT={'DENYLIST_STORE': 'users.denylist.CacheDenylistStore',
+                                   'DENYLIST_SYNC_INTERVAL': 3600})
+    def test_sync_interval_trusts_misses(self):
+        worker = get_denylist()
+        CacheDenylistStore().add('revoked-during-interval', 2 ** 40)
+        self.assertFalse(worker.is_revoked('revoked-during-interval'))
+
+
+class TestTokenGenerations(APITestCase):
+
+    def setUp(self):
+        user = User(username='testuser', email='test@test.com')
+        user.set_password('testpassword')
+        user.save()
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        settings_override = override_settings(COOKIE_JWT={
+            'GENERATION_TABLE_PATH': os.path.join(self.tmpdir.name, 'generations.bin'),
+            'GENERATION_TABLE_SLOTS': 64,
+        })
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def obtain(self):
+        response = self.client.post('/api/token', json.dumps({
+            'username': 'testuser',
+            'password': 'testpassword',
+            'remember': False
+        }), content_type="application/json")
+        return response.client.cookies['access_token'].value, response.client.cookies['refresh_token'].value
+
+    def test_generation_table_shared_between_mappings(self):
+        path = os.path.join(self.tmpdir.name, 'shared.bin')
+        table, other_worker = GenerationTable(path, 16), GenerationTable(path, 1024)
+        self.addCleanup(table.close)
+        self.addCleanup(other_worker.close)
+
+        self.assertEqual(other_worker.slots, 16)
+        for user_id in range(1, 17):
+            table.bump(user_id, now=1000)
+        table.bump(5, now=1000)
+
+        self.assertEqual(other_worker.get(5), 1001)
+        self.assertEqual(other_worker.get(16), 1000)
+        self.assertEqual(other_worker.get(17), 0)
+        self.assertRaises(GenerationTableFull, table.bump, 17, now=1000)
+
+    def test_expired_slots_reused(self):
+        table = GenerationTable(os.path.join(self.tmpdir.name, 'expiring.bin'), 4, ttl=100)
+        self.addCleanup(table.close)
+        for user_id in range(1, 5):
+            table.bump(user_id, now=1000)
+        self.assertRaises(GenerationTableFull, table.bump, 5, now=1099)
+
+        self.assertEqual(table.bump(5, now=1100), 1100)
+        self.assertEqual(table.get(5), 1100)
+        self.assertEqual(sum(table.get(user_id) == 0 for user_id in range(1, 5)), 1)
+        # generations only grow, tokens of the previous generation stay revoked
+        self.assertEqual(table.bump(5, now=1050), 1101)
+
+    def test_concurrent_bumps_take_distinct_slots(self):
+        table = GenerationTable(os.path.join(self.tmpdir.name, 'threads.bin'), 1)
+        self.addCleanup(table.close)
+        probe = table._probe
+
+        def slow_probe(key):
+            for slot in probe(key):
+                time.sleep(0.05)
+                yield slot
+
+        results = []
+
+        def bump(user_id):
+            try:
+                results.append(table.bump(user_id, now=1000))
+            except GenerationTableFull as e:
+                results.append(e)
+
+        with mock.patch.object(table, '_probe', side_effect=slow_probe):
+            threads = [threading.Thread(target=bump, args=(user_id,)) for user_id in (1, 2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(sum(isinstance(result, GenerationTableFull) for result in results), 1)
+        self.assertEqual(sorted(table.get(user_id) for user_id in (1, 2)), [0, 1000])
+
+    def test_revoke_when_full(self):
+        access, _ = self.obtain()
+        self.client.cookies = cookies.SimpleCookie({'access_token': access})
+        with mock.patch.object(GenerationTable, 'max_probe', 0):
+            response = self.client.post('/api/token/revoke')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_revoke_logs_out_everywhere(self):
+        access, refresh = self.obtain()
+        other_access, other_refresh = self.obtain()
+
+        self.client.cookies = cookies.SimpleCookie({'access_token': access})
+        response = self.client.post('/api/token/revoke')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.cookies['access_token'].value, "")
+
+        self.client.cookies = cookies.SimpleCookie({'access_token': other_access})
+        response = self.client.get('/api/token/verify')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.client.cookies = cookies.SimpleCookie({'refresh_token': other_refresh})
+        response = self.client.post('/api/token/refresh')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_login_after_revoke(self):
+        self.obtain()
+        generation = get_generation_table().bump(1)
+        access, _ = self.obtain()
+
+        backend = CookieAccessTokenAuthentication()
+        self.assertEqual(backend.get_validated_token(access)['gen'], generation)
+
+        self.client.cookies = cookies.SimpleCookie({'access_token': access})
+        response = self.client.get('/api/token/verify')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class TestSlidingRenewal(APITestCase):
+
+    def setUp(self):
+        user = User(username='testuser', email='test@test.com')
+        user.set_password('testpassword')
+        user.save()
+
+    def test_expiring_access_token_renewed_in_band(self):
+        u = User.objects.first()
+        access = AccessToken.for_user(u)
+        access.set_exp(lifetime=datetime.timedelta(seconds=30))
+        self.client.cookies = cookies.SimpleCookie({'access_token': access, 'refresh_token': RefreshToken.for_user(u)})
+
+        response = self.client.get('/api/token/verify')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        renewed = response.cookies['access_token'].value
+        self.assertNotEqual(renewed, str(access))
+        self.assertIn('refresh_token', response.cookies)
+        self.assertEqual(CookieAccessTokenAuthentication().get_validated_token(renewed)['user_id'], u.id)
+
+    def test_missing_access_token_renewed_in_band(self):
+        u = User.objects.first()
+        self.client.cookies = cookies.SimpleCookie({'refresh_token': RefreshToken.for_user(u)})
+
+        response = self.client.get('/api/token/verify')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['user_id'], u.id)
+
+    def test_fresh_access_token_not_renewed(self):
+        u = User.objects.first()
+        self.client.cookies = cookies.SimpleCookie({'access_token': AccessToken.for_user(u),
+                                                    'refresh_token': RefreshToken.for_user(u)})
+
+        response = self.client.get('/api/token/verify')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('access_token', response.cookies)
+
+    def test_invalid_refresh_token_not_renewed(self):
+        self.client.cookies = cookies.SimpleCookie({'refresh_token': str(os.urandom(32))})
+
+        response = self.client.get('/api/token/verify')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertNotIn('access_token', response.cookies)
+
+    def test_token_clear_not_renewed(self):
+        u = User.objects.first()
+        self.client.cookies = cookies.SimpleCookie({'refresh_token': RefreshToken.for_user(u)})
+
+        response = self.client.post('/api/token/clear')
+        self.assertEqual(response.cookies['access_token'].value, "")
+        self.assertEqual(response.cookies['refresh_token'].value, "")
+
+
+@override_settings(COOKIE_JWT={'TOKEN_PROFILE': 'compact', 'REFRESH_COOKIE_PATH': '/api/token/refresh'})
+class TestCompactTokenProfile(APITestCase):
+
+    def setUp(self):
+        user = User(username='testuser', email='test@test.com')
+        user.set_password('testpassword')
+        user.save()
+
+    def obtain(self):
+        return self.client.post('/api/token', json.dumps({
+            'username': 'testuser',
+            'password': 'testpassword',
+            'remember': False
+        }), content_type="application/json")
+
+    def test_compact_tokens(self):
+        response = self.obtain()
+        access = response.cookies['access_token'].value
+        refresh = response.cookies['refresh_token']
+
+        payload = jwt.decode(access, verify=False)
+        self.assertEqual(payload[api_settings.TOKEN_TYPE_CLAIM], 'a')
+        self.assertNotIn('jti', payload)
+        self.assertLess(len(access), len(str(AccessToken.for_user(User.objects.first()))))
+        self.assertEqual(refresh['path'], '/api/token/refresh')
+
+        self.client.cookies = cookies.SimpleCookie({'access_token': access})
+        response = self.client.get('/api/token/verify')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_compact_refresh(self):
+        refresh = self.obtain().cookies['refresh_token'].value
+
+        self.client.cookies = cookies.SimpleCookie({'refresh_token': refresh})
+        response = self.client.post('/api/token/refresh')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(jwt.decode(response.cookies['access_token'].value, verify=False)['token_type'], 'a')
+
+    def test_refresh_token_rejected_as_access_token(self):
+        refresh = self.obtain().cookies['refresh_token'].value
+
+        self.client.cookies = cookies.SimpleCookie({'access_token': refresh})
+        response = self.client.get('/api/token/verify')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_clear_uses_refresh_cookie_path(self):
+        response = self.client.post('/api/token/clear')
+        self.assertEqual(response.cookies['refresh_token']['path'], '/api/token/refresh')
+
+    def test_token_size_report(self):
+        out = StringIO()
+        call_command('token_size_report', json=True, stdout=out)
+        report = json.loads(out.getvalue())
+
+        self.assertEqual(report['current_profile'], 'compact')
+        self.assertGreater(report['saved_bytes_per_request'], 0)
+
+    def test_token_size_report_measures_issued_tokens(self):
+        response = self.obtain()
+        out = StringIO()
+        call_command('token_size_report', '--user-id', str(User.objects.first().id), '--json', stdout=out)
+        report = json.loads(out.getvalue())
+
+        self.assertEqual(report['compact']['access_token_bytes'], len(response.cookies['access_token'].value))
+        self.assertEqual(report['compact']['refresh_token_bytes'], len(response.cookies['refresh_token'].value))
+
+
+@override_settings(COOKIE_JWT={'INTROSPECTION_CLIENTS': {'gateway': 'gateway-secret'}})
+class TestTokenIntrospection(APITestCase):
+
+    def setUp(self):
+        user = User(username='testuser', email='test@test.com')
+        user.set_password('testpassword')
+        user.save()
+        self.authorize('gateway', 'gateway-secret')
+
+    def authorize(self, client_id, secret):
+        credentials = base64.b64encode('{}:{}'.format(client_id, secret).encode()).decode()
+        self.client.credentials(HTTP_AUTHORIZATION='Basic ' + credentials)
+
+    def introspect(self, tokens, url='/api/token/introspect', **extra):
+        return self.client.post(url, json.dumps(dict(tokens=tokens, **extra)), content_type="application/json")
+
+    def test_batch_introspection(self):
+        u = User.objects.first()
+        access = str(AccessToken.for_user(u))
+        refresh = str(RefreshToken.for_user(u))
+
+        response = self.introspect([access, 'garbage', refresh, access])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        results = response.data['results']
+        self.assertEqual([r['valid'] for r in results], [True, False, False, True])
+        self.assertEqual(results[0]['claims']['user_id'], u.id)
+        self.assertGreater(results[0]['expires_in'], 0)
+        self.assertLessEqual(results[0]['expires_in'], api_settings.ACCESS_TOKEN_LIFETIME.total_seconds())
+        self.assertEqual(results[2]['error'], 'Token has wrong type')
+
+    def test_refresh_token_introspection(self):
+        refresh = str(RefreshToken.for_user(User.objects.first()))
+
+        response = self.introspect([refresh], token_type='refresh')
+        self.assertTrue(response.data['results'][0]['valid'])
+
+    @override_settings(COOKIE_JWT={
+        'INTROSPECTION_MAX_TOKENS': 2,
+        'INTROSPECTION_CLIENTS': {'gateway': 'gateway-secret'},
+    })
+    def test_batch_size_limit(self):
+        response = self.introspect(['a', 'b', 'c'])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_empty_batch(self):
+        response = self.introspect([])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def assert_client_authentication_required(self, url):
+        access = str(AccessToken.for_user(User.objects.first()))
+        self.assertEqual(self.introspect([access], url=url).status_code, status.HTTP_200_OK)
+
+        self.client.credentials()
+        response = self.introspect([access], url=url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response['WWW-Authenticate'], 'Basic realm="introspection"')
+
+        self.authorize('gateway', 'wrong-secret')
+        self.assertEqual(self.introspect([access], url=url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        # a valid access token cookie is no client credential
+        self.client.credentials()
+        self.client.cookies = cookies.SimpleCookie({'access_token': access})
+        self.assertEqual(self.introspect([access], url=url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_client_authentication_required(self):
+        self.assert_client_authentication_required('/api/token/introspect')
+
+    @override_settings(ROOT_URLCONF='users.async_urls')
+    def test_async_client_authentication_required(self):
+        self.assert_client_authentication_required('/token/introspect')
+
+    @override_settings(COOKIE_JWT={})
+    def test_no_clients_configured(self):
+        self.assertEqual(self.introspect(['a']).status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(COOKIE_JWT={'METRICS_ENABLED': True})
+class TestMetrics(APITestCase):
+
+    def setUp(self):
+        user = User(username='testuser', email='test@test.com')
+        user.set_password('testpassword')
+        user.save()
+        registry.clear()
+
+    def verify(self, token=None):
+        self.client.cookies = cookies.SimpleCookie({'access_token': token} if token is not None else {})
+        return self.client.get('/api/token/verify')
+
+    def test_authentication_outcomes(self):
+        u = User.objects.first()
+        expired = AccessToken.for_user(u)
+        expired.set_exp(lifetime=-datetime.timedelta(seconds=1))
+        forged = str(AccessToken.for_user(u))[:-4] + 'AAAA'
+
+        self.verify(AccessToken.for_user(u))
+        self.verify()
+        self.verify(expired)
+        self.verify(forged)
+        self.verify(RefreshToken.for_user(u))
+        self.verify('garbage')
+
+        for outcome in ('success', 'missing_cookie', 'expired', 'bad_signature', 'wrong_type', 'malformed'):
+            self.assertEqual(AUTHENTICATION_TOTAL.get(cookie='access_token', outcome=outcome), 1, outcome)
+
+        self.assertEqual(VIEW_SECONDS.count(view='verify', status=200), 1)
+        self.assertEqual(VIEW_SECONDS.count(view='verify', status=401), 5)
+
+    def test_login_metrics_and_endpoint(self):
+        self.client.post('/api/token', json.dumps({
+            'username': 'testuser',
+            'password': 'testpassword',
+            'remember': False
+        }), content_type="application/json")
+        self.assertEqual(PASSWORD_HASH_SECONDS.count(), 1)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = response.content.decode()
+        self.assertIn('# TYPE cookiejwt_view_seconds histogram', body)
+        self.assertIn('cookiejwt_view_seconds_count{view="obtain",status="200"} 1', body)
+        self.assertIn('cookiejwt_password_hash_seconds_bucket{le="+Inf"} 1', body)
+
+    def test_endpoint_restricted_to_allowed_networks(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7').status_code,
+                         status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7',
+                                         HTTP_X_FORWARDED_FOR='127.0.0.1').status_code,
+                         status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='::1').status_code, status.HTTP_200_OK)
+
+        with override_settings(COOKIE_JWT={'METRICS_ENABLED': True, 'METRICS_ALLOWED_NETWORKS': ('10.0.0.0/8',)}):
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.1.2.3').status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(COOKIE_JWT={'METRICS_ENABLED': False})
+    def test_metrics_disabled(self):
+        self.verify(AccessToken.for_user(User.objects.first()))
+
+        self.assertEqual(AUTHENTICATION_TOTAL.get(cookie='access_token', outcome='success'), 0)
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(COOKIE_JWT={'METRICS_ENABLED': True,
+                               'LOGIN_THROTTLE_RATES': {'ip': (10, 1 / 3600), 'username': (2, 1 / 3600)}})
+class TestLoginThrottle(APITestCase):
+
+    def setUp(self):
+        user = User(username='testuser', email='test@test.com')
+        user.set_password('testpassword')
+        user.save()
+        registry.clear()
+        reset_login_limiters()
+
+    def obtain(self, password='testpassword', username='testuser', url='/api/token'):
+        return self.client.post(url, json.dumps({
+            'username': username,
+            'password': password,
+            'remember': False
+        }), content_type="application/json")
+
+    def test_token_bucket(self):
+        limiter = InMemoryTokenBucketLimiter(burst=2, refill_rate=1)
+        self.assertIsNone(limiter.consume('key', now=0))
+        self.assertIsNone(limiter.consume('key', now=0))
+        self.assertAlmostEqual(limiter.consume('key', now=0.5), 0.5)
+        self.assertIsNone(limiter.consume('key', now=1))
+
+        limiter.refund('key', now=1)
+        self.assertIsNone(limiter.consume('key', now=1))
+        self.assertIsNotNone(limiter.consume('key', now=1))
+
+    def test_least_recently_used_buckets_evicted(self):
+        limiter = InMemoryTokenBucketLimiter(burst=1, refill_rate=1 / 3600, shards=1, max_keys_per_shard=2)
+        limiter.consume('a', now=0)
+        limiter.consume('b', now=0)
+        self.assertIsNotNone(limiter.consume('a', now=1))
+        limiter.consume('c', now=2)
+
+        buckets, _ = limiter._shards[0]
+        self.assertEqual(list(buckets), ['a', 'c'])
+
+    def test_cache_token_bucket(self):
+        limiter = CacheTokenBucketLimiter(burst=1, refill_rate=0.5, prefix='test-throttle')
+        self.assertIsNone(limiter.consume('key', now=100))
+        self.assertAlmostEqual(limiter.consume('key', now=100), 2)
+        self.assertIsNone(limiter.consume('key', now=102))
+
+    def test_cache_keys_hashed(self):
+        limiter = CacheTokenBucketLimiter(burst=1, refill_rate=0.5, prefix='test-throttle')
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            self.assertIsNone(limiter.consume('username:john doe' + 'x' * 300, now=100))
+            self.assertIsNotNone(limiter.consume('username:john doe' + 'x' * 300, now=100))
+
+    @override_settings(COOKIE_JWT={'LOGIN_THROTTLE_RATES': {'ip': (1, 1 / 60)}})
+    def test_forwarded_for_ignored_without_proxies(self):
+        self.obtain('wrongpassword')
+        self.client.defaults['HTTP_X_FORWARDED_FOR'] = '198.51.100.1'
+        self.assertEqual(self.obtain('wrongpassword').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(COOKIE_JWT={'LOGIN_THROTTLE_RATES': {'ip': (1, 1 / 60)}, 'LOGIN_THROTTLE_PROXIES': 1})
+    def test_client_address_from_trusted_proxy(self):
+        self.client.defaults['HTTP_X_FORWARDED_FOR'] = '198.51.100.1'
+        self.obtain('wrongpassword')
+        # the spoofed first entry is ignored, the proxy appended the real address
+        self.client.defaults['HTTP_X_FORWARDED_FOR'] = '203.0.113.9, 198.51.100.1'
+        self.assertEqual(self.obtain('wrongpassword').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.client.defaults['HTTP_X_FORWARDED_FOR'] = '198.51.100.2'
+        self.assertEqual(self.obtain('wrongpassword').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_failed_logins_throttled_before_hashing(self):
+        self.assertEqual(self.obtain('wrongpassword').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.obtain('wrongpassword').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(PASSWORD_HASH_SECONDS.count(), 2)
+
+        response = self.obtain()
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(PASSWORD_HASH_SECONDS.count(), 2)
+
+        # other usernames keep their own budget
+        self.assertEqual(self.obtain(username='otheruser').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_successful_logins_not_throttled(self):
+        for _ in range(5):
+            self.assertEqual(self.obtain().status_code, status.HTTP_200_OK)
+
+    def test_username_is_case_insensitive(self):
+        self.obtain('wrongpassword')
+        self.obtain('wrongpassword', username='TestUser')
+        self.assertEqual(self.obtain(username='TESTUSER').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    @override_settings(COOKIE_JWT={'LOGIN_THROTTLE_RATES': {'ip': (1, 1 / 60)}})
+    def test_ip_throttled_with_retry_after(self):
+        self.obtain('wrongpassword')
+        response = self.obtain('wrongpassword', username='otheruser')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '60')
+
+class TestLoginThrottleHashingPool(APITransactionTestCase):
+
+    def setUp(self):
+        reset_login_limiters()
+
+    def obtain(self, url):
+        return self.client.post(url, json.dumps({
+            'username': 'testuser',
+            'password': 'testpassword',
+            'remember': False
+        }), content_type="application/json")
+
+    @override_settings(COOKIE_JWT={'LOGIN_THROTTLE_RATES': {'username': (1, 1 / 60)}, 'HASHING_POOL_WORKERS': 1,
+                                   'HASHING_POOL_RETRY_AFTER': 5})
+    def test_pool_full_not_counted(self):
+        release = threading.Event()
+        busy = get_hashing_executor().submit(release.wait)
+        try:
+            for urlconf, url in (('cookiejwt.urls', '/api/token'), ('users.async_urls', '/token')):
+                with override_settings(ROOT_URLCONF=urlconf):
+                    for _ in range(2):
+                        # rejected by the pool, not by the username bucket
+                        self.assertEqual(self.obtain(url)['Retry-After'], '5')
+        finally:
+            release.set()
+            busy.result()
+
+class TestWriteBehind(APITestCase):
+
+    def setUp(self):
+        user = User(username='testuser', email='test@test.com')
+        user.set_password('testpassword')
+        user.save()
+
+    def obtain(self):
+        return self.client.post('/api/token', json.dumps({
+            'username': 'testuser',
+            'password': 'testpassword',
+            'remember': False
+        }), content_type="application/json")
+
+    @override_settings(COOKIE_JWT={'UPDATE_LAST_LOGIN': True})
+    def test_last_login_written_synchronously(self):
+        self.assertEqual(self.obtain().status_code, status.HTTP_200_OK)
+        self.assertIsNotNone(User.objects.get().last_login)
+
+    @override_settings(COOKIE_JWT={'UPDATE_LAST_LOGIN': True, 'WRITE_BEHIND_ENABLED': True,
+                                   'WRITE_BEHIND_FLUSH_INTERVAL': 3600})
+    def test_last_login_written_behind(self):
+        self.obtain()
+        self.obtain()
+        self.assertIsNone(User.objects.get().last_login)
+
+        buffer = get_write_behind()
+        self.assertEqual(len(buffer), 1)
+        self.assertEqual(buffer.flush(), 1)
+        self.assertIsNotNone(User.objects.get().last_login)
+        self.assertEqual(len(buffer), 0)
+
+    def test_close_flushes_pending_writes(self):
+        buffer = WriteBehindBuffer(batch_size=100, flush_interval=3600)
+        buffer.record_login(User.objects.get())
+        buffer.close()
+
+        self.assertIsNotNone(User.objects.get().last_login)
+
+    def test_failed_flush_keeps_entries(self):
+        buffer = WriteBehindBuffer(batch_size=100, flush_interval=3600)
+        user = User.objects.get()
+        buffer.record_login(user)
+
+        with mock.patch('django.db.models.query.QuerySet.bulk_update',
+                        side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                buffer.flush()
+        self.assertEqual(len(buffer), 1)
+
+        self.assertEqual(buffer.flush(), 1)
+        self.assertIsNotNone(User.objects.get().last_login)
+        buffer.close()
+
+    def test_failed_flush_drops_permanent_errors(self):
+        buffer = WriteBehindBuffer(batch_size=100, flush_interval=3600)
+        buffer.record_login(User.objects.get())
+
+        with mock.patch('django.db.models.query.QuerySet.bulk_update', side_effect=DataError('bad value')):
+            with self.assertRaises(DataError):
+                buffer.flush()
+        self.assertEqual(len(buffer), 0)
+        buffer.close()
+
+    def test_pending_entries_capped(self):
+        buffer = WriteBehindBuffer(batch_size=100, flush_interval=3600, max_pending=2)
+        for pk in (1, 2, 3, 1):
+            buffer.record_login(User(pk=pk))
+
+        self.assertEqual(list(buffer._last_logins), [3, 1])
+        buffer._last_logins.clear()
+        buffer.close()
+
+    def test_batch_size_triggers_flush(self):
+        flushed = threading.Event()
+        with mock.patch.object(WriteBehindBuffer, 'flush', side_effect=lambda: flushed.set()):
+            buffer = WriteBehindBuffer(batch_size=2, flush_interval=3600)
+            buffer.record_login(User(pk=1))
+            self.assertFalse(flushed.wait(0.05))
+
+            buffer.record_login(User(pk=2))
+            self.assertTrue(flushed.wait(5))
+            buffer.close()
+
+
+@override_settings(ROOT_URLCONF=settings_auth.ROOT_URLCONF, MIDDLEWARE=settings_auth.MIDDLEWARE)
+class TestAuthOnlyProfile(APITestCase):
+
+    def setUp(self):
+        user = User(username='testuser', email='test@test.com')
+        user.set_password('testpassword')
+        user.save()
+
+    def test_token_endpoints(self):
+        response = self.client.post('/api/token', json.dumps({
+            'username': 'testuser',
+            'password': 'testpassword',
+            'remember': False
+        }), content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get('/api/token/verify')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['user_id'], User.objects.get().id)
+
+        response = self.client.post('/api/token/refresh')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_only_token_endpoints_mounted(self):
+        self.assertEqual(self.client.get('/admin/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TestAuditTokens(APITestCase):
+
+    def setUp(self):
+        user = User(username='testuser', email='test@test.com')
+        user.set_password('testpassword')
+        user.save()
+
+        expired = AccessToken.for_user(user)
+        expired.set_exp(lifetime=-datetime.timedelta(seconds=1))
+        lines = [
+            json.dumps({'token': str(AccessToken.for_user(user))}),
+            json.dumps(str(RefreshToken.for_user(user))),
+            json.dumps({'token': str(expired)}),
+            json.dumps({'token': str(AccessToken.for_user(user))[:-4] + 'AAAA'}),
+            json.dumps({'token': 'garbage'}),
+            'not json',
+        ]
+
+        fd, self.path = tempfile.mkstemp(suffix='.jsonl')
+        with os.fdopen(fd, 'w') as f:
+            f.write('\n'.join(lines * 3) + '\n')
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def audit(self, *args, **options):
+        out, err = StringIO(), StringIO()
+        call_command('audit_tokens', self.path, *args, stdout=out, stderr=err, **options)
+        return [json.loads(line) for line in out.getvalue().splitlines()], json.loads(err.getvalue())
+
+    def test_verdicts_and_stats(self):
+        verdicts, stats = self.audit('--workers', '0')
+
+        self.assertEqual([verdict['line'] for verdict in verdicts], list(range(1, 19)))
+        self.assertEqual([verdict['reason'] for verdict in verdicts[:6]],
+                         ['valid', 'valid', 'expired', 'bad_signature', 'malformed', 'unreadable'])
+        self.assertEqual(verdicts[1]['token_type'], 'refresh')
+        self.assertEqual(verdicts[0]['user_id'], User.objects.get().id)
+
+        self.assertEqual(stats['total'], 18)
+        self.assertEqual(stats['reasons'], {'valid': 6, 'expired': 3, 'bad_signature': 3,
+                                            'malformed': 3, 'unreadable': 3})
+        self.assertEqual(stats['top_users'], {str(User.objects.get().id): 12})
+        self.assertEqual(sum(stats['issued_per_bucket'].values()), 12)
+
+    def test_process_pool_keeps_order(self):
+        verdicts, stats = self.audit('--workers', '2', '--chunk-size', '4')
+        expected, _ = self.audit('--workers', '0')
+
+        for verdict in verdicts + expected:
+            verdict.pop('expires_in', None)
+        self.assertEqual(verdicts, expected)
+
+    def test_spawned_workers_set_up_django(self):
+        with open(self.path) as f:
+            verdicts = list(audit_stream(f, workers=1, chunk_size=4, mp_context=multiprocessing.get_context('spawn')))
+
+        self.assertEqual(len(verdicts), 18)
+        self.assertEqual([verdict['reason'] for verdict in verdicts[2:6]],
+                         ['expired', 'bad_signature', 'malformed', 'unreadable'])
+
+    def test_user_stats_bounded(self):
+        stats = AuditStats(top_users=2)
+        for i in range(5000):
+            stats.add({'reason': 'valid', 'valid': True, 'user_id': i})
+        for _ in range(50):
+            stats.add({'reason': 'valid', 'valid': True, 'user_id': 'frequent'})
+
+        self.assertLess(len(stats.users.counts), 2000)
+        self.assertEqual(stats.summary()['top_users']['frequent'], 50)
+        self.assertAlmostEqual(stats.summary()['distinct_users'], 5001, delta=50)
+
+    def test_out_of_range_times(self):
+        payload = {'token_type': 'access', 'jti': 'forged', 'user_id': User.objects.get().id}
+        tokens = [jwt.encode(dict(payload, exp=exp), api_settings.SIGNING_KEY, algorithm='HS256')
+                  for exp in (float('inf'), float('-inf'), float('nan'), 1e308, 2 ** 70)]
+        tokens.append(jwt.encode(dict(payload, exp=2 ** 33, iat=float('nan')), 'forged', algorithm='HS256'))
+        lines = [json.dumps(token.decode()) for token in tokens]
+
+        verdicts = list(audit_stream(lines))
+        self.assertEqual([verdict['reason'] for verdict in verdicts], ['invalid'] * 5 + ['bad_signature'])
+        self.assertEqual([verdict['issued_at'] for verdict in verdicts][:5], [None] * 5)
+        self.assertIsNotNone(verdicts[5]['issued_at'])
+
+        stats = AuditStats()
+        for verdict in verdicts:
+            stats.add(verdict)
+        self.assertEqual(sum(stats.summary()['issued_per_bucket'].values()), 1)
+
+    def test_issue_time_buckets_bounded(self):
+        stats = AuditStats(bucket_seconds=1, max_buckets=10)
+        for issued_at in range(100):
+            stats.add({'reason': 'bad_signature', 'valid': False, 'issued_at': issued_at})
+        stats.add({'reason': 'bad_signature', 'valid': False, 'issued_at': 0})
+
+        self.assertEqual(len(stats.summary()['issued_per_bucket']), 10)
+        self.assertEqual(stats.summary()['issued_per_bucket']['0'], 2)
+        self.assertEqual(stats.summary()['issued_unbucketed'], 90)
+
+    def test_revoked_tokens(self):
+        user = User.objects.get()
+        with override_settings(COOKIE_JWT={'GENERATION_TABLE_PATH': self.path + '.gen'}):
+            try:
+                with open(self.path, 'w') as f:
+                    f.write(json.dumps(str(AccessToken.for_user(user))) + '\n')
+                get_generation_table().bump(user.id)
+
+                verdicts, stats = self.audit('--workers', '0')
+            finally:
+                os.remove(self.path + '.gen')
+
+        self.assertEqual(verdicts[0]['reason'], 'revoked')
+
+
+class TestPruning(APITestCase):
+    # users with a past last_login stand in for expired OutstandingToken rows,
+    # the blacklist app is not installed in this project
+
+    def setUp(self):
+        past = timezone.now() - datetime.timedelta(days=1)
+        future = timezone.now() + datetime.timedelta(days=1)
+        User.objects.bulk_create([
+            User(username='user-{}'.format(i), last_login=past if i % 3 else future) for i in range(30)
+        ])
+
+    def test_prunes_in_chunks(self):
+        chunks = []
+        stats = ExpiredRowPruner(User, 'last_login', chunk_size=4, pause=0).run(
+            progress=lambda stats: chunks.append(stats['deleted']))
+
+        self.assertTrue(stats['done'])
+        self.assertEqual(stats['deleted'], 20)
+        self.assertEqual(stats['chunks'], 8)
+        self.assertEqual(len(chunks), 8)
+        self.assertEqual(User.objects.count(), 10)
+        self.assertFalse(User.objects.filter(last_login__lte=timezone.now()).exists())
+
+    def test_resumes_from_checkpoint(self):
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        os.remove(path)
+        try:
+            pruner = ExpiredRowPruner(User, 'last_login', chunk_size=4, pause=0, checkpoint=PruneCheckpoint(path))
+            stats = pruner.run(time_budget=0)
+            self.assertFalse(stats['done'])
+            self.assertEqual(stats['chunks'], 1)
+
+            resumed = ExpiredRowPruner(User, 'last_login', chunk_size=4, pause=0, checkpoint=PruneCheckpoint(path))
+            self.assertEqual(resumed.checkpoint.next_pk, stats['next_pk'])
+            resumed_stats = resumed.run()
+            self.assertTrue(resumed_stats['done'])
+            self.assertEqual(resumed_stats['chunks'], 7)
+            self.assertEqual(stats['deleted'] + resumed_stats['deleted'], 20)
+            self.assertIsNone(PruneCheckpoint(path).next_pk)
+        finally:
+            os.remove(path)
+
+    def test_command_without_blacklist_app(self):
+        out = StringIO()
+        call_command('prune_tokens', stdout=out)
+        self.assertIn('not installed', out.getvalue())
+
+
+class TestBenchUsers(APITestCase):
+
+    def test_passwords_hashed_once(self):
+        with mock.patch('users.benchmark.make_password', wraps=make_password) as hasher:
+            created = create_bench_users(25, passwords=3, batch_size=10)
+
+        self.assertEqual(created, 25)
+        self.assertEqual(hasher.call_count, 3)
+        self.assertEqual(User.objects.values('password').distinct().count(), 3)
+
+        user = User.objects.get(username='bench-user-7')
+        self.assertTrue(user.check_password(bench_password('bench-user-7', 3)))
+        self.assertEqual(create_bench_users(30, passwords=3, batch_size=10), 5)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('create_bench_users', '12', '--batch-size', '5', stdout=out)
+
+        self.assertEqual(User.objects.filter(username__startswith='bench-user-').count(), 12)
+        self.assertIn('12/12 users, 12 created', out.getvalue())
+        self.assertIn('created 12 users', out.getvalue())
+
+        response = self.client.post('/api/token', json.dumps({
+            'username': 'bench-user-11',
+            'password': bench_password('bench-user-11'),
+            'remember': False
+        }), content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class TestSQLiteWALBackend(APITestCase):
+
+    def test_pragmas_applied(self):
+        self.assertEqual(connection.vendor, 'sqlite')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_read_transaction_does_not_take_writer_lock(self):
+        self.assertTrue(connection.in_atomic_block)
+        list(User.objects.all())
+        self.assertFalse(connection._holds_writer_lock)
+        self.assertFalse(connection.writer_lock.locked())
+
+        # the first write of the open test case transaction makes it the writer
+        User.objects.create(username='writer')
+        self.assertTrue(connection._holds_writer_lock)
+        self.assertFalse(connection.acquire_writer_lock())
+
+
+class TestSQLiteWALTransactions(APITransactionTestCase):
+
+    def test_transactions_begin_by_first_statement(self):
+        with transaction.atomic():
+            list(User.objects.all())
+            self.assertFalse(connection.writer_lock.locked())
+        self.assertFalse(connection.writer_lock.locked())
+
+        with transaction.atomic():
+            User.objects.create(username='writer')
+            self.assertTrue(connection._holds_writer_lock)
+        self.assertFalse(connection.writer_lock.locked())
+
+        with write_atomic():
+            self.assertTrue(connection._holds_writer_lock)
+            list(User.objects.all())
+        self.assertFalse(connection.writer_lock.locked())
+
+
+class TestDatabaseBenchmarkCommand(APITransactionTestCase):
+
+    def test_benchmark_db(self):
+        out = StringIO()
+        call_command('benchmark_db', '--concurrency', '2', '--operations', '20', '--users', '4', '--json',
+                     stdout=out)
+
+        result = json.loads(out.getvalue())
+        self.assertEqual(result['requests'], 20)
+        self.assertEqual(result['engine'], 'users.db.backends.sqlite_wal')
+
+
+class TestLeanJSONResponses(APITestCase):
+
+    def test_json_regardless_of_accept(self):
+        u = User.objects.create(username='testuser')
+        self.client.cookies = cookies.SimpleCookie({'access_token': AccessToken.for_user(u)})
+
+        response = self.client.get('/api/token/verify', HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.content, '{{"user_id":{}}}'.format(u.id).encode())
+
+        self.client.cookies = cookies.SimpleCookie()
+        response = self.client.get('/api/token/verify', HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+    def test_clear_static_body(self):
+        response = self.client.post('/api/token/clear', HTTP_ACCEPT='application/xml')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, b'{}')
+        self.assertEqual(response.cookies['access_token'].value, '')
+
+    def test_benchmark_rendering(self):
+        out = StringIO()
+        call_command('benchmark_rendering', '--iterations', '10', '--json', stdout=out)
+        results = json.loads(out.getvalue())
+        self.assertEqual([result['endpoint'] for result in results], ['token/verify', 'token/clear'])
+
+
+
+def b64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+class TestHMACVerifier(APITestCase):
+    secret = 'parity-secret'
+
+    def backends(self, algorithm='HS256', audience=None, issuer=None):
+        return (TokenBackend(algorithm, self.secret, audience=audience, issuer=issuer),
+                HMACTokenBackend(algorithm, self.secret, audience=audience, issuer=issuer))
+
+    def outcome(self, backend, token, verify):
+        try:
+            return backend.decode(token, verify=verify)
+        except TokenBackendError:
+            return 'invalid'
+        except Exception as e:
+            return type(e)
+
+    def assertParity(self, backends, tokens):
+        reference, fast = backends
+        for token in tokens:
+            for verify in (True, False):
+                with self.subTest(token=token, verify=verify):
+                    self.assertEqual(self.outcome(fast, token, verify), self.outcome(reference, token, verify))
+
+    def signed(self, header, payload, secret=None, algorithm='HS256'):
+        signing_input = '{}.{}'.format(b64url(header), b64url(payload))
+        signature = hmac.new((secret or self.secret).encode(), signing_input.encode(),
+                             HMAC_ALGORITHMS[algorithm]).digest()
+        return '{}.{}'.format(signing_input, b64url(signature))
+
+    def claim_tokens(self, algorithm='HS256'):
+        now = int(time.time())
+        payloads = [
+            {'user_id': 1, 'exp': now + 300},
+            {'user_id': 1, 'exp': now - 1},
+            {'user_id': 1, 'exp': now},
+            {'user_id': 1},
+            {'user_id': 1, 'exp': str(now + 300)},
+            {'user_id': 1, 'exp': 'soon'},
+            {'user_id': 1, 'exp': now + 300.9},
+            {'user_id': 1, 'nbf': now + 60},
+            {'user_id': 1, 'nbf': now - 60},
+            {'user_id': 1, 'nbf': 'later'},
+            {'user_id': 1, 'iat': 'yesterday'},
+            {'user_id': 1, 'iat': now},
+            {'user_id': 1, 'iss': 'issuer'},
+            {'user_id': 1, 'iss': 'other'},
+            {'user_id': 1, 'aud': 'audience'},
+            {'user_id': 1, 'aud': ['other', 'audience']},
+            {'user_id': 1, 'aud': ['other']},
+            {'user_id': 1, 'aud': [1]},
+            {'user_id': 1, 'aud': {'audience': 1}},
+        ]
+        return [jwt.encode(payload, self.secret, algorithm=algorithm).decode() for payload in payloads]
+
+    def test_claims(self):
+        tokens = self.claim_tokens()
+        self.assertParity(self.backends(), tokens)
+        self.assertParity(self.backends(audience='audience'), tokens)
+        self.assertParity(self.backends(audience=['audience', 'second']), tokens)
+        self.assertParity(self.backends(issuer='issuer'), tokens)
+
+    def test_algorithms(self):
+        for algorithm in ('HS384', 'HS512'):
+            self.assertParity(self.backends(algorithm), self.claim_tokens(algorithm))
+
+        payload = {'user_id': 1}
+        self.assertParity(self.backends(), [
+            jwt.encode(payload, self.secret, algorithm='HS512').decode(),
+            jwt.encode(payload, None, algorithm='none').decode(),
+            jwt.encode(payload, 'other-secret', algorithm='HS256').decode(),
+            self.signed(b'{"alg":"HS256"}', b'{"user_id":1}'),
+            self.signed(b'{"typ":"JWT"}', b'{"user_id":1}'),
+            self.signed(b'{"alg":"hs256"}', b'{"user_id":1}'),
+        ])
+
+    def test_malformed(self):
+        token = jwt.encode({'user_id': 1}, self.secret, algorithm='HS256').decode()
+        header, payload, signature = token.split('.')
+        self.assertParity(self.backends(), [
+            '', '.', '..', 'abc', header, header + '.' + payload,
+            token + '.', token + '.extra', '.'.join([header, payload + '.' + payload, signature]),
+            '.'.join([header, payload, signature[:-1]]),
+            '.'.join([header, payload, signature[:-2] + 'AA']),
+            '.'.join([header, payload[:-1], signature]),
+            '.'.join([header + '!', payload, signature]),
+            '.'.join([header, payload, signature + '=']),
+            token.replace('.', 'é.', 1),
+            token.encode(), None, 42,
+            self.signed(b'not json', b'{"user_id":1}'),
+            self.signed(b'["alg","HS256"]', b'{"user_id":1}'),
+            self.signed(b'{"alg":"HS256"}', b'not json'),
+            self.signed(b'{"alg":"HS256"}', b'[1, 2]'),
+            self.signed(b'{"alg":"HS256"}', b'\xff\xfe'),
+            self.signed(b'{"alg":"HS256"}', b''),
+        ])
+
+    def test_installed_backend(self):
+        self.assertIsInstance(state.token_backend, HMACTokenBackend)
+
+        u = User.objects.create(username='testuser')
+        self.client.cookies = cookies.SimpleCookie({'access_token': AccessToken.for_user(u)})
+        response = self.client.get('/api/token/verify')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with override_settings(COOKIE_JWT={'HMAC_VERIFIER_ENABLED': False}):
+            self.assertIs(type(state.token_backend), TokenBackend)
+
+    def test_benchmark_verification(self):
+        out = StringIO()
+        call_command('benchmark_verification', '--iterations', '10', '--json', stdout=out)
+        results = json.loads(out.getvalue())
+        self.assertEqual([result['operation'] for result in results], ['decode', 'access_token'])
+
+
+class TestRefreshCoalescing(APITestCase):
+
+    def setUp(self):
+        reset_refresh_flights()
+        self.user = User.objects.create(username='testuser')
+
+    def refresh(self, token):
+        self.client.cookies = cookies.SimpleCookie({'refresh_token': token})
+        return self.client.post('/api/token/refresh')
+
+    def test_near_simultaneous_refreshes_share_tokens(self):
+        token = str(RefreshToken.for_user(self.user))
+        followers = REFRESH_COALESCED_TOTAL.get(role='follower')
+
+        first = self.refresh(token)
+        second = self.refresh(token)
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.cookies['access_token'].value, first.cookies['access_token'].value)
+        self.assertEqual(second.cookies['refresh_token'].value, first.cookies['refresh_token'].value)
+        self.assertEqual(REFRESH_COALESCED_TOTAL.get(role='follower'), followers + 1)
+
+        # the rotated token is refreshed on its own
+        third = self.refresh(first.cookies['refresh_token'].value)
+        self.assertEqual(third.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(third.cookies['refresh_token'].value, first.cookies['refresh_token'].value)
+
+    @override_settings(COOKIE_JWT={'REFRESH_COALESCE_WINDOW': 0})
+    def test_disabled(self):
+        token = str(RefreshToken.for_user(self.user))
+
+        self.assertEqual(self.refresh(token).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.refresh(token).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_concurrent_callers_wait_for_leader(self):
+        flights = SingleFlight(window=60)
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def mint():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return {'access': 'minted'}
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flights.run('token', mint)))
+        leader.start()
+        started.wait()
+        followers = [threading.Thread(target=lambda: results.append(flights.run('token', mint))) for _ in range(4)]
+        for thread in followers:
+            thread.start()
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(leader for _, leader in results), [False] * 4 + [True])
+        self.assertTrue(all(result == {'access': 'minted'} for result, _ in results))
+
+    def test_window_and_failures(self):
+        flights = SingleFlight(window=0.05)
+        calls = []
+
+        def mint():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(flights.run('token', mint), (1, True))
+        self.assertEqual(flights.run('token', mint), (1, False))
+        time.sleep(0.06)
+        self.assertEqual(flights.run('token', mint), (2, True))
+
+        def fail():
+            raise TokenError('Token is invalid or expired')
+
+        self.assertRaises(TokenError, flights.run, 'other', fail)
+        self.assertEqual(flights.run('other', mint), (3, True))
+
+    def test_bounded(self):
+        flights = SingleFlight(window=60, max_size=3)
+        for i in range(10):
+            flights.run(str(i), lambda: i)
+        self.assertEqual(len(flights), 3)
+        self.assertEqual(flights.run('9', lambda: None), (9, False))
+
+
+
+class TestCookieAuthenticationMiddleware(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='testuser')
+        self.factory = RequestFactory()
+
+    def request(self, **cookie_values):
+        cookie_header = '; '.join('{}={}'.format(name, value) for name, value in cookie_values.items())
+        return self.factory.get('/api/token/verify', HTTP_COOKIE=cookie_header)
+
+    def test_get_cookie_matches_request_cookies(self):
+        headers = [
+            '', 'access_token=abc', 'a=1; access_token=abc; b=2', 'xaccess_token=1; access_token_old=2',
+            'access_token=1; access_token=2', ' access_token = "a\\"b" ;', 'access_token', 'access_token=',
+            '=access_token; access_token=a=b', 'a=1;;access_token=x;', 'access_token=é',
+        ]
+        for header in headers:
+            with self.subTest(header=header):
+                expected = self.factory.get('/', HTTP_COOKIE=header).COOKIES.get('access_token')
+                self.assertEqual(get_cookie(self.factory.get('/', HTTP_COOKIE=header), 'access_token'), expected)
+
+    def test_cookies_not_parsed(self):
+        request = self.request(access_token=AccessToken.for_user(self.user), other='x')
+        CookieAuthenticationMiddleware(lambda request: HttpResponse())(request)
+
+        self.assertEqual(request.user.id, self.user.id)
+        self.assertNotIn('COOKIES', request.__dict__)
+
+    def test_plain_views_fall_back(self):
+        request = self.request(access_token='garbage')
+        request.user = AnonymousUser()
+        CookieAuthenticationMiddleware(lambda request: HttpResponse())(request)
+        self.assertEqual(request.user, AnonymousUser())
+
+        request = self.request()
+        CookieAuthenticationMiddleware(lambda request: HttpResponse())(request)
+        self.assertFalse(request.user.is_authenticated)
+
+    def test_session_user_kept(self):
+        session_user = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+        request = self.request(access_token=AccessToken.for_user(self.user))
+        request.user = session_user
+        CookieAuthenticationMiddleware(lambda request: HttpResponse())(request)
+        self.assertEqual(request.user.id, session_user.id)
+
+    def test_token_never_opens_admin(self):
+        self.user.is_staff = self.user.is_superuser = True
+        self.user.save()
+        access = AccessToken.for_user(self.user)
+        access['is_staff'] = access['is_superuser'] = True
+
+        self.client.cookies = cookies.SimpleCookie({'access_token': str(access)})
+        response = self.client.get('/admin/')
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertIn('/admin/login/', response['Location'])
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/admin/').status_code, status.HTTP_200_OK)
+
+    def test_validated_once(self):
+        def get_response(request):
+            self.assertTrue(request.user.is_authenticated)
+            return CookieTokenVerify.as_view()(request)
+
+        request = self.request(access_token=AccessToken.for_user(self.user))
+        with mock.patch.object(CookieAccessTokenAuthentication, 'authenticate_token',
+                               autospec=True, side_effect=CookieAccessTokenAuthentication.authenticate_token) as calls:
+            response = CookieAuthenticationMiddleware(get_response)(request)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(calls.call_count, 1)
+
+    def test_failures_validated_once(self):
+        failures = AUTHENTICATION_TOTAL.get(cookie='access_token', outcome='malformed')
+
+        def get_response(request):
+            self.assertFalse(request.user.is_authenticated)
+            return CookieTokenVerify.as_view()(request)
+
+        response = CookieAuthenticationMiddleware(get_response)(self.request(access_token='garbage'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(AUTHENTICATION_TOTAL.get(cookie='access_token', outcome='malformed'), failures + 1)
+
+    def test_sliding_renewal_replaces_user(self):
+        access = AccessToken.for_user(self.user)
+        access.set_exp(lifetime=datetime.timedelta(seconds=-30))
+        view = CookieTokenVerify.as_view()
+
+        def get_response(request):
+            self.assertFalse(request.user.is_authenticated)
+            SlidingAccessTokenMiddleware(None).process_view(request, view, (), {})
+            self.assertEqual(request.user.id, self.user.id)
+            return view(request)
+
+        request = self.request(access_token=access, refresh_token=RefreshToken.for_user(self.user))
+        response = CookieAuthenticationMiddleware(get_response)(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+@override_settings(COOKIE_JWT={'USER_CLAIMS': ['groups', 'permissions', 'is_staff'],
+                               'CLAIMS_CACHE_OPTIONS': {'max_size': 10000, 'ttl': 300}})
+class TestUserClaims(APITestCase):
+
+    def setUp(self):
+        reset_claims_cache()
+        self.user = User(username='testuser', email='test@test.com')
+        self.user.set_password('testpassword')
+        self.user.save()
+        self.group = Group.objects.create(name='editors')
+        self.group.permissions.add(Permission.objects.get(codename='change_user'))
+        self.user.groups.add(self.group)
+        self.user.user_permissions.add(Permission.objects.get(codename='view_group'))
+
+    def login(self):
+        response = self.client.post('/api/token', json.dumps({
+            'username': 'testuser',
+            'password': 'testpassword',
+            'remember': False
+        }), content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def refresh(self, response):
+        self.client.cookies = cookies.SimpleCookie({'refresh_token': response.cookies['refresh_token'].value})
+        # every refresh mints new claims, do not share results between them
+        reset_refresh_flights()
+        return self.client.post('/api/token/refresh')
+
+    def access_claims(self, response):
+        return AccessToken(response.cookies['access_token'].value).payload
+
+    def test_token_user_not_staff(self):
+        token = AccessToken.for_user(self.user)
+        token['is_staff'] = token['is_superuser'] = True
+        user = CookieAccessTokenAuthentication().get_user(token)
+        self.assertFalse(user.is_staff)
+        self.assertFalse(user.is_superuser)
+        self.assertFalse(user.has_perm('users.delete_user'))
+
+    def test_login_and_refresh_claims(self):
+        response = self.login()
+        claims = self.access_claims(response)
+        self.assertEqual(claims['groups'], ['editors'])
+        self.assertEqual(claims['permissions'], ['auth.view_group', 'users.change_user'])
+        self.assertIs(claims['is_staff'], False)
+        self.assertNotIn('groups', RefreshToken(response.cookies['refresh_token'].value).payload)
+
+        with self.assertNumQueries(0):
+            response = self.refresh(response)
+        self.assertEqual(self.access_claims(response)['groups'], ['editors'])
+
+    def test_token_user_permissions(self):
+        response = self.login()
+        user = CookieAccessTokenAuthentication().get_user(AccessToken(response.cookies['access_token'].value))
+        self.assertTrue(user.has_perm('users.change_user'))
+        self.assertFalse(user.has_perm('users.delete_user'))
+        self.assertTrue(user.has_module_perms('auth'))
+        self.assertEqual(user.group_names, ['editors'])
+
+    def test_invalidation(self):
+        response = self.login()
+
+        other = Group.objects.create(name='admins')
+        self.user.groups.add(other)
+        response = self.refresh(response)
+        self.assertEqual(self.access_claims(response)['groups'], ['admins', 'editors'])
+
+        other.permissions.add(Permission.objects.get(codename='delete_user'))
+        response = self.refresh(response)
+        self.assertIn('users.delete_user', self.access_claims(response)['permissions'])
+
+        other.user_set.remove(self.user)
+        response = self.refresh(response)
+        self.assertEqual(self.access_claims(response)['groups'], ['editors'])
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.refresh(response)
+        self.assertIs(self.access_claims(response)['is_staff'], True)
+
+    def test_last_login_keeps_cache(self):
+        get_user_claims(self.user.id)
+        self.user.save(update_fields=['last_login'])
+        self.assertEqual(len(get_claims_cache()), 1)
+        self.user.save(update_fields=['is_staff'])
+        self.assertEqual(len(get_claims_cache()), 0)
+
+    def test_build_queries(self):
+        with self.assertNumQueries(2):
+            claims = build_user_claims(self.user.id, ['groups', 'permissions', 'is_staff', 'email'])
+        self.assertEqual(claims['email'], 'test@test.com')
+        self.assertIsNone(build_user_claims(self.user.id + 1, ['groups']))
+
+    @override_settings(COOKIE_JWT={'USER_CLAIMS': ['groups', 'user_id']})
+    def test_reserved_claims(self):
+        self.assertRaises(ImproperlyConfigured, add_user_claims, AccessToken.for_user(self.user))
+
+    @override_settings(COOKIE_JWT={'USER_CLAIMS': []})
+    def test_disabled(self):
+        self.assertNotIn('groups', self.access_claims(self.login()))
+
+    def test_cache_backed(self):
+        cache = CacheClaimsCache(prefix='test:claims')
+        cache.set(1, {'groups': ['editors']})
+        self.assertEqual(cache.get(1), {'groups': ['editors']})
+        cache.invalidate(1)
+        self.assertIsNone(cache.get(1))
+
+        cache.set(1, {'groups': ['editors']})
+        cache.clear()
+        self.assertIsNone(cache.get(1))
+
+
+class TestPasswordHashers(APITestCase):
+
+    def setUp(self):
+        self.user = User(username='testuser', email='test@test.com')
+        self.user.set_password('testpassword')
+        self.user.save()
+
+    def login(self):
+        return self.client.post('/api/token', json.dumps({
+            'username': 'testuser',
+            'password': 'testpassword',
+            'remember': False
+        }), content_type="application/json")
+
+    @override_settings(COOKIE_JWT={'PASSWORD_HASHER_PARAMS': {'scrypt': {'work_factor': 1024}}})
+    def test_scrypt(self):
+        hasher = ScryptPasswordHasher()
+        encoded = hasher.encode('testpassword', 'seasalt')
+        self.assertTrue(encoded.startswith('scrypt$1024$seasalt$8$1$'))
+        self.assertTrue(hasher.verify('testpassword', encoded))
+        self.assertFalse(hasher.verify('wrongpassword', encoded))
+        self.assertTrue(check_password('testpassword', encoded))
+        self.assertFalse(hasher.must_update(encoded))
+        self.assertTrue(hasher.must_update(hasher.encode('testpassword', 'seasalt', n=2048)))
+
+    @override_settings(COOKIE_JWT={'METRICS_ENABLED': True,
+                                   'PASSWORD_HASHER_PARAMS': {'pbkdf2_sha256': {'iterations': 1000}}})
+    def test_rehash_on_login(self):
+        rehashed = PASSWORD_REHASH_TOTAL.get(algorithm='pbkdf2_sha256')
+        self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$1000$'))
+        self.assertEqual(PASSWORD_REHASH_TOTAL.get(algorithm='pbkdf2_sha256'), rehashed + 1)
+
+        self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+        self.assertEqual(PASSWORD_REHASH_TOTAL.get(algorithm='pbkdf2_sha256'), rehashed + 1)
+
+    @override_settings(PASSWORD_HASHERS=['users.hashers.ScryptPasswordHasher', 'users.hashers.PBKDF2PasswordHasher'],
+                       COOKIE_JWT={'PASSWORD_HASHER_PARAMS': {'scrypt': {'work_factor': 1024}}})
+    def test_migrate_algorithm(self):
+        self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('scrypt$1024$'))
+
+    def test_tune_pbkdf2(self):
+        result = tune_pbkdf2(0.002, samples=1, probe_iterations=1000)
+        self.assertEqual(result['algorithm'], 'pbkdf2_sha256')
+        self.assertGreaterEqual(result['params']['iterations'], 1000)
+        self.assertEqual(result['params']['iterations'] % 1000, 0)
+
+    def test_cost_floor(self):
+        result = apply_cost_floor(tune_pbkdf2(0.002, samples=1, probe_iterations=1000), samples=1)
+        self.assertEqual(result['params'], {'iterations': COST_FLOORS['pbkdf2_sha256']['iterations']})
+        self.assertLess(result['below_floor']['iterations'], COST_FLOORS['pbkdf2_sha256']['iterations'])
+
+        result = apply_cost_floor(tuning_result('scrypt', ScryptPasswordHasher, {
+            'work_factor': 2 ** 10, 'block_size': 8, 'parallelism': 1}, 0.001, 2 ** 20), samples=1)
+        self.assertEqual(result['params']['work_factor'], 2 ** 14)
+        self.assertEqual(result['memory_bytes'], 16 * 2 ** 20)
+
+        strong = tuning_result('scrypt', ScryptPasswordHasher, {'work_factor': 2 ** 15}, 0.1)
+        self.assertIs(apply_cost_floor(strong), strong)
+
+    def test_recommended_config(self):
+        results = [{'algorithm': 'scrypt', 'hasher': 'users.hashers.ScryptPasswordHasher',
+                    'params': {'work_factor': 4096}}]
+        config = recommended_config(results, ['users.hashers.PBKDF2PasswordHasher',
+                                              'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+                                              'users.hashers.ScryptPasswordHasher'])
+        self.assertEqual(config, {
+            'PASSWORD_HASHERS': ['users.hashers.ScryptPasswordHasher', 'users.hashers.PBKDF2PasswordHasher'],
+            'PASSWORD_HASHER_PARAMS': {'scrypt': {'work_factor': 4096}},
+        })
+
+    def test_tune_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'password_hashers.json')
+            out = StringIO()
+            err = StringIO()
+            call_command('tune_password_hashers', '--target-ms', '2', '--samples', '1', '--algorithms',
+                         'pbkdf2_sha256', '--write', path, '--json', stdout=out, stderr=err)
+            self.assertIn('below Django\'s default cost', err.getvalue())
+            report = json.loads(out.getvalue())
+            with open(path) as f:
+                self.assertEqual(json.load(f), report['config'])
+        self.assertEqual(report['config']['PASSWORD_HASHERS'][0], 'users.hashers.PBKDF2PasswordHasher')
+        self.assertGreaterEqual(report['config']['PASSWORD_HASHER_PARAMS']['pbkdf2_sha256']['iterations'],
+                                COST_FLOORS['pbkdf2_sha256']['iterations'])
+
+    def test_status(self):
+        User.objects.create_user('nopassword')
+        User.objects.create_user('outdated', password='x')
+        User.objects.filter(username='outdated').update(password=make_password('x', hasher='pbkdf2_sha1'))
+
+        status_ = HashStatus()
+        status_.add('invalid$hash')
+        self.assertEqual(status_.unknown, 1)
+
+        out = StringIO()
+        call_command('password_hash_status', '--chunk-size', '2', '--json', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual((report['total'], report['current'], report['outdated'], report['unusable']), (3, 1, 1, 1))
+        self.assertEqual(report['migrated_percent'], 50.0)
+        self.assertEqual(report['hashes']['pbkdf2_sha1 iterations=216000'], 1)
@@ -0,0 +1,207 @@
+import hashlib
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test.signals import setting_changed
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+
+from users.settings import USER_SETTINGS, cookie_settings
+
+
+class InMemoryTokenBucketLimiter:
+    """
+    Token buckets held in process memory. Keys are spread over `shards`
+    dicts, each with its own lock, so concurrent logins rarely contend.
+    Each shard keeps its keys in least recently used order and drops the
+    oldest one once it holds `max_keys_per_shard`, so memory and the cost of
+    an attempt stay bounded however many distinct keys are seen.
+    """
+
+    def __init__(self, burst, refill_rate, shards=64, max_keys_per_shard=10000):
+        self.burst = float(burst)
+        self.refill_rate = float(refill_rate)
+        self.max_keys_per_shard = max_keys_per_shard
+        self._shards = [(OrderedDict(), threading.Lock()) for _ in range(shards)]
+
+    def _shard(self, key):
+        return self._shards[zlib.crc32(key.encode('utf-8')) % len(self._shards)]
+
+    def _refill(self, bucket, now):
+        tokens, updated_at = bucket
+        return min(self.burst, tokens + (now - updated_at) * self.refill_rate)
+
+    def consume(self, key, now=None):
+        """
+        Takes one token from the bucket of `key`. Returns None when allowed,
+        otherwise the number of seconds until a token is available.
+        `refill_rate` is in tokens per second and must be positive.
+        """
+        now = time.monotonic() if now is None else now
+        buckets, lock = self._shard(key)
+
+        with lock:
+            bucket = buckets.get(key)
+            tokens = self.burst if bucket is None else self._refill(bucket, now)
+            if tokens < 1:
+                # a key still being refused is the last one to forget
+                buckets.move_to_end(key)
+                return (1 - tokens) / self.refill_rate
+
+            buckets[key] = (tokens - 1, now)
+            buckets.move_to_end(key)
+            while len(buckets) > self.max_keys_per_shard:
+                buckets.popitem(last=False)
+            return None
+
+    def refund(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        buckets, lock = self._shard(key)
+
+        with lock:
+            bucket = buckets.get(key)
+            if bucket is not None:
+                buckets[key] = (min(self.burst, self._refill(bucket, now) + 1), now)
+
+
+class CacheTokenBucketLimiter(InMemoryTokenBucketLimiter):
+    """
+    Buckets kept in a Django cache shared by all workers. Updates are a plain
+    read-modify-write, so concurrent workers may admit a few extra attempts,
+    which is fine for throttling. Keys are hashed, usernames may hold
+    characters or lengths that memcached does not accept.
+    """
+
+    def __init__(self, burst, refill_rate, alias='default', prefix='cookiejwt:throttle', **kwargs):
+        super().__init__(burst, refill_rate)
+        self.cache = caches[alias]
+        self.prefix = prefix
+
+    def _cache_key(self, key):
+        return '{}:{}'.format(self.prefix, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+    def _timeout(self):
+        return int(self.burst / self.refill_rate) + 1
+
+    def consume(self, key, now=None):
+        now = time.time() if now is None else now
+        cache_key = self._cache_key(key)
+
+        bucket = self.cache.get(cache_key)
+        tokens = self.burst if bucket is None else self._refill(bucket, now)
+        if tokens < 1:
+            return (1 - tokens) / self.refill_rate
+
+        self.cache.set(cache_key, (tokens - 1, now), self._timeout())
+        return None
+
+    def refund(self, key, now=None):
+        now = time.time() if now is None else now
+        cache_key = self._cache_key(key)
+
+        bucket = self.cache.get(cache_key)
+        if bucket is not None:
+            self.cache.set(cache_key, (min(self.burst, self._refill(bucket, now) + 1), now), self._timeout())
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_login_limiter(scope):
+    """
+    Returns the limiter of the 'username' or 'ip' scope, None when that
+    scope is not throttled.
+    """
+    config = cookie_settings.LOGIN_THROTTLE_RATES.get(scope)
+    if config is None:
+        return None
+
+    limiter = _limiters.get(scope)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(scope)
+            if limiter is None:
+                burst, refill_rate = config
+                limiter_class = import_string(cookie_settings.LOGIN_THROTTLE_BACKEND)
+                limiter = _limiters[scope] = limiter_class(burst, refill_rate,
+                                                           **cookie_settings.LOGIN_THROTTLE_OPTIONS)
+    return limiter
+
+
+def reset_login_limiters(*args, **kwargs):
+    if kwargs.get('setting', USER_SETTINGS) == USER_SETTINGS:
+        _limiters.clear()
+
+
+setting_changed.connect(reset_login_limiters)
+
+
+class LoginRateThrottle(BaseThrottle):
+    """
+    Budget of login attempts per client IP and per username, checked before
+    any password hashing or database work. Successful logins give their token
+    back, so only failed attempts drain the buckets.
+    """
+
+    def __init__(self):
+        self.retry_after = None
+
+    def allow_request(self, request, view):
+        username = None
+        try:
+            username = request.data.get(get_user_model().USERNAME_FIELD)
+        except AttributeError:
+            pass
+        return self.allow_login(request, username)
+
+    def get_ident(self, request):
+        """
+        The client address as seen by the last of LOGIN_THROTTLE_PROXIES
+        trusted reverse proxies, REMOTE_ADDR when there are none. Any further
+        X-Forwarded-For entries are chosen by the client and ignored.
+        """
+        remote_addr = request.META.get('REMOTE_ADDR', '')
+        num_proxies = cookie_settings.LOGIN_THROTTLE_PROXIES
+        forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+        if not num_proxies or not forwarded_for:
+            return remote_addr
+
+        addresses = [address.strip() for address in forwarded_for.split(',')]
+        return addresses[-min(num_proxies, len(addresses))]
+
+    def allow_login(self, request, username):
+        keys = [('ip', self.get_ident(request))]
+        if isinstance(username, str) and username:
+            keys.append(('username', username.lower()))
+
+        consumed = []
+        for scope, key in keys:
+            limiter = get_login_limiter(scope)
+            if limiter is None:
+                continue
+
+            key = '{}:{}'.format(scope, key)
+            retry_after = limiter.consume(key)
+            if retry_after is not None:
+                self.retry_after = retry_after
+                for consumed_limiter, consumed_key in consumed:
+                    consumed_limiter.refund(consumed_key)
+                return False
+            consumed.append((limiter, key))
+
+        request._login_throttle_consumed = consumed
+        return True
+
+    def wait(self):
+        return self.retry_after
+
+
+def refund_login_attempt(request):
+    for limiter, key in getattr(request, '_login_throttle_consumed', ()):
+        limiter.refund(key)
+    request._login_throttle_consumed = ()
@@ -0,0 +1,90 @@
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from users.settings import cookie_settings
+
+
+class CompactAccessToken(AccessToken):
+    """
+    Access token of the compact profile: one letter type value and no `jti`,
+    access tokens are short lived and never denylisted by id.
+    """
+    token_type = 'a'
+
+    def set_jti(self):
+        pass
+
+    def verify(self):
+        self.check_exp()
+        self.verify_token_type()
+
+
+class CompactRefreshToken(RefreshToken):
+    token_type = 'r'
+    access_token_class = CompactAccessToken
+
+    @property
+    def access_token(self):
+        access = self.access_token_class()
+        access.set_exp(from_time=self.current_time)
+
+        no_copy = self.no_copy_claims
+        for claim, value in self.payload.items():
+            if claim in no_copy:
+                continue
+            access[claim] = value
+
+        return access
+
+
+TOKEN_PROFILES = {
+    'default': (AccessToken, RefreshToken),
+    'compact': (CompactAccessToken, CompactRefreshToken),
+}
+
+
+def get_access_token_class():
+    return TOKEN_PROFILES[cookie_settings.TOKEN_PROFILE][0]
+
+
+def get_refresh_token_class():
+    return TOKEN_PROFILES[cookie_settings.TOKEN_PROFILE][1]
+
+
+def cookie_bytes(name, value):
+    # "; " separator plus "name=value" in the Cookie request header
+    return len(name) + 1 + len(value) + 2
+
+
+def token_profile_report(user, refresh_cookie_path='/'):
+    """
+    Mints the tokens a login of `user` would get under each profile, with the
+    claim names of SIMPLE_JWT, the generation claim and USER_CLAIMS, and
+    returns their sizes together with the Cookie header bytes every ordinary
+    request carries.
+    """
+    from users.claims import add_user_claims
+    from users.generations import add_generation_claim
+
+    report = {}
+    for name, (_, refresh_class) in TOKEN_PROFILES.items():
+        refresh_token = refresh_class.for_user(user)
+        add_generation_claim(refresh_token, user)
+        access_token = refresh_token.access_token
+        add_user_claims(access_token)
+        access, refresh = str(access_token), str(refresh_token)
+
+        cookie_path = refresh_cookie_path if name == 'compact' else '/'
+        per_request = cookie_bytes('access_token', access)
+        if cookie_path == '/':
+            per_request += cookie_bytes('refresh_token', refresh)
+
+        report[name] = {
+            'access_token_bytes': len(access),
+            'refresh_token_bytes': len(refresh),
+            'refresh_cookie_path': cookie_path,
+            'cookie_bytes_per_request': per_request,
+        }
+
+    report['saved_bytes_per_request'] = (report['default']['cookie_bytes_per_request'] -
+                                         report['compact']['cookie_bytes_per_request'])
+    return report
@@ -1,10 +1,16 @@
 from django.urls import path
 
-from users.views import CookieTokenVerify, CookieTokenObtainPair, CookieTokenRefresh, CookieTokenClear
+from users.views import (
+    CookieTokenVerify, CookieTokenObtainPair, CookieTokenRefresh, CookieTokenClear, CookieTokenRevoke,
+    CookieTokenIntrospect, CookieTokenJWKS,
+)
 
 urlpatterns = [
     path('token/verify', CookieTokenVerify.as_view(), name='token_verify'),
     path('token', CookieTokenObtainPair.as_view(), name='token_obtain'),
     path('token/refresh', CookieTokenRefresh.as_view(), name='token_refresh'),
-    path('token/clear', CookieTokenClear.as_view(), name='token_clear')
+    path('token/clear', CookieTokenClear.as_view(), name='token_clear'),
+    path('token/revoke', CookieTokenRevoke.as_view(), name='token_revoke'),
+    path('token/introspect', CookieTokenIntrospect.as_view(), name='token_introspect'),
+    path('token/jwks', CookieTokenJWKS.as_view(), name='token_jwks')
 ]
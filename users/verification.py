@@ -0,0 +1,113 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+from django.utils.translation import gettext_lazy as _
+from jwt.algorithms import HMACAlgorithm
+from rest_framework_simplejwt.backends import TokenBackend
+from rest_framework_simplejwt.exceptions import TokenBackendError
+
+HMAC_ALGORITHMS = {
+    'HS256': hashlib.sha256,
+    'HS384': hashlib.sha384,
+    'HS512': hashlib.sha512,
+}
+
+
+def b64url_decode(segment):
+    return base64.urlsafe_b64decode(segment + b'=' * (-len(segment) % 4))
+
+
+class HMACTokenBackend(TokenBackend):
+    """
+    Token backend verifying HMAC signed tokens without PyJWT. The keyed hash
+    state is computed once and copied for every token, each segment is decoded
+    once and the registered claims are checked inline. It accepts and rejects
+    the same tokens as PyJWT 1.7 called by simplejwt's TokenBackend, encoding
+    is still done by PyJWT.
+    """
+
+    def __init__(self, algorithm, signing_key, audience=None, issuer=None):
+        super().__init__(algorithm, signing_key, audience=audience, issuer=issuer)
+        digestmod = HMAC_ALGORITHMS[algorithm]
+        # refuses PEM encoded public keys as secrets, like PyJWT
+        key = HMACAlgorithm(digestmod).prepare_key(signing_key)
+        self._mac = hmac.new(key, digestmod=digestmod)
+        self._audiences = [audience] if isinstance(audience, str) else audience
+
+    @classmethod
+    def supports(cls, backend):
+        return type(backend) is TokenBackend and backend.algorithm in HMAC_ALGORITHMS
+
+    @classmethod
+    def from_backend(cls, backend):
+        return cls(backend.algorithm, backend.signing_key, backend.audience, backend.issuer)
+
+    def decode(self, token, verify=True):
+        # every way PyJWT rejects a token surfaces as a ValueError here
+        try:
+            return self._decode(token, verify)
+        except ValueError:
+            raise TokenBackendError(_('Token is invalid or expired'))
+
+    def _decode(self, token, verify):
+        if isinstance(token, str):
+            token = token.encode('utf-8')
+        elif not isinstance(token, bytes):
+            raise ValueError('Invalid token type')
+
+        signing_input, signature_segment = token.rsplit(b'.', 1)
+        header_segment, payload_segment = signing_input.split(b'.', 1)
+
+        header = json.loads(b64url_decode(header_segment).decode('utf-8'))
+        if not isinstance(header, dict):
+            raise ValueError('Invalid header string')
+        payload = b64url_decode(payload_segment)
+        signature = b64url_decode(signature_segment)
+
+        if verify:
+            if header.get('alg') != self.algorithm:
+                raise ValueError('The specified alg value is not allowed')
+
+            mac = self._mac.copy()
+            mac.update(signing_input)
+            if not hmac.compare_digest(signature, mac.digest()):
+                raise ValueError('Signature verification failed')
+
+        payload = json.loads(payload.decode('utf-8'))
+        if not isinstance(payload, dict):
+            raise ValueError('Invalid payload string')
+
+        if verify:
+            self.check_claims(payload, int(time.time()))
+        return payload
+
+    def check_claims(self, payload, now):
+        """
+        The claim checks of PyJWT with simplejwt's options and no leeway.
+        """
+        if 'iat' in payload:
+            int(payload['iat'])
+
+        if 'nbf' in payload and int(payload['nbf']) > now:
+            raise ValueError('The token is not yet valid (nbf)')
+
+        if 'exp' in payload and int(payload['exp']) < now:
+            raise ValueError('Signature has expired')
+
+        if self.issuer is not None and ('iss' not in payload or payload['iss'] != self.issuer):
+            raise ValueError('Invalid issuer')
+
+        if self.audience is not None:
+            if 'aud' not in payload:
+                raise ValueError('Invalid audience')
+
+            claims = payload['aud']
+            if isinstance(claims, str):
+                claims = [claims]
+            if not isinstance(claims, list) or any(not isinstance(claim, str) for claim in claims):
+                raise ValueError('Invalid claim format in token')
+            if not any(audience in claims for audience in self._audiences):
+                raise ValueError('Invalid audience')
@@ -1,29 +1,96 @@
-import datetime
-
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse
+from django.utils.cache import patch_cache_control
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
-from rest_framework_simplejwt.serializers import TokenRefreshSerializer
-from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.views import TokenViewBase
 
-from users.serializers import TokenDetailPairObtainSerializer
-
-
-class CookieTokenVerify(APIView):
+from users.authentication import IntrospectionClientAuthentication
+from users.cookies import (
+    access_expiration, delete_token_cookies, refresh_expiration, set_access_cookie, set_refresh_cookie,
+)
+from users.generations import revoke_user_tokens
+from users.hashing import HashingPoolFull
+from users.introspection import introspect_tokens
+from users.keyring import get_keyring
+from users.metrics import (
+    COOKIE_SERIALIZATION_SECONDS, InstrumentedViewMixin, metrics_client_allowed, registry, timer
+)
+from users.renderers import EMPTY_JSON_BODY, LeanJSONMixin, json_body
+from users.serializers import (
+    CookieTokenRefreshSerializer, TokenDetailPairObtainSerializer, TokenIntrospectionSerializer,
+)
+from users.settings import cookie_settings
+from users.throttling import LoginRateThrottle, refund_login_attempt
+
+
+def set_obtain_pair_cookies(response, serializer_data):
+    access_expires = access_expiration()
+    refresh_expires = refresh_expiration()
+    session_cookie = not serializer_data['remember']
+
+    # append access token
+    set_access_cookie(response, serializer_data['access'],
+                      expires=None if session_cookie else access_expires)
+
+    # append refresh token
+    set_refresh_cookie(response, serializer_data['refresh'],
+                       expires=None if session_cookie else refresh_expires)
+
+    return {
+        'user_id': serializer_data['user_id'],
+        'refresh_expire': int(refresh_expires.timestamp()),
+        'access_expire': int(access_expires.timestamp())
+    }
+
+
+def jwks_response():
+    keyring = get_keyring()
+    response = HttpResponse(keyring.jwks_json if keyring is not None else b'{"keys": []}',
+                            content_type='application/json')
+    patch_cache_control(response, public=True, max_age=cookie_settings.JWKS_MAX_AGE)
+    return response
+
+
+def set_refresh_cookies(response, serializer_data):
+    access_expires = access_expiration()
+
+    response_data = {
+        'access_expire': int(access_expires.timestamp())
+    }
+
+    # append access token
+    set_access_cookie(response, serializer_data['access'], expires=access_expires)
+
+    # append rotated refresh token, a session cookie unless the login asked to be remembered
+    if 'refresh' in serializer_data:
+        refresh_expires = refresh_expiration()
+        set_refresh_cookie(response, serializer_data['refresh'],
+                           expires=refresh_expires if serializer_data.get('remember') else None)
+        response_data['refresh_expire'] = int(refresh_expires.timestamp())
+
+    return response_data
+
+
+class CookieTokenVerify(InstrumentedViewMixin, LeanJSONMixin, APIView):
+    metrics_name = 'verify'
     permission_classes = (IsAuthenticated,)
 
     def get(self, request, *args, **kwargs):
-        return Response({
+        return self.json_response({
             'user_id': self.request.user.id
-        }, status=status.HTTP_200_OK)
+        })
 
 
-class CookieTokenObtainPair(TokenViewBase):
+class CookieTokenObtainPair(InstrumentedViewMixin, LeanJSONMixin, TokenViewBase):
+    metrics_name = 'obtain'
+    sliding_renewal = False
     serializer_class = TokenDetailPairObtainSerializer
     permission_classes = ()
+    throttle_classes = (LoginRateThrottle,)
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -32,40 +99,22 @@ class CookieTokenObtainPair(TokenViewBase):
             serializer.is_valid(raise_exception=True)
         except TokenError as e:
             raise InvalidToken(e.args[0])
-
-        serializer_data = serializer.validated_data
-        access_expiration = (datetime.datetime.utcnow() +
-                             api_settings.ACCESS_TOKEN_LIFETIME)
-
-        refresh_expiration = (datetime.datetime.utcnow() +
-                              api_settings.REFRESH_TOKEN_LIFETIME)
-
-        response_data = {
-            'user_id': serializer_data['user_id'],
-            'refresh_expire': int(refresh_expiration.timestamp()),
-            'access_expire': int(access_expiration.timestamp())
-        }
-
-        response = Response(response_data, status=status.HTTP_200_OK)
-        session_cookie = not serializer_data['remember']
-
-        # append access token
-        response.set_cookie('access_token',
-                            serializer_data['access'],
-                            expires=None if session_cookie else access_expiration,
-                            httponly=True)
-
-        # append refresh token
-        response.set_cookie('refresh_token',
-                            serializer_data['refresh'],
-                            expires=None if session_cookie else refresh_expiration,
-                            httponly=True)
-
+        except HashingPoolFull:
+            # the password was never checked, the attempt must not count
+            refund_login_attempt(request)
+            raise
+        refund_login_attempt(request)
+
+        response = self.json_response(body=b'')
+        with timer(COOKIE_SERIALIZATION_SECONDS, view=self.metrics_name):
+            response.content = json_body(set_obtain_pair_cookies(response, serializer.validated_data))
         return response
 
 
-class CookieTokenRefresh(TokenViewBase):
-    serializer_class = TokenRefreshSerializer
+class CookieTokenRefresh(InstrumentedViewMixin, LeanJSONMixin, TokenViewBase):
+    metrics_name = 'refresh'
+    sliding_renewal = False
+    serializer_class = CookieTokenRefreshSerializer
     authentication_classes = ()
 
     def post(self, request, *args, **kwargs):
@@ -79,31 +128,65 @@ class CookieTokenRefresh(TokenViewBase):
         except TokenError as e:
             raise InvalidToken(e.args[0])
 
-        serializer_data = serializer.validated_data
-        access_expiration = (datetime.datetime.utcnow() +
-                             api_settings.ACCESS_TOKEN_LIFETIME)
-
-        response_data = {
-            'access_expire': int(access_expiration.timestamp())
-        }
+        response = self.json_response(body=b'')
+        with timer(COOKIE_SERIALIZATION_SECONDS, view=self.metrics_name):
+            response.content = json_body(set_refresh_cookies(response, serializer.validated_data))
+        return response
 
-        response = Response(response_data, status=status.HTTP_200_OK)
 
-        # append access token
-        response.set_cookie('access_token',
-                            serializer_data['access'],
-                            expires=access_expiration,
-                            httponly=True)
+class CookieTokenClear(InstrumentedViewMixin, LeanJSONMixin, APIView):
+    metrics_name = 'clear'
+    sliding_renewal = False
+    permission_classes = ()
+    authentication_classes = ()
 
+    def post(self, request, *args, **kwargs):
+        response = self.json_response(body=EMPTY_JSON_BODY)
+        with timer(COOKIE_SERIALIZATION_SECONDS, view=self.metrics_name):
+            delete_token_cookies(response)
         return response
 
 
-class CookieTokenClear(APIView):
-    permission_classes = ()
-    authentication_classes = ()
+class CookieTokenRevoke(APIView):
+    sliding_renewal = False
+    permission_classes = (IsAuthenticated,)
 
     def post(self, request, *args, **kwargs):
+        # log out every session of the user, not only this browser
+        revoke_user_tokens(request.user)
+
         response = Response({}, status=status.HTTP_200_OK)
-        response.delete_cookie('access_token')
-        response.delete_cookie('refresh_token')
+        delete_token_cookies(response)
         return response
+
+
+class CookieTokenIntrospect(APIView):
+    sliding_renewal = False
+    permission_classes = (IsAuthenticated,)
+    authentication_classes = (IntrospectionClientAuthentication,)
+
+    def post(self, request, *args, **kwargs):
+        serializer = TokenIntrospectionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        return Response({
+            'results': introspect_tokens(serializer.validated_data['tokens'],
+                                         serializer.validated_data['token_type'])
+        }, status=status.HTTP_200_OK)
+
+
+class CookieTokenJWKS(APIView):
+    sliding_renewal = False
+    permission_classes = ()
+    authentication_classes = ()
+
+    def get(self, request, *args, **kwargs):
+        return jwks_response()
+
+
+def metrics(request):
+    if not cookie_settings.METRICS_ENABLED:
+        raise Http404()
+    if not metrics_client_allowed(request):
+        raise PermissionDenied()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
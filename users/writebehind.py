@@ -0,0 +1,236 @@
+import atexit
+import logging
+import threading
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, OperationalError, connections, transaction
+from django.test.signals import setting_changed
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import Token
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from users.settings import USER_SETTINGS, cookie_settings
+
+logger = logging.getLogger(__name__)
+
+
+def blacklist_installed():
+    return apps.is_installed('rest_framework_simplejwt.token_blacklist')
+
+
+class WriteBehindBuffer:
+    """
+    Collects login side effects (`last_login` updates and OutstandingToken
+    rows) and writes them with one bulk query per kind, either once
+    `batch_size` entries are pending or every `flush_interval` seconds.
+    Flushing happens on a background thread, `flush()` may also be called
+    directly and runs on the calling thread. At most `max_pending` entries
+    are kept, the oldest are dropped while the database is unavailable.
+    """
+
+    def __init__(self, batch_size=100, flush_interval=1.0, max_pending=10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_logins = {}
+        self._outstanding_tokens = []
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='cookiejwt-write-behind', daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._last_logins) + len(self._outstanding_tokens)
+
+    def record_login(self, user):
+        now = timezone.now()
+        user.last_login = now
+        with self._lock:
+            # only the latest login of a user matters
+            self._last_logins.pop(user.pk, None)
+            self._last_logins[user.pk] = now
+            self._trim()
+        self._check_size()
+
+    def record_outstanding_token(self, token, user):
+        from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+
+        outstanding = OutstandingToken(
+            user=user,
+            jti=token[api_settings.JTI_CLAIM],
+            token=str(token),
+            created_at=token.current_time,
+            expires_at=datetime_from_epoch(token['exp']),
+        )
+        with self._lock:
+            self._outstanding_tokens.append(outstanding)
+            self._trim()
+        self._check_size()
+
+    def _trim(self):
+        dropped = 0
+        while len(self._last_logins) + len(self._outstanding_tokens) > self.max_pending:
+            # a lost last_login matters less than a token the blacklist app misses
+            if self._last_logins:
+                del self._last_logins[next(iter(self._last_logins))]
+            else:
+                self._outstanding_tokens.pop(0)
+            dropped += 1
+        if dropped:
+            logger.warning('Write-behind buffer full, dropped %d pending entries', dropped)
+
+    def _check_size(self):
+        if len(self) >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self):
+        """
+        Writes all pending entries, returns the number of rows written.
+        Entries of a write that failed with an OperationalError (e.g.
+        `database is locked`) are queued again for the next flush, those of
+        any other failure would fail again and are dropped. The error is
+        raised.
+        """
+        with self._flush_lock:
+            with self._lock:
+                last_logins, self._last_logins = self._last_logins, {}
+                outstanding_tokens, self._outstanding_tokens = self._outstanding_tokens, []
+
+            written = 0
+            try:
+                if outstanding_tokens:
+                    written += self._create_outstanding_tokens(outstanding_tokens)
+                    outstanding_tokens = []
+
+                if last_logins:
+                    UserModel = get_user_model()
+                    users = [UserModel(pk=pk, last_login=last_login) for pk, last_login in last_logins.items()]
+                    UserModel._default_manager.bulk_update(users, ['last_login'], batch_size=self.batch_size)
+                    written += len(users)
+            except OperationalError:
+                self._requeue(last_logins, outstanding_tokens)
+                raise
+            except Exception:
+                logger.error('Write-behind dropped %d entries', len(last_logins) + len(outstanding_tokens))
+                raise
+
+            return written
+
+    def _create_outstanding_tokens(self, outstanding_tokens):
+        from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+
+        try:
+            # bulk_create and bulk_update run in a transaction, a failed call
+            # writes none of its rows
+            OutstandingToken.objects.bulk_create(outstanding_tokens, batch_size=self.batch_size)
+            return len(outstanding_tokens)
+        except IntegrityError:
+            pass
+
+        # a single bad row, such as a token of a user deleted before the
+        # flush, must not keep the rest of the batch out
+        written = 0
+        for outstanding in outstanding_tokens:
+            try:
+                with transaction.atomic():
+                    outstanding.save(force_insert=True)
+                written += 1
+            except IntegrityError:
+                logger.warning('Write-behind dropped OutstandingToken %s', outstanding.jti)
+        return written
+
+    def _requeue(self, last_logins, outstanding_tokens):
+        with self._lock:
+            for pk, last_login in last_logins.items():
+                # a login recorded while the write failed is newer
+                self._last_logins.setdefault(pk, last_login)
+            self._outstanding_tokens[:0] = outstanding_tokens
+            self._trim()
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._stopped:
+                # close() runs the final flush on the calling thread
+                break
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Write-behind flush failed')
+            finally:
+                # connections are per thread, do not keep this one open between flushes
+                connections.close_all()
+
+    def close(self):
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+
+
+_write_behind = None
+_write_behind_lock = threading.Lock()
+
+
+def get_write_behind():
+    """
+    Returns the process wide write-behind buffer or None when login side
+    effects are written synchronously.
+    """
+    global _write_behind
+
+    if not cookie_settings.WRITE_BEHIND_ENABLED:
+        return None
+
+    if _write_behind is None:
+        with _write_behind_lock:
+            if _write_behind is None:
+                _write_behind = WriteBehindBuffer(cookie_settings.WRITE_BEHIND_BATCH_SIZE,
+                                                  cookie_settings.WRITE_BEHIND_FLUSH_INTERVAL,
+                                                  cookie_settings.WRITE_BEHIND_MAX_PENDING)
+    return _write_behind
+
+
+def refresh_token_for_user(token_class, user):
+    """
+    `token_class.for_user` which defers the OutstandingToken insert of the
+    blacklist app to the write-behind buffer when it is enabled.
+    """
+    buffer = get_write_behind()
+    if buffer is None or not blacklist_installed():
+        return token_class.for_user(user)
+
+    # Token.for_user skips BlacklistMixin.for_user and its single row insert
+    token = Token.for_user.__func__(token_class, user)
+    buffer.record_outstanding_token(token, user)
+    return token
+
+
+def record_login(user):
+    if not cookie_settings.UPDATE_LAST_LOGIN:
+        return
+
+    buffer = get_write_behind()
+    if buffer is None:
+        user.last_login = timezone.now()
+        user.save(update_fields=['last_login'])
+    else:
+        buffer.record_login(user)
+
+
+def close_write_behind(*args, **kwargs):
+    global _write_behind
+
+    if kwargs.get('setting', USER_SETTINGS) == USER_SETTINGS and _write_behind is not None:
+        _write_behind.close()
+        _write_behind = None
+
+
+setting_changed.connect(close_write_behind)
+atexit.register(close_write_behind)